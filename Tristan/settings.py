@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'core.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,9 +138,38 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 
+# Cache
+# Use a shared backend such as memcached when running more than one process,
+# so that invalidations reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Custom Settings
 PAGE_SIZE = 24  # Number of items a page should list
+DASHBOARD_CACHE_TIMEOUT = 300  # Seconds before the dashboard snapshot is recomputed regardless
+LIST_COUNT_CACHE_TIMEOUT = 60  # Seconds a filtered list's row count is reused for its pages
+QUERY_INSTRUMENTATION = DEBUG  # Record query counts and timings per URL name, see core.instrumentation
+AUTOCOMPLETE_LIMIT = 20  # Most rows an order form lookup returns, see core.autocomplete
+AUTOCOMPLETE_CACHE_TIMEOUT = 30  # Seconds a lookup's results are reused
+PAGE_CACHE_TIMEOUT = 300  # Seconds a rendered page is kept; edits move pages to new keys at once, see core.pagecache
+ORDER_CODE_PREFIXES = {}  # Shown before the codes of each order type, e.g. {'salesorder': 'SO-'}
 SITE_ID = 1
 BOOTSTRAP3 = {
     'required_css_class': 'required',
-}
\ No newline at end of file
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.instrumentation': {'handlers': ['console'], 'level': 'INFO' if DEBUG else 'WARNING'},
+    },
+}
@@ -2,12 +2,28 @@ from django.contrib import admin
 from .models import (
     Customer, SalesOrder, Inventory, ItemImage, SalesOrderItem,
     SalesOrderPayment, Supplier, SupplyOrder, SupplyOrderItem,
-    SupplyOrderPayment
+    SupplyOrderPayment, SalesOrderItemDelivery, SupplyOrderItemDelivery
 )
+from .search import search
 
 
-class CustomerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'contact_phone')
+class SearchAdminMixin(object):
+    """Search the changelist with ``core.search``, served by its indexes; order codes match exactly.
+
+    Results keep the ordering the changelist chose, by column header or the default,
+    rather than the search rank.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        ordering = queryset.query.order_by
+        results = search(queryset, search_term)
+        if ordering:
+            results = results.order_by(*ordering)
+        return results, False
+
+
+class CustomerAdmin(SearchAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'email', 'contact_phone', 'total_paid', 'total_due')
     search_fields = ('name', 'email', 'contact_phone')
 
 
@@ -15,28 +31,43 @@ class ItemImageInline(admin.StackedInline):
     model = ItemImage
 
 
-class InventoryAdmin(admin.ModelAdmin):
-    list_display = ('item_name', 'item_sku', 'has_stock')
+class InventoryAdmin(SearchAdminMixin, admin.ModelAdmin):
+    list_display = ('item_name', 'item_sku', 'quantity', 'has_stock')
     search_fields = ('item_name', 'item_sku')
     readonly_fields = ('has_stock',)
     inlines = (ItemImageInline, )
 
+    def get_queryset(self, request):
+        return super(InventoryAdmin, self).get_queryset(request).with_availability()
+
 
 class SalesOrderItemInline(admin.StackedInline):
     model = SalesOrderItem
+    raw_id_fields = ('item',)
+
 
 class SalesOrderPaymentInline(admin.StackedInline):
     model = SalesOrderPayment
 
 
-class SalesOrderAdmin(admin.ModelAdmin):
-    list_display = ('order_code', 'get_customer', 'get_item_count')
-    search_fields = ('order_code', 'get_customer', )
+class SalesOrderAdmin(SearchAdminMixin, admin.ModelAdmin):
+    list_display = (
+        'order_code', 'get_customer', 'get_item_count', 'order_value', 'amount_due', 'payment_status', 'order_status'
+    )
+    list_select_related = ('customer',)
+    list_filter = ('payment_status', 'order_status')
+    search_fields = ('order_code', )
+    raw_id_fields = ('customer',)
+    show_full_result_count = False
     inlines = (SalesOrderItemInline, SalesOrderPaymentInline)
 
+    def get_queryset(self, request):
+        return super(SalesOrderAdmin, self).get_queryset(request).with_totals().with_item_count()
+
     def get_item_count(self, inst):
-        return inst.salesorderitem_set.count()
+        return inst.item_count
     get_item_count.short_description = 'Number of Items'
+    get_item_count.admin_order_field = 'item_count'
 
     def get_customer(self, obj):
         return obj.customer.name
@@ -44,22 +75,79 @@ class SalesOrderAdmin(admin.ModelAdmin):
     get_customer.admin_order_field = 'customer__name'
 
 
-class SupplierOrderAdmin(admin.ModelAdmin):
-    list_display = ('order_code', 'get_supplier', 'get_item_count')
-    search_fields = ('order_code', 'get_supplier', )
-    inlines = (SalesOrderItemInline, SalesOrderPaymentInline)
+class SupplyOrderItemInline(admin.StackedInline):
+    model = SupplyOrderItem
+    raw_id_fields = ('item',)
+
+
+class SupplyOrderPaymentInline(admin.StackedInline):
+    model = SupplyOrderPayment
+
+
+class SupplyOrderAdmin(SearchAdminMixin, admin.ModelAdmin):
+    list_display = (
+        'order_code', 'get_supplier', 'get_item_count', 'order_value', 'amount_due', 'payment_status',
+        'order_status', 'is_draft'
+    )
+    list_select_related = ('supplier',)
+    list_filter = ('is_draft', 'payment_status', 'order_status')
+    search_fields = ('order_code', )
+    raw_id_fields = ('supplier',)
+    show_full_result_count = False
+    inlines = (SupplyOrderItemInline, SupplyOrderPaymentInline)
+
+    def get_queryset(self, request):
+        return super(SupplyOrderAdmin, self).get_queryset(request).with_totals().with_item_count()
 
     def get_item_count(self, inst):
-        return inst.salesorderitem_set.count()
+        return inst.item_count
     get_item_count.short_description = 'Number of Items'
+    get_item_count.admin_order_field = 'item_count'
 
     def get_supplier(self, obj):
-        return obj.customer.name
-    get_supplier.short_description = 'Customer'
-    get_supplier.admin_order_field = 'customer__name'
+        return obj.supplier.name
+    get_supplier.short_description = 'Supplier'
+    get_supplier.admin_order_field = 'supplier__name'
+
+
+class SalesOrderItemDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('get_order', 'get_item', 'quantity_delivered', 'delivery_date')
+    list_select_related = ('item__sales_order', 'item__item')
+    raw_id_fields = ('item',)
+    show_full_result_count = False
+
+    def get_order(self, obj):
+        return obj.item.sales_order.display_code
+    get_order.short_description = 'Order'
+    get_order.admin_order_field = 'item__sales_order__order_code'
+
+    def get_item(self, obj):
+        return obj.item.item.item_name
+    get_item.short_description = 'Item'
+    get_item.admin_order_field = 'item__item__item_name'
+
+
+class SupplyOrderItemDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('get_order', 'get_item', 'quantity_delivered', 'delivery_date')
+    list_select_related = ('item__supply_order', 'item__item')
+    raw_id_fields = ('item',)
+    show_full_result_count = False
+
+    def get_order(self, obj):
+        return obj.item.supply_order.display_code
+    get_order.short_description = 'Order'
+    get_order.admin_order_field = 'item__supply_order__order_code'
+
+    def get_item(self, obj):
+        return obj.item.item.item_name
+    get_item.short_description = 'Item'
+    get_item.admin_order_field = 'item__item__item_name'
 
 
 admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Supplier, CustomerAdmin)
 admin.site.register(Inventory, InventoryAdmin)
 admin.site.register(SalesOrder, SalesOrderAdmin)
+admin.site.register(SupplyOrder, SupplyOrderAdmin)
+admin.site.register(SalesOrderItemDelivery, SalesOrderItemDeliveryAdmin)
+admin.site.register(SupplyOrderItemDelivery, SupplyOrderItemDeliveryAdmin)
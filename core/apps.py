@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
@@ -9,3 +10,7 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         import core.signals
+        from core.numbering import create_order_code_sequences
+        from core.search import create_search_indexes
+        post_migrate.connect(create_search_indexes, sender=self)
+        post_migrate.connect(create_order_code_sequences, sender=self)
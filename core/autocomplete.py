@@ -0,0 +1,77 @@
+"""Type-ahead lookups for the order forms.
+
+A form field using ``AutocompleteSelect`` renders only its chosen option, however large
+the table behind it. The page looks the other rows up by prefix as the user types, from
+the ``autocomplete`` view. Prefix matches are served by the name indexes, and results are
+cached briefly, since many clerks type the same first letters.
+"""
+import hashlib
+
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.utils.encoding import force_bytes, force_text
+from .models import Customer, Inventory
+
+# The model, the fields matched by prefix and the ordering of each lookup
+LOOKUPS = {
+    'customers': (Customer, ('name',), 'name'),
+    'items': (Inventory, ('item_name', 'item_sku'), 'item_name'),
+}
+
+
+def lookup(name, term):
+    """Up to ``AUTOCOMPLETE_LIMIT`` rows of lookup ``name`` starting with ``term``, as id and text."""
+    model, fields, ordering = LOOKUPS[name]
+    term = (term or '').strip()
+    key = 'core:autocomplete:%s:%s' % (name, hashlib.md5(force_bytes(term.lower())).hexdigest())
+    results = cache.get(key)
+    if results is None:
+        queryset = model.objects.order_by(ordering, 'pk')
+        if term:
+            matches = Q()
+            for field in fields:
+                matches |= Q(**{field + '__istartswith': term})
+            queryset = queryset.filter(matches)
+        results = [
+            {'id': obj.pk, 'text': force_text(obj)} for obj in queryset[:getattr(settings, 'AUTOCOMPLETE_LIMIT', 20)]
+        ]
+        cache.set(key, results, getattr(settings, 'AUTOCOMPLETE_CACHE_TIMEOUT', 30))
+    return results
+
+
+class AutocompleteSelect(forms.Select):
+    """A select holding only the chosen option, next to a text input looking up the others.
+
+    ``lookup`` names the entry of ``LOOKUPS`` searched; the base template wires the input up.
+    """
+    template_name = 'core/widgets/autocomplete.html'
+
+    def __init__(self, lookup, attrs=None):
+        attrs = dict(attrs or {}, **{'class': 'hidden'})
+        super(AutocompleteSelect, self).__init__(attrs)
+        self.lookup = lookup
+
+    def optgroups(self, name, value, attrs=None):
+        chosen = [v for v in value if force_text(v).isdigit()]
+        choices = self.choices
+        self.choices = [('', '---------')]
+        if chosen:
+            self.choices.extend(
+                (obj.pk, choices.field.label_from_instance(obj)) for obj in choices.queryset.filter(pk__in=chosen)
+            )
+        try:
+            return super(AutocompleteSelect, self).optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
+    def get_context(self, name, value, attrs):
+        context = super(AutocompleteSelect, self).get_context(name, value, attrs)
+        context['widget']['lookup_url'] = reverse('core:autocomplete', args=[self.lookup])
+        context['widget']['chosen_label'] = ''.join(
+            option['label'] for group, options, index in context['widget']['optgroups']
+            for option in options if option['selected'] and option['value'] not in ('', None)
+        )
+        return context
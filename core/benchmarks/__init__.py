@@ -0,0 +1,12 @@
+"""Timing of the slower code paths against generated fixtures."""
+import time
+
+
+def timed(func, repeat):
+    """Run ``func`` ``repeat`` times and return the timings in milliseconds, fastest first."""
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    return sorted(timings)
@@ -0,0 +1,34 @@
+"""Rows per second and memory growth of the streaming exports."""
+import resource
+import time
+
+from core.exports import export_rows, stream
+
+SCENARIOS = (
+    ('salesorders', 'csv'),
+    ('salesorders', 'jsonl'),
+    ('salespayments', 'csv'),
+)
+
+
+def peak_memory_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run():
+    """Stream each export to nowhere, reporting throughput and how far peak memory grew."""
+    results = []
+    for name, format in SCENARIOS:
+        before = peak_memory_kb()
+        started = time.time()
+        size = lines = 0
+        for chunk in stream(name, export_rows(name), format):
+            size += len(chunk)
+            lines += chunk.count('\n')
+        elapsed = time.time() - started
+        results.append({
+            'export': name, 'format': format, 'lines': lines, 'bytes': size,
+            'seconds': round(elapsed, 2), 'lines_per_sec': int(lines / max(elapsed, 1e-6)),
+            'peak_memory_growth_kb': peak_memory_kb() - before,
+        })
+    return results
@@ -0,0 +1,203 @@
+"""Deterministic fixture data; the same seed always produces the same rows."""
+import datetime
+import random
+from decimal import Decimal
+
+from django.utils.timezone import now
+from core.models import (
+    Customer, Supplier, Inventory, SalesOrder, SalesOrderItem, SalesOrderItemDelivery, SalesOrderPayment,
+    StockMovement, SupplyOrder, SupplyOrderItem, SupplyOrderItemDelivery, SupplyOrderPayment
+)
+from core.pagecache import invalidate_pages
+from core.rollups import rebuild_all
+
+FIRST_NAMES = (
+    'Amina', 'Brian', 'Caro', 'David', 'Esther', 'Felix', 'Grace', 'Hassan', 'Irene', 'James',
+    'Kevin', 'Lucy', 'Moses', 'Njeri', 'Otieno', 'Peter', 'Rose', 'Samuel', 'Tabitha', 'Wanjiku',
+)
+LAST_NAMES = (
+    'Achieng', 'Barasa', 'Cheruiyot', 'Documbo', 'Gitau', 'Kamau', 'Kiprop', 'Mutua', 'Njoroge',
+    'Odhiambo', 'Omondi', 'Wafula', 'Wambui', 'Wekesa',
+)
+COMPANY_WORDS = ('Agro', 'Bora', 'Coast', 'Delta', 'Highland', 'Lake', 'Metro', 'Rift', 'Savanna', 'Tana')
+PRODUCT_WORDS = (
+    'bolt', 'cable', 'drill', 'filter', 'hinge', 'lamp', 'nail', 'pipe', 'pump', 'saw', 'screw',
+    'switch', 'tank', 'valve', 'wire',
+)
+ADJECTIVES = ('steel', 'copper', 'plastic', 'heavy', 'light', 'galvanised', 'industrial', 'compact')
+
+
+def _batches(objects, size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _split(quantity, parts):
+    """``quantity`` in at most ``parts`` positive shares, the remainder going to the last."""
+    parts = min(parts, quantity)
+    share = quantity // parts
+    return [share] * (parts - 1) + [quantity - share * (parts - 1)]
+
+
+def generate_search_fixture(rows, seed=1, batch_size=10000):
+    """Create ``rows`` customers, items and sales orders and a tenth as many suppliers."""
+    rng = random.Random(seed)
+
+    def person(i):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        return dict(
+            name='%s %s %d' % (first, last, i),
+            email='%s.%s%d@example.com' % (first.lower(), last.lower(), i),
+            contact_phone='07%08d' % rng.randrange(10 ** 8),
+        )
+
+    for batch in _batches((Customer(**person(i)) for i in range(rows)), batch_size):
+        Customer.objects.bulk_create(batch)
+    for batch in _batches((Supplier(**dict(person(i), name='%s %s Ltd %d' % (
+        rng.choice(COMPANY_WORDS), rng.choice(LAST_NAMES), i
+    ))) for i in range(rows // 10)), batch_size):
+        Supplier.objects.bulk_create(batch)
+
+    def item(i):
+        adjective, product = rng.choice(ADJECTIVES), rng.choice(PRODUCT_WORDS)
+        return Inventory(
+            item_name='%s %s %d' % (adjective.title(), product, i), item_sku='SKU%07d' % i,
+            description='A %s %s suitable for %s work.' % (adjective, product, rng.choice(PRODUCT_WORDS)),
+            unit_price=Decimal(rng.randrange(100, 100000)) / 100,
+        )
+
+    for batch in _batches((item(i) for i in range(rows)), batch_size):
+        Inventory.objects.bulk_create(batch)
+
+    customer_ids = list(Customer.objects.values_list('pk', flat=True))
+    start = SalesOrder.objects.count()
+    today = now()
+    for batch in _batches((SalesOrder(
+        customer_id=rng.choice(customer_ids), order_date=today, order_code=1000000 + start + i
+    ) for i in range(rows)), batch_size):
+        SalesOrder.objects.bulk_create(batch)
+
+
+def generate_order_fixture(rows, seed=1, batch_size=10000):
+    """Create ``rows`` sales orders with one payment each, for a hundredth as many customers."""
+    rng = random.Random(seed)
+    customers = [
+        Customer(name='%s %s %d' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), i))
+        for i in range(max(rows // 100, 1))
+    ]
+    Customer.objects.bulk_create(customers, batch_size=batch_size)
+    customer_ids = list(Customer.objects.order_by('-pk').values_list('pk', flat=True)[:len(customers)])
+    first_code = 2000000 + SalesOrder.objects.count()
+    today = now()
+    for batch in _batches((SalesOrder(
+        customer_id=rng.choice(customer_ids), order_date=today, order_code=first_code + i,
+        order_value=Decimal(rng.randrange(100, 100000)) / 100, payment_status='paid', order_status='complete',
+    ) for i in range(rows)), batch_size):
+        SalesOrder.objects.bulk_create(batch)
+    order_ids = SalesOrder.objects.filter(order_code__gte=first_code).values_list('pk', 'order_value').iterator()
+    for batch in _batches((SalesOrderPayment(
+        sales_order_id=pk, payment_code='B%d' % pk, amount_paid=value, date_paid=today
+    ) for pk, value in order_ids), batch_size):
+        SalesOrderPayment.objects.bulk_create(batch)
+
+
+def _create_orders(rng, order_model, counterparty_field, counterparty_ids, item_ids, orders, lines,
+                   deliveries, payments, first_code, start, batch_size):
+    """Bulk create orders with their lines, deliveries and payments, then derive their totals."""
+    line_model, delivery_model, payment_model, order_field = {
+        SalesOrder: (SalesOrderItem, SalesOrderItemDelivery, SalesOrderPayment, 'sales_order_id'),
+        SupplyOrder: (SupplyOrderItem, SupplyOrderItemDelivery, SupplyOrderPayment, 'supply_order_id'),
+    }[order_model]
+    for batch in _batches((order_model(**{
+        counterparty_field: rng.choice(counterparty_ids), 'order_code': first_code + i,
+        'order_date': start + datetime.timedelta(minutes=rng.randrange(60 * 24 * 365)),
+    }) for i in range(orders)), batch_size):
+        order_model.objects.bulk_create(batch)
+    new_orders = order_model.objects.filter(order_code__gte=first_code)
+
+    order_ids = list(new_orders.order_by('pk').values_list('pk', 'order_date'))
+    for batch in _batches((line_model(**{
+        order_field: pk, 'item_id': item_id, 'quantity_ordered': rng.randrange(1, 20),
+        'unit_price': Decimal(rng.randrange(100, 100000)) / 100,
+    }) for pk, order_date in order_ids for item_id in rng.sample(item_ids, min(lines, len(item_ids)))), batch_size):
+        line_model.objects.bulk_create(batch)
+
+    line_rows = line_model.objects.filter(**{order_field[:-3] + '__order_code__gte': first_code}).order_by('pk')
+    for batch in _batches((delivery_model(
+        item_id=pk, quantity_delivered=share, delivery_date=order_date + datetime.timedelta(days=n + 1),
+    ) for pk, quantity, order_date in line_rows.values_list(
+        'pk', 'quantity_ordered', order_field[:-3] + '__order_date'
+    ).iterator() for n, share in enumerate(_split(quantity, deliveries))), batch_size):
+        delivery_model.objects.bulk_create(batch)
+
+    def payment(pk, n):
+        payment = payment_model(**{
+            order_field: pk, 'amount_paid': Decimal(rng.randrange(100, 10000)) / 100, 'date_paid': now(),
+        })
+        if payment_model is SalesOrderPayment:
+            payment.payment_code = 'G%d-%d' % (pk, n)
+        return payment
+
+    for batch in _batches((payment(pk, n) for pk, order_date in order_ids for n in range(payments)), batch_size):
+        payment_model.objects.bulk_create(batch)
+
+    if order_model is SupplyOrder:
+        line_rows.filter(supplyorderitemdelivery__isnull=False).update(delivery_date=now())
+    else:
+        line_rows.refresh_delivered()
+    new_orders.refresh_last_delivery()
+    new_orders.rebuild_totals()
+    new_orders.refresh_statuses()
+
+
+def generate_dataset(customers=1000, suppliers=100, items=500, orders=10000, lines=3, deliveries=1,
+                     payments=1, seed=1, batch_size=5000):
+    """Create a complete, consistent dataset of the given size.
+
+    Every sales and supply order gets ``lines`` lines, each delivered in full in up to
+    ``deliveries`` deliveries, and ``payments`` payments. Rows are bulk inserted and the stored totals,
+    statuses, balances, rollups and opening stock movements derived afterwards, as the import does.
+    """
+    rng = random.Random(seed)
+    Customer.objects.bulk_create([
+        Customer(name='%s %s %d' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), i))
+        for i in range(customers)
+    ], batch_size=batch_size)
+    Supplier.objects.bulk_create([
+        Supplier(name='%s %s Ltd %d' % (rng.choice(COMPANY_WORDS), rng.choice(LAST_NAMES), i))
+        for i in range(suppliers)
+    ], batch_size=batch_size)
+    first_item = Inventory.objects.count()
+    Inventory.objects.bulk_create([
+        Inventory(
+            item_name='%s %s %d' % (rng.choice(ADJECTIVES).title(), rng.choice(PRODUCT_WORDS), first_item + i),
+            item_sku='GEN%07d' % (first_item + i), quantity=rng.randrange(0, 500), min_threshold=rng.randrange(0, 50),
+            manage_stock=True,
+            unit_price=Decimal(rng.randrange(100, 100000)) / 100,
+        )
+        for i in range(items)
+    ], batch_size=batch_size)
+
+    customer_ids = list(Customer.objects.order_by('-pk').values_list('pk', flat=True)[:customers])
+    supplier_ids = list(Supplier.objects.order_by('-pk').values_list('pk', flat=True)[:suppliers])
+    item_ids = list(Inventory.objects.order_by('-pk').values_list('pk', flat=True)[:items])
+    Inventory.objects.filter(pk__in=item_ids).refresh_low_stock()
+    start = now() - datetime.timedelta(days=365)
+    for order_model, field, ids, code in ((SalesOrder, 'customer_id', customer_ids, 5000000),
+                                          (SupplyOrder, 'supplier_id', supplier_ids, 6000000)):
+        first_code = max(code, (order_model.objects.order_by('-order_code').values_list(
+            'order_code', flat=True
+        ).first() or 0) + 1)
+        _create_orders(rng, order_model, field, ids, item_ids, orders, lines, deliveries, payments,
+                       first_code, start, batch_size)
+    Customer.objects.filter(pk__in=customer_ids).rebuild_balances()
+    Supplier.objects.filter(pk__in=supplier_ids).rebuild_balances()
+    rebuild_all()
+    StockMovement.objects.open_balances()
+    invalidate_pages()
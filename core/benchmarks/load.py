@@ -0,0 +1,229 @@
+"""Concurrent load against the web views, replaying a weighted mix of reads and writes.
+
+Each worker thread is one clerk with its own session. It picks actions by weight and
+issues them over HTTP, either to a server started in this process or to one given by
+URL. Latency and errors are reported per URL name. Only the standard library and the
+project's own database are needed.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer, get_internal_wsgi_application
+from django.core.urlresolvers import reverse
+from django.utils.six.moves import http_cookiejar, socketserver, urllib
+from django.utils.timezone import now
+from core.models import Customer, Inventory, SalesOrder, SalesOrderItem
+
+# URL name and how often it is requested relative to the others
+DEFAULT_MIX = (
+    ('core:index', 10),
+    ('core:customer_list', 8),
+    ('core:customer', 8),
+    ('core:salesorder_list', 12),
+    ('core:salesorder', 15),
+    ('core:inventory', 5),
+    ('search', 5),
+    ('core:salesorder_add', 10),
+    ('core:salesorderpayment_add', 10),
+    ('core:salesorderdelivery_batch', 7),
+)
+
+
+# Built as basehttp.run() builds the threaded development server
+ThreadedWSGIServer = type('WSGIServer', (socketserver.ThreadingMixIn, WSGIServer), {'daemon_threads': True})
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(object):
+    """The project served by a threaded WSGI server on a free local port."""
+
+    def __init__(self, host='127.0.0.1'):
+        self.server = ThreadedWSGIServer((host, 0), QuietRequestHandler)
+        self.server.set_app(get_internal_wsgi_application())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server.server_address[:2]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects, such as the one after a successful form post, instead of following them."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(timings, fraction):
+    """Nearest-rank percentile of sorted ``timings``."""
+    if not timings:
+        return None
+    return timings[min(int(fraction * len(timings)), len(timings) - 1)]
+
+
+class Targets(object):
+    """Ids the actions pick from, loaded once before the run."""
+
+    def __init__(self):
+        self.customers = list(Customer.objects.values_list('pk', flat=True)[:1000])
+        self.items = list(Inventory.objects.values_list('pk', flat=True)[:1000])
+        self.orders = list(SalesOrder.objects.order_by('-pk').values_list('pk', flat=True)[:1000])
+        self.search_terms = list(Customer.objects.values_list('name', flat=True)[:100]) or ['a']
+
+
+class Clerk(object):
+    """One worker: a session and the actions it can take."""
+
+    def __init__(self, base_url, targets, rng):
+        self.base_url = base_url
+        self.targets = targets
+        self.rng = rng
+        self.cookies = http_cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect())
+
+    def request(self, path, data=None):
+        """Issue a request and return its status code."""
+        body = None
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.csrf_token())
+            body = urllib.parse.urlencode(data).encode('utf-8')
+        try:
+            response = self.opener.open(self.base_url + path, body, timeout=60)
+            response.read()
+            return response.getcode()
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        self.request(reverse('core:salesorder_add'))
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def act(self, name):
+        """Perform the action for URL name ``name``; returns the status code."""
+        targets, rng = self.targets, self.rng
+        if name == 'search':
+            term = rng.choice(targets.search_terms).split()[0]
+            return self.request(reverse('core:customer_list') + '?' + urllib.parse.urlencode({'search': term}))
+        if name == 'core:customer':
+            return self.request(reverse(name, args=[rng.choice(targets.customers)]))
+        if name == 'core:salesorder':
+            return self.request(reverse(name, args=[rng.choice(targets.orders)]))
+        if name == 'core:salesorder_add':
+            return self.request(reverse(name), self.order_data())
+        if name == 'core:salesorderpayment_add':
+            return self.request(reverse(name, args=[rng.choice(targets.orders)]), {
+                'currency': 'KES', 'amount_paid': '%d.00' % rng.randrange(1, 100),
+                'date_paid': now().strftime('%Y-%m-%d %H:%M'),
+            })
+        if name == 'core:salesorderdelivery_batch':
+            order = rng.choice(targets.orders)
+            data = {'delivery_date': now().strftime('%Y-%m-%d %H:%M')}
+            for pk in SalesOrderItem.objects.filter(sales_order=order, is_delivered=False).values_list('pk', flat=True):
+                data['item_%d' % pk] = 1
+            return self.request(reverse(name, args=[order]), data)
+        return self.request(reverse(name))
+
+    def order_data(self):
+        items = self.rng.sample(self.targets.items, min(self.rng.randrange(1, 6), len(self.targets.items)))
+        data = {
+            'customer': self.rng.choice(self.targets.customers),
+            'order_date': now().strftime('%Y-%m-%d %H:%M'),
+            'salesorderitem_set-TOTAL_FORMS': len(items), 'salesorderitem_set-INITIAL_FORMS': 0,
+            'salesorderitem_set-MIN_NUM_FORMS': 0, 'salesorderitem_set-MAX_NUM_FORMS': 1000,
+        }
+        for i, item in enumerate(items):
+            data.update({
+                'salesorderitem_set-%d-item' % i: item, 'salesorderitem_set-%d-quantity_ordered' % i: 1,
+                'salesorderitem_set-%d-currency' % i: 'KES', 'salesorderitem_set-%d-unit_price' % i: '10.00',
+            })
+        return data
+
+
+class LoadRun(object):
+    def __init__(self, base_url, workers=50, duration=60, mix=DEFAULT_MIX, seed=1):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.duration = duration
+        self.mix = mix
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, elapsed_ms, ok):
+        with self.lock:
+            self.timings[name].append(elapsed_ms)
+            if not ok:
+                self.errors[name] += 1
+
+    def worker(self, number, targets, deadline):
+        from django.db import connection
+        rng = random.Random(self.seed * 1000 + number)
+        clerk = Clerk(self.base_url, targets, rng)
+        names = [name for name, weight in self.mix for _ in range(weight)]
+        try:
+            while time.time() < deadline:
+                name = rng.choice(names)
+                started = time.time()
+                try:
+                    ok = clerk.act(name) < 400
+                except Exception:
+                    ok = False
+                self.record(name, (time.time() - started) * 1000, ok)
+        finally:
+            connection.close()
+
+    def run(self):
+        targets = Targets()
+        if not (targets.customers and targets.items and targets.orders):
+            raise ValueError('The load run needs customers, items and sales orders to work with')
+        deadline = time.time() + self.duration
+        threads = [
+            threading.Thread(target=self.worker, args=(number, targets, deadline)) for number in range(self.workers)
+        ]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.time() - started)
+
+    def report(self, elapsed):
+        """Requests, error rate and latency percentiles per URL name."""
+        views = {}
+        for name, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            views[name] = {
+                'requests': len(timings),
+                'errors': self.errors[name],
+                'error_rate': round(float(self.errors[name]) / len(timings), 4),
+                'p50_ms': round(percentile(timings, 0.50), 1),
+                'p95_ms': round(percentile(timings, 0.95), 1),
+                'p99_ms': round(percentile(timings, 0.99), 1),
+            }
+        total = sum(view['requests'] for view in views.values())
+        return {
+            'workers': self.workers, 'seconds': round(elapsed, 1), 'requests': total,
+            'requests_per_sec': round(total / max(elapsed, 1e-6), 1), 'views': views,
+        }
@@ -0,0 +1,133 @@
+"""Timed scenarios for the hot paths, run against whatever data is in the database."""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.timezone import now
+from core.dashboard import invalidate_dashboard
+from core.models import Customer, Inventory, SalesOrder, SalesOrderItem
+from core.pagecache import invalidate_pages
+from core.search import search
+from core.signals import coalesced_recomputation
+from . import timed
+
+
+class Rollback(Exception):
+    pass
+
+
+def rolled_back(func):
+    """``func`` wrapped so whatever it writes is rolled back afterwards."""
+    def run():
+        try:
+            with transaction.atomic():
+                func()
+                raise Rollback
+        except Rollback:
+            pass
+    return run
+
+
+def order_properties():
+    for order in SalesOrder.objects.select_related('customer')[:100]:
+        order.order_value
+        order.get_payment_status()
+        order.get_order_status()
+
+
+def _order_saver(lines, coalesced):
+    customer = Customer.objects.order_by('pk').first()
+    items = list(Inventory.objects.order_by('pk')[:lines])
+
+    def save():
+        def create():
+            order = SalesOrder.objects.create(customer=customer, order_date=now())
+            for item in items:
+                SalesOrderItem.objects.create(
+                    sales_order=order, item=item, quantity_ordered=1, unit_price=Decimal('10.00')
+                )
+        if coalesced:
+            with coalesced_recomputation():
+                create()
+        else:
+            create()
+    return rolled_back(save)
+
+
+def _cached_page(client, name, *args, **params):
+    url = reverse(name, args=args)
+
+    def get():
+        response = client.get(url, params)
+        assert response.status_code == 200, '%s returned %s' % (url, response.status_code)
+    return get
+
+
+def _page(client, name, *args, **params):
+    """GET the page as rendered by its view, not served from the page cache the warm-up filled."""
+    get = _cached_page(client, name, *args, **params)
+
+    def uncached():
+        invalidate_pages()
+        get()
+    return uncached
+
+
+def _cold_dashboard(client):
+    get = _page(client, 'core:index')
+
+    def cold():
+        invalidate_dashboard()
+        get()
+    return cold
+
+
+def _search(model, term):
+    return lambda: list(search(model.objects.all(), term)[:24])
+
+
+def scenarios():
+    """Yield the group, name and callable of each scenario."""
+    client = Client()
+    deep_order = SalesOrder.objects.order_by('order_date', 'pk').first()
+    last_page = max(min(SalesOrder.objects.count() // settings.PAGE_SIZE, 40), 1)
+    yield 'models', 'order_value and statuses of 100 orders', order_properties
+    if Customer.objects.exists():
+        yield 'save', 'order with 5 lines', _order_saver(5, coalesced=False)
+        yield 'save', 'order with 5 lines, coalesced', _order_saver(5, coalesced=True)
+        yield 'save', 'order with 20 lines, coalesced', _order_saver(20, coalesced=True)
+    yield 'dashboard', 'index, cold', _cold_dashboard(client)
+    yield 'dashboard', 'index, warm', _page(client, 'core:index')
+    yield 'lists', 'customers, first page', _page(client, 'core:customer_list')
+    yield 'lists', 'sales orders, first page', _page(client, 'core:salesorder_list')
+    yield 'lists', 'sales orders, page %d' % last_page, _page(client, 'core:salesorder_list', last_page)
+    yield 'lists', 'sales orders by value', _page(client, 'core:salesorder_list', sort='-order_value')
+    yield 'lists', 'sales orders, first page, cached', _cached_page(client, 'core:salesorder_list')
+    if deep_order is not None:
+        yield 'details', 'sales order', _page(client, 'core:salesorder', deep_order.pk)
+        yield 'details', 'customer', _page(client, 'core:customer', deep_order.customer_id)
+        yield 'details', 'sales order, cached', _cached_page(client, 'core:salesorder', deep_order.pk)
+    yield 'search', 'customers by name', _search(Customer, 'Kamau')
+    yield 'search', 'items by description', _search(Inventory, 'galvanised')
+    yield 'search', 'orders by customer', _search(SalesOrder, 'Wambui')
+
+
+def run(repeat=5, only=None):
+    """Time every scenario, or those in the groups ``only``; returns one dict per scenario."""
+    results = []
+    with override_settings(ALLOWED_HOSTS=['*']):
+        for group, name, func in scenarios():
+            if only and group not in only:
+                continue
+            with CaptureQueriesContext(connection) as queries:
+                func()
+            timings = timed(func, repeat)
+            results.append({
+                'group': group, 'scenario': name, 'repeat': repeat, 'queries': len(queries),
+                'min_ms': round(timings[0], 2), 'median_ms': round(timings[len(timings) // 2], 2),
+                'max_ms': round(timings[-1], 2),
+            })
+    return results
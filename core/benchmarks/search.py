@@ -0,0 +1,44 @@
+"""How long a page of search results takes, per model and kind of search term."""
+from django.conf import settings
+from django.db import connection
+from core.models import Customer, Supplier, Inventory, SalesOrder
+from core.search import search
+from . import timed
+
+# Model, description and search term
+SCENARIOS = (
+    (Customer, 'name substring', 'Wambui 12'),
+    (Customer, 'email', 'grace.kamau'),
+    (Customer, 'phone digits', '0712'),
+    (Supplier, 'company name', 'Savanna Mutua'),
+    (Inventory, 'item name', 'Copper valve'),
+    (Inventory, 'sku', 'SKU00042'),
+    (Inventory, 'description words', 'galvanised pipe'),
+    (SalesOrder, 'order code', '1000042'),
+    (SalesOrder, 'customer name', 'Otieno Barasa'),
+)
+
+
+def uses_index(queryset):
+    """Whether PostgreSQL would answer ``queryset`` from an index; None elsewhere."""
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+    return 'Index' in plan
+
+
+def run(repeat=5):
+    """Time the first page of results of each scenario."""
+    results = []
+    for model, description, term in SCENARIOS:
+        queryset = search(model.objects.all(), term)[:settings.PAGE_SIZE]
+        timings = timed(lambda: list(queryset.all()), repeat)
+        results.append({
+            'model': model.__name__, 'search': description, 'term': term,
+            'rows': len(list(queryset.all())), 'uses_index': uses_index(queryset),
+            'min_ms': round(timings[0], 2), 'median_ms': round(timings[len(timings) // 2], 2),
+        })
+    return results
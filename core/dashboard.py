@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Count, Case, When, F, Q, IntegerField
+from .models import Customer, Supplier, SalesOrder, SupplyOrder, Inventory
+
+DASHBOARD_CACHE_KEY = 'core:dashboard'
+
+
+def _count_if(condition):
+    return Sum(Case(When(condition, then=1), default=0, output_field=IntegerField()))
+
+
+def compute_dashboard():
+    """Compute the dashboard figures with one aggregate query per table."""
+    unpaid = ~Q(payment_status='paid')
+    sales = SalesOrder.objects.aggregate(
+        total_sales_orders=Count('pk'),
+        revenue=Sum('total_paid'),
+        credit=Sum('amount_due'),
+        del_orders=_count_if(Q(order_status='pending deliveries')),
+        total_unpaid_sales=_count_if(unpaid),
+        unpaying_customers=Count(Case(When(unpaid, then=F('customer'))), distinct=True),
+    )
+    purchases = SupplyOrder.objects.confirmed().aggregate(
+        total_supply_orders=Count('pk'),
+        expenditure=Sum('total_paid'),
+        total_unpaid_purchases=_count_if(unpaid),
+        unpaid_suppliers=Count(Case(When(unpaid, then=F('supplier'))), distinct=True),
+    )
+    data = {
+        'total_customers': Customer.objects.count(),
+        'total_suppliers': Supplier.objects.count(),
+        'low_items': Inventory.objects.filter(is_low_stock=True).count(),
+        'debit': 0,
+    }
+    data.update(sales)
+    data.update(purchases)
+    # Aggregates over empty tables come back as None
+    for key, value in data.items():
+        if value is None:
+            data[key] = 0
+    return data
+
+
+def get_dashboard():
+    """Return the cached dashboard snapshot, computing it on a miss."""
+    data = cache.get(DASHBOARD_CACHE_KEY)
+    if data is None:
+        data = compute_dashboard()
+        cache.set(DASHBOARD_CACHE_KEY, data, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+    return data
+
+
+def invalidate_dashboard():
+    cache.delete(DASHBOARD_CACHE_KEY)
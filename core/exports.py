@@ -0,0 +1,149 @@
+"""Streaming CSV and JSON lines exports of orders, payments and deliveries.
+
+Rows are read with ``values_list().iterator()``, which uses a server-side cursor on
+PostgreSQL, and written out one at a time, so memory stays flat however many rows
+are exported.
+"""
+import csv
+import datetime
+import json
+from collections import namedtuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+from django.utils.dateparse import parse_date
+from django.utils.encoding import force_text
+from django.utils.timezone import make_aware
+from .models import (
+    SalesOrder, SupplyOrder, SalesOrderPayment, SupplyOrderPayment, SalesOrderItemDelivery,
+    SupplyOrderItemDelivery
+)
+
+Export = namedtuple('Export', 'model date_field status_fields columns')
+
+ORDER_STATUS_FIELDS = ('payment_status', 'order_status')
+
+# Column name and the field path it is read from
+EXPORTS = {
+    'salesorders': Export(SalesOrder, 'order_date', ORDER_STATUS_FIELDS, (
+        ('order_code', 'order_code'), ('order_date', 'order_date'), ('customer', 'customer__name'),
+        ('order_value', 'order_value'), ('total_paid', 'total_paid'), ('amount_due', 'amount_due'),
+        ('payment_status', 'payment_status'), ('order_status', 'order_status'),
+        ('last_delivery_date', 'last_delivery_date'),
+    )),
+    'supplyorders': Export(SupplyOrder, 'order_date', ORDER_STATUS_FIELDS, (
+        ('order_code', 'order_code'), ('order_date', 'order_date'), ('supplier', 'supplier__name'),
+        ('order_value', 'order_value'), ('total_paid', 'total_paid'), ('amount_due', 'amount_due'),
+        ('payment_status', 'payment_status'), ('order_status', 'order_status'),
+        ('last_delivery_date', 'last_delivery_date'),
+    )),
+    'salespayments': Export(SalesOrderPayment, 'date_paid', (), (
+        ('payment_code', 'payment_code'), ('order_code', 'sales_order__order_code'),
+        ('customer', 'sales_order__customer__name'), ('date_paid', 'date_paid'),
+        ('currency', 'currency'), ('amount_paid', 'amount_paid'), ('notes', 'notes'),
+    )),
+    'supplypayments': Export(SupplyOrderPayment, 'date_paid', (), (
+        ('order_code', 'supply_order__order_code'), ('supplier', 'supply_order__supplier__name'),
+        ('date_paid', 'date_paid'), ('currency', 'currency'), ('amount_paid', 'amount_paid'),
+        ('notes', 'notes'),
+    )),
+    'salesdeliveries': Export(SalesOrderItemDelivery, 'delivery_date', (), (
+        ('order_code', 'item__sales_order__order_code'), ('customer', 'item__sales_order__customer__name'),
+        ('item_sku', 'item__item__item_sku'), ('quantity_delivered', 'quantity_delivered'),
+        ('delivery_date', 'delivery_date'),
+    )),
+    'supplydeliveries': Export(SupplyOrderItemDelivery, 'delivery_date', (), (
+        ('order_code', 'item__supply_order__order_code'), ('supplier', 'item__supply_order__supplier__name'),
+        ('item_sku', 'item__item__item_sku'), ('quantity_delivered', 'quantity_delivered'),
+        ('delivery_date', 'delivery_date'),
+    )),
+}
+
+# Lines joined into each chunk written to the response or file
+STREAM_CHUNK_LINES = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def parse_day(value):
+    """The date in a ``YYYY-MM-DD`` query parameter or option, or None if it is empty.
+
+    Raises ValueError for malformed or impossible dates, such as 2016-02-30.
+    """
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError('%r is not a date' % value)
+    return day
+
+
+def day_bounds(start=None, end=None):
+    """Local midnight at the start of ``start`` and after ``end``, for an inclusive date range."""
+    def midnight(day):
+        return make_aware(datetime.datetime.combine(day, datetime.time.min)) if day else None
+    return midnight(start), midnight(end and end + datetime.timedelta(days=1))
+
+
+def export_rows(name, start=None, end=None, **statuses):
+    """Yield the rows of an export as tuples, oldest first.
+
+    ``start`` and ``end`` bound the export's date field (end exclusive); ``statuses``
+    filters the order exports by payment or order status.
+    """
+    export = EXPORTS[name]
+    queryset = export.model.objects.order_by(export.date_field, 'pk')
+    if start is not None:
+        queryset = queryset.filter(**{export.date_field + '__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{export.date_field + '__lt': end})
+    for field, value in statuses.items():
+        if field not in export.status_fields:
+            raise ValueError('%s cannot be filtered by %s' % (name, field))
+        if value:
+            queryset = queryset.filter(**{field: value})
+    return queryset.values_list(*[path for column, path in export.columns]).iterator()
+
+
+class Echo(object):
+    """File-like object handing back what the csv writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if six.PY2:
+        return force_text(value).encode('utf-8')
+    return force_text(value)
+
+
+def _lines(name, rows, format):
+    columns = [column for column, path in EXPORTS[name].columns]
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow([_csv_value(column) for column in columns])
+        for row in rows:
+            yield writer.writerow([_csv_value(value) for value in row])
+    elif format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+    else:
+        raise ValueError('Unknown export format %s' % format)
+
+
+def stream(name, rows, format='csv', lines_per_chunk=STREAM_CHUNK_LINES):
+    """Yield an export in ``format`` as chunks of lines, starting with the header for CSV."""
+    chunk = []
+    for line in _lines(name, rows, format):
+        chunk.append(line)
+        if len(chunk) == lines_per_chunk:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -1,4 +1,9 @@
 from django import forms
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from .autocomplete import AutocompleteSelect
+from .dashboard import invalidate_dashboard
 from .models import (
     Customer, Supplier, SalesOrder, SupplyOrder, SalesOrderPayment,
     SupplyOrderPayment, SalesOrderItem, SupplyOrderItem, Inventory,
@@ -11,6 +16,7 @@ class SalesOrderForm(forms.ModelForm):
         model = SalesOrder
         fields = ['customer', 'order_date']
         widgets = {
+            'customer': AutocompleteSelect('customers'),
             'order_date': forms.DateInput(attrs={'class':'datepicker'}),
         }
 
@@ -24,6 +30,32 @@ class ItemDeliveryForm(forms.ModelForm):
         }
 
 
+class BatchDeliveryForm(forms.Form):
+    """Delivered quantities for every outstanding line of a sales order."""
+    delivery_date = forms.DateTimeField(widget=forms.DateInput(attrs={'class': 'datepicker'}))
+
+    def __init__(self, *args, **kwargs):
+        self.sales_order = kwargs.pop('sales_order')
+        super(BatchDeliveryForm, self).__init__(*args, **kwargs)
+        self.lines = list(self.sales_order.salesorderitem_set.filter(is_delivered=False).select_related(
+            'item'
+        ).annotate(delivered=Coalesce(Sum('salesorderitemdelivery__quantity_delivered'), 0)))
+        for line in self.lines:
+            remaining = line.quantity_ordered - line.delivered
+            self.fields['item_%d' % line.pk] = forms.IntegerField(
+                label=line.item.item_name, min_value=0, max_value=remaining, initial=remaining,
+                required=False, help_text='%d of %d delivered' % (line.delivered, line.quantity_ordered)
+            )
+
+    def save(self):
+        quantities = dict(
+            (line.pk, self.cleaned_data.get('item_%d' % line.pk) or 0) for line in self.lines
+        )
+        count = SalesOrderItemDelivery.objects.bulk_record(quantities, self.cleaned_data['delivery_date'])
+        transaction.on_commit(invalidate_dashboard)
+        return count
+
+
 class SalesOrderPaymentForm(forms.ModelForm):
     class Meta:
         model = SalesOrderPayment
@@ -37,6 +69,9 @@ class ItemInline(forms.ModelForm):
     class Meta:
         model = SalesOrderItem
         fields = ['item', 'quantity_ordered', 'currency', 'unit_price']
+        widgets = {
+            'item': AutocompleteSelect('items'),
+        }
 
 
 class ItemDeliveryInline(forms.ModelForm):
@@ -0,0 +1,183 @@
+"""Query count and timing of every request, by URL name.
+
+For each request the middleware records the number of SQL queries, the time spent in
+SQL and in total, the fingerprints of queries that ran more than once, the usual sign
+of an N+1, and whether a cached page was served (see ``core.pagecache``). Each request
+is logged to the ``core.instrumentation`` logger and folded into an in-process summary,
+served by ``instrumentation_summary``.
+
+Views declare the most queries a GET request may need, as a ``query_budget`` attribute
+on class-based views or with the ``query_budget`` decorator. Requests over budget are
+logged as warnings, and fail ``QueryBudgetTestMixin.assertWithinBudget`` in tests.
+
+Recording forces the debug cursor, so it is off unless ``QUERY_INSTRUMENTATION`` is set,
+as it is in development.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+
+def fingerprint(sql):
+    """``sql`` with its literal values replaced, so repeats of one query compare equal."""
+    sql = _NUMBERS.sub('?', _STRINGS.sub('?', sql))
+    return ' '.join(_LISTS.sub('(...)', sql).split())
+
+
+def query_budget(queries):
+    """Declare the most queries a function view may run per request."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def get_query_budget(view):
+    view_class = getattr(view, 'view_class', None)
+    if view_class is not None and getattr(view_class, 'query_budget', None) is not None:
+        return view_class.query_budget
+    return getattr(view, 'query_budget', None)
+
+
+class RequestStats(object):
+    def __init__(self, view_name, queries, total_ms, budget, page_cache=None):
+        self.view_name = view_name
+        self.page_cache = page_cache
+        self.queries = len(queries)
+        self.sql_ms = sum(float(query['time']) for query in queries) * 1000
+        self.total_ms = total_ms
+        self.budget = budget
+        counts = Counter(fingerprint(query['sql']) for query in queries)
+        self.duplicates = dict((sql, count) for sql, count in counts.items() if count > 1)
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.queries > self.budget
+
+    def __str__(self):
+        text = '%s: %d queries (budget %s), %.1fms in SQL, %.1fms in total, %d duplicated' % (
+            self.view_name, self.queries, self.budget, self.sql_ms, self.total_ms, len(self.duplicates)
+        )
+        if self.page_cache:
+            text += ', page cache %s' % self.page_cache
+        return text
+
+
+def _ratio(part, whole):
+    return round(float(part) / whole, 3) if whole else None
+
+
+class Summary(object):
+    """Running totals per URL name, for this process only."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, stats):
+        with self.lock:
+            view = self.views.setdefault(stats.view_name, {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'sql_ms': 0.0, 'total_ms': 0.0,
+                'max_total_ms': 0.0, 'over_budget': 0, 'budget': stats.budget, 'duplicates': Counter(),
+                'cache_hits': 0, 'cache_misses': 0,
+            })
+            view['requests'] += 1
+            if stats.budget is not None:
+                view['budget'] = stats.budget
+            view['queries'] += stats.queries
+            view['max_queries'] = max(view['max_queries'], stats.queries)
+            view['sql_ms'] += stats.sql_ms
+            view['total_ms'] += stats.total_ms
+            view['max_total_ms'] = max(view['max_total_ms'], stats.total_ms)
+            view['over_budget'] += stats.over_budget
+            view['duplicates'].update(stats.duplicates)
+            view['cache_hits'] += stats.page_cache == 'hit'
+            view['cache_misses'] += stats.page_cache == 'miss'
+
+    def as_dict(self):
+        with self.lock:
+            return dict((name, {
+                'requests': view['requests'],
+                'budget': view['budget'],
+                'over_budget': view['over_budget'],
+                'avg_queries': round(float(view['queries']) / view['requests'], 1),
+                'max_queries': view['max_queries'],
+                'avg_sql_ms': round(view['sql_ms'] / view['requests'], 1),
+                'avg_total_ms': round(view['total_ms'] / view['requests'], 1),
+                'max_total_ms': round(view['max_total_ms'], 1),
+                'duplicates': dict(view['duplicates'].most_common(5)),
+                'cache_hits': view['cache_hits'],
+                'cache_misses': view['cache_misses'],
+                'cache_hit_ratio': _ratio(view['cache_hits'], view['cache_hits'] + view['cache_misses']),
+            }) for name, view in self.views.items())
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+summary = Summary()
+
+
+class QueryInstrumentationMiddleware(MiddlewareMixin):
+    """Record the queries and timing of each request to a resolved URL.
+
+    Queries run while a streaming response is consumed happen after the response
+    leaves the middleware and are not counted.
+    """
+
+    def process_request(self, request):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            return
+        request._instrumentation = (time.time(), len(connection.queries_log), connection.force_debug_cursor)
+        connection.force_debug_cursor = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Budgets cover reading pages; what a write costs depends on what it writes
+        if request.method in ('GET', 'HEAD'):
+            request._query_budget = get_query_budget(view_func)
+
+    def process_response(self, request, response):
+        state = getattr(request, '_instrumentation', None)
+        if state is None:
+            return response
+        started, first_query, force_debug_cursor = state
+        connection.force_debug_cursor = force_debug_cursor
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+        stats = RequestStats(
+            match.view_name, list(connection.queries_log)[first_query:], (time.time() - started) * 1000,
+            getattr(request, '_query_budget', None), getattr(request, '_page_cache', None)
+        )
+        summary.record(stats)
+        if stats.over_budget:
+            logger.warning('Over query budget: %s', stats)
+        else:
+            logger.info('%s', stats)
+        response.query_stats = stats
+        return response
+
+
+class QueryBudgetTestMixin(object):
+    """TestCase helpers failing a test when a view runs more queries than it declares."""
+
+    def assertWithinBudget(self, response):
+        stats = response.query_stats
+        self.assertIsNotNone(stats.budget, '%s declares no query budget' % stats.view_name)
+        self.assertFalse(stats.over_budget, 'Over query budget: %s\nRepeated queries:\n%s' % (
+            stats, '\n'.join('%dx %s' % (count, sql) for sql, count in stats.duplicates.items())
+        ))
+        return stats
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import SalesOrder, SupplyOrder
+from core.dashboard import invalidate_dashboard
+from core.pagecache import invalidate_pages
+
+
+class Command(BaseCommand):
+    help = (
+        'Move unpaid sales and supply orders between pending payment, overdue and critical as '
+        'their last delivery ages. Meant to run nightly, e.g. from cron.'
+    )
+
+    def handle(self, *args, **options):
+        moved = 0
+        with transaction.atomic():
+            for model in (SalesOrder, SupplyOrder):
+                counts = model.objects.age_payment_statuses()
+                for status, count in sorted(counts.items()):
+                    self.stdout.write('%s: %d moved to %s' % (model._meta.verbose_name_plural, count, status))
+                moved += sum(counts.values())
+            if moved:
+                transaction.on_commit(invalidate_dashboard)
+                transaction.on_commit(invalidate_pages)
+        self.stdout.write('Moved %d orders.' % moved)
@@ -0,0 +1,62 @@
+import json
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.timezone import now
+from core.benchmarks import scenarios
+from core.benchmarks.fixtures import generate_dataset
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the hot paths (order properties, order saves, dashboard, lists, details, search) '
+        'against the data in the database and write the results as JSON, to compare runs '
+        'across commits. --generate first adds a deterministic dataset; use a benchmark database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', action='store_true', default=False,
+                            help='Add a generated dataset before timing, and keep it')
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--suppliers', type=int, default=100)
+        parser.add_argument('--items', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=10000, help='Sales and supply orders each')
+        parser.add_argument('--lines', type=int, default=3, help='Lines per order')
+        parser.add_argument('--deliveries', type=int, default=1, help='Deliveries per line')
+        parser.add_argument('--payments', type=int, default=1, help='Payments per order')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--group', action='append', dest='groups',
+                            help='Only run this group of scenarios; may be repeated')
+        parser.add_argument('--output', help='File to write the JSON results to instead of standard output')
+
+    def handle(self, *args, **options):
+        dataset = dict((name, options[name]) for name in (
+            'customers', 'suppliers', 'items', 'orders', 'lines', 'deliveries', 'payments', 'seed'
+        ))
+        if options['generate']:
+            self.stderr.write('Generating %s...' % ', '.join('%s=%s' % item for item in sorted(dataset.items())))
+            generate_dataset(**dataset)
+        results = {
+            'commit': current_commit(),
+            'created': now().isoformat(),
+            'database': connection.vendor,
+            'python': sys.version.split()[0],
+            'dataset': dataset if options['generate'] else None,
+            'results': scenarios.run(repeat=options['repeat'], only=options['groups']),
+        }
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
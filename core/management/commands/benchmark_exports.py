@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.benchmarks import exports
+from core.benchmarks.fixtures import generate_order_fixture
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the streaming exports against a generated fixture of orders and payments. The '
+        'fixture is created in a transaction that is rolled back afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Orders to generate, each with a payment')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', default=False, help='Keep the fixture rows')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['rows']:
+                self.stderr.write('Generating %d orders...' % options['rows'])
+                generate_order_fixture(options['rows'], seed=options['seed'])
+            results = exports.run()
+            transaction.set_rollback(not options['keep'])
+        self.stdout.write(json.dumps(results, indent=2))
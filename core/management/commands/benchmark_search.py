@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from core.benchmarks import search
+from core.benchmarks.fixtures import generate_search_fixture
+from core.models import Customer, Supplier, Inventory, SalesOrder
+from core.search import create_search_indexes
+
+
+class Command(BaseCommand):
+    help = (
+        'Time ranked searches against a generated fixture. The fixture is created in a '
+        'transaction that is rolled back afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Customers, items and orders to generate')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs of each search')
+        parser.add_argument('--keep', action='store_true', default=False, help='Keep the fixture rows')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['rows']:
+                self.stderr.write('Generating %d rows...' % options['rows'])
+                generate_search_fixture(options['rows'], seed=options['seed'])
+            create_search_indexes(connection.alias)
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    for model in (Customer, Supplier, Inventory, SalesOrder):
+                        cursor.execute('ANALYZE %s' % model._meta.db_table)
+            results = search.run(repeat=options['repeat'])
+            transaction.set_rollback(not options['keep'])
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from core.models import StockMovement
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold stock movements older than --days into one balance row per item, keeping the '
+        'ledger table bounded. Meant to run nightly, e.g. from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Keep the movements of this many days')
+
+    def handle(self, *args, **options):
+        removed = StockMovement.objects.compact(now() - timedelta(days=options['days']))
+        self.stdout.write('Removed %d stock movements.' % removed)
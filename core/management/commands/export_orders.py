@@ -0,0 +1,47 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from core.exports import EXPORTS, FORMATS, ORDER_STATUS_FIELDS, day_bounds, export_rows, parse_day, stream
+
+
+class Command(BaseCommand):
+    help = ('Stream orders, payments or deliveries to a CSV or JSON lines file, optionally '
+            'limited to a date range and, for orders, a payment or order status.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write to instead of standard output')
+        parser.add_argument('--start', help='First day to include, YYYY-MM-DD')
+        parser.add_argument('--end', help='Last day to include, YYYY-MM-DD')
+        for field in ORDER_STATUS_FIELDS:
+            parser.add_argument('--' + field.replace('_', '-'), dest=field)
+
+    def handle(self, *args, **options):
+        name = options['name']
+        days = []
+        for option in ('start', 'end'):
+            try:
+                days.append(parse_day(options[option]))
+            except ValueError:
+                raise CommandError('--%s must be a date, YYYY-MM-DD' % option)
+        statuses = dict((field, options[field]) for field in ORDER_STATUS_FIELDS if options[field])
+        if statuses and not EXPORTS[name].status_fields:
+            raise CommandError('Only order exports can be filtered by status')
+
+        rows = export_rows(name, *day_bounds(*days), **statuses)
+        output = open(options['output'], 'w') if options['output'] else sys.stdout
+        started = time.time()
+        written = 0
+        try:
+            for chunk in stream(name, rows, options['format']):
+                output.write(chunk)
+                written += chunk.count('\n')
+        finally:
+            if options['output']:
+                output.close()
+        elapsed = time.time() - started
+        self.stderr.write('Wrote %d lines in %.1fs (%.0f lines/sec).' % (
+            written, elapsed, written / max(elapsed, 1e-6)
+        ))
@@ -0,0 +1,206 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import six
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from core.dashboard import invalidate_dashboard
+from core.models import (
+    Customer, Supplier, Inventory, SalesOrder, SalesOrderItem, SupplyOrder, SupplyOrderItem,
+    ImportCheckpoint, StockMovement, StockReservation
+)
+from core.numbering import assign_codes
+from core.pagecache import invalidate_pages
+from core.rollups import update_since_watermark
+
+KINDS = ('customers', 'suppliers', 'inventory', 'salesorders', 'supplyorders')
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+def read_rows(path):
+    """Yield the rows of a CSV or JSON lines file as dicts, one at a time."""
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif six.PY2:
+        with open(path, 'rb') as f:
+            for row in csv.DictReader(f):
+                yield dict((k.decode('utf-8'), (v or b'').decode('utf-8')) for k, v in row.items() if k)
+    else:
+        with io.open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+
+def chunks(rows, size, key=None):
+    """Split ``rows`` into lists of at least ``size`` rows, never splitting rows sharing a ``key``."""
+    chunk = []
+    groups = groupby(rows, key) if key else ((None, [row]) for row in rows)
+    for _, group in groups:
+        chunk.extend(group)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_when(value):
+    when = parse_datetime(value) or datetime.combine(parse_date(value), datetime.min.time())
+    if is_naive(when):
+        when = make_aware(when)
+    return when
+
+
+def import_counterparties(model, rows):
+    model.objects.bulk_create([
+        model(name=row['name'], email=row.get('email') or None, contact_phone=row.get('contact_phone') or None)
+        for row in rows
+    ])
+
+
+def import_inventory(rows):
+    items = [
+        Inventory(
+            item_name=row['item_name'], item_sku=row['item_sku'],
+            description=row.get('description') or None,
+            unit_price=Decimal(row.get('unit_price') or 0),
+            manage_stock=six.text_type(row.get('manage_stock', '')).lower() in TRUE_VALUES,
+            quantity=int(row.get('quantity') or 0),
+            min_threshold=int(row.get('min_threshold') or 0),
+        )
+        for row in rows
+    ]
+    for item in items:  # Set as Inventory.save would, which bulk_create bypasses
+        item.is_low_stock = item.manage_stock and item.quantity <= item.min_threshold
+    Inventory.objects.bulk_create(items)
+
+
+def import_orders(rows, order_model, line_model, order_field, counterparty_model, counterparty):
+    """Insert the orders in ``rows``, one row per order line, with two bulk inserts."""
+    names = set(row[counterparty] for row in rows)
+    counterparties = dict(counterparty_model.objects.filter(name__in=names).values_list('name', 'pk'))
+    if names - set(counterparties):
+        raise CommandError('Unknown %s: %s' % (counterparty, ', '.join(sorted(names - set(counterparties)))))
+    skus = set(row['item_sku'] for row in rows)
+    items = dict(Inventory.objects.filter(item_sku__in=skus).values_list('item_sku', 'pk'))
+    if skus - set(items):
+        raise CommandError('Unknown item_sku: %s' % ', '.join(sorted(skus - set(items))))
+
+    orders = []
+    for ref, group in groupby(rows, lambda row: row['order_ref']):
+        group = list(group)
+        order = order_model(order_date=parse_when(group[0]['order_date']))
+        setattr(order, counterparty + '_id', counterparties[group[0][counterparty]])
+        orders.append((order, group))
+    order_model.objects.bulk_create([order for order, group in orders])
+
+    line_model.objects.bulk_create([
+        line_model(**{
+            order_field: order, 'item_id': items[row['item_sku']],
+            'quantity_ordered': int(row['quantity_ordered']), 'unit_price': Decimal(row['unit_price']),
+        })
+        for order, group in orders for row in group
+    ], batch_size=1000)
+
+
+def finalize_orders(order_model, counterparty_model):
+    """Set-based pass over imported orders, which are the ones still without an order code."""
+    pending = order_model.objects.filter(order_code__isnull=True)
+    with transaction.atomic():
+        pending.rebuild_totals()
+        pending.refresh_statuses()
+        counterparty_model.objects.filter(
+            **{order_model._meta.model_name + '__order_code__isnull': True}
+        ).rebuild_balances()
+        if order_model is SalesOrder:  # Imported lines are undelivered, so all they order is reserved
+            StockReservation.objects.reserve(dict(
+                SalesOrderItem.objects.filter(sales_order__order_code__isnull=True).order_by().values(
+                    'item'
+                ).annotate(total=Sum('quantity_ordered')).values_list('item', 'total')
+            ))
+        return assign_codes(pending)
+
+
+class Command(BaseCommand):
+    help = ('Stream customers, suppliers, inventory or orders from a CSV or JSON lines file into the '
+            'database in bulk. Order files hold one line per row with order_ref, customer (or '
+            'supplier) name, order_date, item_sku, quantity_ordered and unit_price, and must '
+            'keep the lines of an order together. A failed import resumes from its last committed chunk '
+            'when run again on the same file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=1000, dest='chunk_size')
+        parser.add_argument(
+            '--restart', action='store_true', dest='restart', default=False,
+            help='Ignore the stored checkpoint and import the file from the start',
+        )
+
+    def handle(self, *args, **options):
+        kind, path = options['kind'], options['path']
+        if not os.path.exists(path):
+            raise CommandError('%s does not exist' % path)
+        if kind.endswith('orders') and not connection.features.can_return_ids_from_bulk_insert:
+            raise CommandError('Importing orders needs a database that returns ids from bulk inserts')
+
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(
+            source='%s:%s' % (kind, os.path.abspath(path))
+        )
+        if options['restart']:
+            checkpoint.rows_done = 0
+            checkpoint.save()
+        if checkpoint.rows_done:
+            self.stdout.write('Resuming after row %d' % checkpoint.rows_done)
+
+        importers = {
+            'customers': lambda rows: import_counterparties(Customer, rows),
+            'suppliers': lambda rows: import_counterparties(Supplier, rows),
+            'inventory': import_inventory,
+            'salesorders': lambda rows: import_orders(
+                rows, SalesOrder, SalesOrderItem, 'sales_order', Customer, 'customer'
+            ),
+            'supplyorders': lambda rows: import_orders(
+                rows, SupplyOrder, SupplyOrderItem, 'supply_order', Supplier, 'supplier'
+            ),
+        }
+        key = (lambda row: row['order_ref']) if kind.endswith('orders') else None
+        rows = islice(read_rows(path), checkpoint.rows_done, None)
+
+        imported = 0
+        started = time.time()
+        for chunk in chunks(rows, options['chunk_size'], key):
+            with transaction.atomic():
+                importers[kind](chunk)
+                ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(rows_done=F('rows_done') + len(chunk))
+            imported += len(chunk)
+            elapsed = time.time() - started
+            self.stdout.write('%d rows imported, %.0f rows/sec' % (imported, imported / max(elapsed, 1e-6)))
+
+        if kind == 'inventory':  # Open the ledger of the imported items at their quantity
+            StockMovement.objects.open_balances()
+        elif kind == 'salesorders':
+            finalize_orders(SalesOrder, Customer)
+        elif kind == 'supplyorders':
+            finalize_orders(SupplyOrder, Supplier)
+        # The file is done; importing it again, e.g. with new contents, starts from the top
+        ImportCheckpoint.objects.filter(pk=checkpoint.pk).delete()
+        update_since_watermark()
+        invalidate_dashboard()
+        invalidate_pages()
+        elapsed = time.time() - started
+        self.stdout.write('Imported %d rows in %.1fs (%.0f rows/sec).' % (
+            imported, elapsed, imported / max(elapsed, 1e-6)
+        ))
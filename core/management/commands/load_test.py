@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from core.benchmarks.load import DEFAULT_MIX, LoadRun, LocalServer
+
+
+def parse_mix(value):
+    """Parse ``name=weight,...`` into the pairs ``LoadRun`` takes."""
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        try:
+            mix.append((name.strip(), int(weight)))
+        except ValueError:
+            raise CommandError('Expected name=weight, got %r' % part)
+    return tuple(mix)
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a weighted mix of page reads and order, payment and delivery writes from many '
+        'concurrent clerks, and report latency percentiles and error rates per URL name. Writes '
+        'are real: point it at a scratch database, for instance one filled by benchmark --generate.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=50, help='Concurrent clerks')
+        parser.add_argument('--duration', type=int, default=60, help='Seconds to run for')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--url', help='Base URL of a running server; by default one is started in this process'
+        )
+        parser.add_argument(
+            '--mix', type=parse_mix, default=DEFAULT_MIX,
+            help='URL names and weights, e.g. core:index=5,core:salesorder_add=1 (default: %s)' % ','.join(
+                '%s=%d' % pair for pair in DEFAULT_MIX
+            )
+        )
+        parser.add_argument('--output', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        def run(url):
+            self.stderr.write('%d clerks against %s for %ds...' % (options['workers'], url, options['duration']))
+            return LoadRun(url, options['workers'], options['duration'], options['mix'], options['seed']).run()
+        try:
+            if options['url']:
+                report = run(options['url'])
+            else:
+                with LocalServer() as server:
+                    report = run(server.url)
+        except ValueError as e:
+            raise CommandError(e)
+        for name, view in sorted(report['views'].items()):
+            self.stdout.write('%-34s %6d req %5.1f%% err  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms' % (
+                name, view['requests'], view['error_rate'] * 100, view['p50_ms'], view['p95_ms'], view['p99_ms']
+            ))
+        self.stdout.write('%d requests in %.1fs, %.1f/s' % (
+            report['requests'], report['seconds'], report['requests_per_sec']
+        ))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
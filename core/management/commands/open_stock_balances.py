@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import StockMovement
+
+
+class Command(BaseCommand):
+    help = (
+        'Write one balance row to the stock ledger for every item whose movements do not add up '
+        'to its quantity, such as items stocked before the ledger was kept. Safe to run again.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = StockMovement.objects.open_balances()
+        self.stdout.write('Opened balances for %d items.' % written)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Customer, Supplier, SalesOrder, SupplyOrder, Inventory, StockReservation
+from core.dashboard import invalidate_dashboard
+from core.pagecache import invalidate_pages
+
+
+class Command(BaseCommand):
+    help = ('Recompute the stored order totals from the order items, payments and deliveries, '
+            'the customer and supplier balances from the confirmed orders, the stock reserved for '
+            'undelivered sales order lines and the low stock flags')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sales_orders = SalesOrder.objects.rebuild_totals()
+            supply_orders = SupplyOrder.objects.rebuild_totals()
+            Customer.objects.rebuild_balances()
+            Supplier.objects.rebuild_balances()
+            StockReservation.objects.rebuild()
+            Inventory.objects.refresh_low_stock()
+        invalidate_dashboard()
+        invalidate_pages()
+        self.stdout.write('Rebuilt totals for %d sales orders and %d supply orders.' % (
+            sales_orders, supply_orders
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from core.rollups import update_since_watermark, rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily rollup rows for the days touched since the stored watermark'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full', default=False,
+            help='Rebuild every day instead of only those touched since the watermark',
+        )
+
+    def handle(self, *args, **options):
+        if options['full']:
+            rebuild_all()
+            self.stdout.write('Rebuilt all rollups.')
+            return
+        days = update_since_watermark()
+        self.stdout.write('Rebuilt rollups for %d days.' % len(days))
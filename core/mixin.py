@@ -1,4 +1,5 @@
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 
 
 class AjaxableResponseMixin(object):
@@ -25,3 +26,29 @@ class AjaxableResponseMixin(object):
             return JsonResponse(data)
         else:
             return response
+
+
+class CounterpartyFilterMixin(object):
+    """
+    Mixin to list only the rows of one customer or supplier, named by its pk in the
+    query string, e.g. ``?customer=12``. Must be used with a ListView.
+    """
+    counterparty_model = None
+    counterparty_lookup = None  # The queryset filter leading to the counterparty
+
+    def get_counterparty(self):
+        if not hasattr(self, '_counterparty'):
+            pk = self.request.GET.get(self.counterparty_model._meta.model_name, '')
+            self._counterparty = get_object_or_404(self.counterparty_model, pk=pk) if pk.isdigit() else None
+        return self._counterparty
+
+    def filter_counterparty(self, queryset):
+        counterparty = self.get_counterparty()
+        if counterparty is None:
+            return queryset
+        return queryset.filter(**{self.counterparty_lookup: counterparty})
+
+    def get_context_data(self, **kwargs):
+        context = super(CounterpartyFilterMixin, self).get_context_data(**kwargs)
+        context['counterparty'] = self.get_counterparty()
+        return context
@@ -1,10 +1,20 @@
 from __future__ import unicode_literals
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import Avg, Sum, Max, Min, Count, F, Q, ExpressionWrapper as E
+from django.db.models import (
+    Avg, Sum, Max, Min, Count, F, Q, ExpressionWrapper as E, OuterRef, Subquery, Exists, Case, When, Value,
+    Prefetch
+)
+from django.db.models.base import DEFERRED
+from django.db.models.functions import Coalesce
+from django.conf import settings
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.utils.timezone import now
-from django.db import models
+from django.db import models, transaction, IntegrityError
+import random
+from collections import defaultdict
+from datetime import timedelta
 from uuid import uuid4
+from .pagecache import pages_changed
 
 # All currency is in Kenya Shillings. TODO Support multi currency
 
@@ -29,9 +39,96 @@ ORDER_STATUS = (
     ('complete', 'Complete'),
 )
 
+STOCK_MOVEMENT_REASONS = (
+    ('sale', 'Delivered to a customer'),
+    ('receipt', 'Received from a supplier'),
+    ('adjustment', 'Adjusted by hand'),
+    ('balance', 'Opening balance or balance of compacted movements'),
+)
+
+
+def _add_deltas(queryset, deltas):
+    """Atomically add ``deltas``, keyed by field name, to the rows of ``queryset``."""
+    changes = dict((name, F(name) + delta) for name, delta in deltas.items() if delta)
+    if not changes:
+        return 0
+    return queryset.update(**changes)
+
+
+class LoadedValuesMixin(object):
+    """Remembers the field values an instance was loaded with, so signals can apply deltas."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(LoadedValuesMixin, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_loaded_values(self, *field_names):
+        """Values of ``field_names`` as stored in the database, or None for a new instance."""
+        if self._state.adding:
+            return None
+        loaded = getattr(self, '_loaded_values', {})
+        if all(loaded.get(name, DEFERRED) is not DEFERRED for name in field_names):
+            return dict((name, loaded[name]) for name in field_names)
+        return type(self)._default_manager.filter(pk=self.pk).values(*field_names).first()
+
+    def get_stored_values(self, *field_names):
+        """Values of ``field_names`` in the database row now, or None for a new instance.
+
+        Unlike the loaded values these are not stale when the row was saved through another
+        instance since. Inside a transaction the row stays locked until it ends, so saves of
+        the same row apply their deltas one after the other.
+        """
+        if self._state.adding:
+            return None
+        queryset = type(self)._default_manager.filter(pk=self.pk)
+        if transaction.get_connection().in_atomic_block:
+            queryset = queryset.select_for_update()
+        return queryset.values(*field_names).first()
+
+    def remember_loaded_values(self):
+        """Make the current field values the baseline for the next delta, after a save."""
+        self._loaded_values = dict(
+            (f.attname, self.__dict__[f.attname]) for f in self._meta.concrete_fields
+            if f.attname in self.__dict__
+        )
+
+
+class CustomerQuerySet(models.QuerySet):
+    def add_to_balance(self, **deltas):
+        return _add_deltas(self, deltas)
+
+    def with_order_count(self):
+        """Annotate the number of orders, read by ``total_orders``."""
+        return self.annotate(order_count=Count('salesorder'))
+
+    def rebuild_balances(self):
+        """Recompute total paid and total due of the selected customers from their orders."""
+        return self.update(
+            total_paid=_sum_subquery(SalesOrder.objects.all(), 'customer', F('total_paid')),
+            total_due=_sum_subquery(SalesOrder.objects.all(), 'customer', F('amount_due')),
+        )
+
+
+class SupplierQuerySet(models.QuerySet):
+    def add_to_balance(self, **deltas):
+        return _add_deltas(self, deltas)
+
+    def with_order_count(self):
+        """Annotate the number of orders, read by ``total_orders``."""
+        return self.annotate(order_count=Count('supplyorder'))
+
+    def rebuild_balances(self):
+        """Recompute total paid and total due of the selected suppliers from their confirmed orders."""
+        return self.update(
+            total_paid=_sum_subquery(SupplyOrder.objects.confirmed(), 'supplier', F('total_paid')),
+            total_due=_sum_subquery(SupplyOrder.objects.confirmed(), 'supplier', F('amount_due')),
+        )
+
 
 class Customer(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     email = models.EmailField(blank=True, null=True)
     contact_phone = models.CharField(max_length=30, blank=True, null=True)
     currency = models.CharField(max_length=3, choices=CURRENCY, default='KES')
@@ -42,6 +139,8 @@ class Customer(models.Model):
         max_digits=9, decimal_places=2, default=0, editable=False
     )
 
+    objects = CustomerQuerySet.as_manager()
+
     class Meta:
         ordering = ['name', 'email']
 
@@ -53,11 +152,13 @@ class Customer(models.Model):
 
     @property
     def total_orders(self):
+        if hasattr(self, 'order_count'):  # See ``with_order_count``
+            return self.order_count
         return self.salesorder_set.count()
 
 
 class Supplier(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     email = models.EmailField(blank=True, null=True)
     contact_phone = models.CharField(max_length=30, blank=True, null=True)
     currency = models.CharField(max_length=3, choices=CURRENCY, default='KES')
@@ -68,6 +169,8 @@ class Supplier(models.Model):
         max_digits=9, decimal_places=2, default=0, editable=False
     )
 
+    objects = SupplierQuerySet.as_manager()
+
     class Meta:
         ordering = ['name', 'email']
 
@@ -79,10 +182,79 @@ class Supplier(models.Model):
 
     @property
     def total_orders(self):
+        if hasattr(self, 'order_count'):  # See ``with_order_count``
+            return self.order_count
         return self.supplyorder_set.count()
 
 
-class Inventory(models.Model):
+def _low_stock(change=0):
+    """Case expression telling whether an item is low on stock once its quantity moves by ``change``."""
+    return Case(
+        When(manage_stock=True, quantity__lte=F('min_threshold') - change, then=Value(True)),
+        default=Value(False), output_field=models.BooleanField()
+    )
+
+
+class InventoryQuerySet(models.QuerySet):
+    def refresh_low_stock(self):
+        """Recompute the stored low stock flag of the selected items."""
+        return self.update(is_low_stock=_low_stock())
+
+    def reorder_candidates(self):
+        """Items low on stock, with what open supply orders will still bring in, in one query.
+
+        ``on_order`` is the quantity ordered on undelivered supply orders less what has
+        arrived of it, and ``shortfall`` what must be ordered on top of that to lift the
+        item above its threshold. ``last_supplier`` and ``last_unit_price`` come from the
+        item's latest supply order line.
+        """
+        integer = models.IntegerField()
+        ordered = SupplyOrderItem.objects.filter(
+            item=OuterRef('pk'), supply_order__order_status='pending deliveries'
+        ).order_by().values('item').annotate(total=Sum('quantity_ordered')).values('total')
+        received = SupplyOrderItemDelivery.objects.filter(
+            item__item=OuterRef('pk'), item__supply_order__order_status='pending deliveries'
+        ).order_by().values('item__item').annotate(total=Sum('quantity_delivered')).values('total')
+        latest = SupplyOrderItem.objects.filter(item=OuterRef('pk')).order_by('-supply_order__order_date', '-pk')
+        return self.filter(is_low_stock=True).annotate(
+            on_order=Coalesce(Subquery(ordered, output_field=integer), 0) -
+            Coalesce(Subquery(received, output_field=integer), 0),
+            last_supplier=Subquery(latest.values('supply_order__supplier')[:1], output_field=integer),
+            last_supplier_name=Subquery(
+                latest.values('supply_order__supplier__name')[:1], output_field=models.CharField()
+            ),
+            last_unit_price=Subquery(latest.values('unit_price')[:1], output_field=models.DecimalField()),
+        ).annotate(
+            shortfall=F('min_threshold') - F('quantity') - F('on_order') + 1
+        ).order_by('item_name')
+
+    def with_availability(self):
+        """Annotate ``reserved``, the stock held for undelivered order lines, and ``available``."""
+        reserved = StockReservation.objects.filter(item=OuterRef('pk')).order_by().values('item').annotate(
+            total=Sum('reserved')
+        ).values('total')
+        return self.annotate(
+            reserved=Coalesce(Subquery(reserved, output_field=models.IntegerField()), 0)
+        ).annotate(available=F('quantity') - F('reserved'))
+
+    def availability(self, item_ids):
+        """``{item id: available}`` for many items in one query; None for items not managing stock."""
+        return dict(
+            (pk, available if manage_stock else None) for pk, manage_stock, available in self.filter(
+                pk__in=item_ids
+            ).with_availability().values_list('pk', 'manage_stock', 'available')
+        )
+
+    def has_stock(self, quantities):
+        """``{item id: bool}`` telling whether each item can supply the quantity wanted of it, in one query."""
+        available = self.availability(list(quantities))
+        return dict(
+            (pk, pk in available and (available[pk] is None or available[pk] >= quantity))
+            for pk, quantity in quantities.items()
+        )
+
+
+class Inventory(LoadedValuesMixin, models.Model):
     item_name = models.CharField(max_length=255, unique=True)
     item_sku = models.CharField(max_length=30, unique=True)
     description = models.TextField(blank=True, null=True)
@@ -94,6 +266,12 @@ class Inventory(models.Model):
     item_status = models.CharField(
         max_length=20, choices=ITEM_STATUS, default=ITEM_STATUS[0][0]
     )
+    is_low_stock = models.BooleanField(
+        default=False, editable=False, db_index=True,
+        help_text='Stock is managed and at or below the threshold; kept current with every stock movement'
+    )
+
+    objects = InventoryQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('inventory')
@@ -106,11 +284,39 @@ class Inventory(models.Model):
         return reverse('core:item', kwargs={'pk': self.pk})
 
     def has_stock(self):
+        """Whether any stock is left once undelivered orders are served; see ``with_availability``."""
         if self.manage_stock:
-            return bool(self.quantity)
+            available = getattr(self, 'available', None)
+            if available is None:
+                available = Inventory.objects.availability([self.pk]).get(self.pk, 0)
+            return available > 0
         else:
             return True
 
+    def save(self, *args, **kwargs):
+        """Save the item, recording a changed quantity in the stock ledger as an adjustment."""
+        loaded = self.get_loaded_values('quantity')
+        if loaded is not None and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            # Deliveries move the stored quantity concurrently, never write back the loaded one
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('quantity', 'is_low_stock')
+            ]
+        if loaded is None:
+            self.is_low_stock = self.manage_stock and self.quantity <= self.min_threshold
+        with transaction.atomic():
+            super(Inventory, self).save(*args, **kwargs)
+            if loaded is None:
+                if self.quantity:
+                    StockMovement.objects.create(item=self, quantity=self.quantity, reason='adjustment')
+            elif self.quantity != loaded['quantity']:
+                StockMovement.objects.record([
+                    StockMovement(item=self, quantity=self.quantity - loaded['quantity'], reason='adjustment')
+                ])
+            else:  # The threshold or whether stock is managed may have changed
+                Inventory.objects.filter(pk=self.pk).refresh_low_stock()
+        self.remember_loaded_values()
+
 
 class ItemImage(models.Model):
     item = models.ForeignKey('Inventory')
@@ -120,11 +326,306 @@ class ItemImage(models.Model):
         return reverse('core:item', kwargs={'pk': self.item.pk})
 
 
-class SalesOrder(models.Model):
+class InsufficientStock(Exception):
+    """Stock-managed items would go below zero; ``items`` holds their ids."""
+
+    def __init__(self, items):
+        super(InsufficientStock, self).__init__('Not enough stock of items %s' % ', '.join(map(str, items)))
+        self.items = items
+
+
+class StockMovementQuerySet(models.QuerySet):
+    def record(self, movements):
+        """Write unsaved ``movements`` and move the stock of their items by them.
+
+        Each item is changed by one conditional UPDATE, which locks only that row, in item id
+        order so concurrent callers cannot deadlock. If an item that manages stock would go
+        below zero nothing is written and ``InsufficientStock`` is raised.
+        """
+        totals = defaultdict(int)
+        for movement in movements:
+            totals[movement.item_id] += movement.quantity
+        with transaction.atomic():
+            short = []
+            for item_id, quantity in sorted(totals.items()):
+                items = Inventory.objects.filter(pk=item_id)
+                if quantity < 0:
+                    items = items.filter(Q(manage_stock=False) | Q(quantity__gte=-quantity))
+                if quantity and not items.update(
+                    quantity=F('quantity') + quantity, is_low_stock=_low_stock(quantity)
+                ):
+                    short.append(item_id)
+            if short:
+                raise InsufficientStock(short)
+            self.bulk_create([movement for movement in movements if movement.quantity])
+
+    def open_balances(self):
+        """Write a balance row for every item whose movements do not add up to its quantity.
+
+        Items stocked before the ledger existed, or bulk imported, have no movements; their
+        row opens the ledger at the current quantity. Returns the number of rows written.
+        """
+        ledger = self.filter(item=OuterRef('pk')).order_by().values('item').annotate(
+            total=Sum('quantity')
+        ).values('total')
+        gaps = Inventory.objects.annotate(
+            ledger=Coalesce(Subquery(ledger, output_field=models.IntegerField()), 0)
+        ).exclude(quantity=F('ledger')).values_list('pk', 'quantity', 'ledger')
+        balances = [
+            self.model(item_id=pk, quantity=quantity - ledger, reason='balance') for pk, quantity, ledger in gaps
+        ]
+        self.bulk_create(balances, batch_size=1000)
+        return len(balances)
+
+    def compact(self, before):
+        """Fold the movements made before ``before`` into one balance row per item.
+
+        Returns the number of rows removed from the ledger.
+        """
+        with transaction.atomic():
+            old = self.filter(created__lt=before)
+            last_id = old.aggregate(last_id=Max('pk'))['last_id']
+            if last_id is None:
+                return 0
+            old = old.filter(pk__lte=last_id)
+            balances = list(old.order_by().values_list('item').annotate(total=Sum('quantity')))
+            removed, counts = old.delete()
+            balances = [
+                self.model(item_id=item_id, quantity=total, reason='balance', created=before)
+                for item_id, total in balances if total
+            ]
+            self.bulk_create(balances)
+        return removed - len(balances)
+
+
+class StockMovement(models.Model):
+    """A change in the stock of an item; the movements of an item add up to its quantity."""
+    item = models.ForeignKey('Inventory')
+    quantity = models.IntegerField(help_text='Positive for stock coming in, negative for stock going out')
+    reason = models.CharField(max_length=20, choices=STOCK_MOVEMENT_REASONS)
+    delivery_id = models.IntegerField(
+        blank=True, null=True, help_text='The sales or supply delivery, for sales and receipts'
+    )
+    created = models.DateTimeField(default=now, db_index=True)
+
+    objects = StockMovementQuerySet.as_manager()
+
+    def __str__(self):
+        return '%s %+d (%s)' % (self.item_id, self.quantity, self.reason)
+
+
+class AtomicSaveMixin(object):
+    """Saves and deletes run in one transaction with whatever their signals write."""
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(AtomicSaveMixin, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super(AtomicSaveMixin, self).delete(*args, **kwargs)
+
+
+class AtomicUpdateMixin(object):
+    """Updates and deletes run in one transaction with whatever their signals write.
+
+    Inserts are left alone: they read nothing to lock, and order lines are inserted by
+    the hundred, where a savepoint each would triple the queries.
+    """
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super(AtomicUpdateMixin, self).save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            super(AtomicUpdateMixin, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super(AtomicUpdateMixin, self).delete(*args, **kwargs)
+
+
+ORDER_TOTAL_FIELDS = ('order_value', 'total_paid', 'amount_due', 'last_delivery_date')
+
+
+def _sum_subquery(queryset, fk_name, expression):
+    """Correlated subquery summing ``expression`` over the rows of ``queryset`` for the outer order."""
+    queryset = queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(
+        total=Sum(E(expression, output_field=models.DecimalField()))
+    ).values('total')
+    return Coalesce(
+        Subquery(queryset, output_field=models.DecimalField()), 0,
+        output_field=models.DecimalField()
+    )
+
+
+def _count_subquery(queryset, fk_name):
+    """Correlated subquery counting the rows of ``queryset`` for the outer order."""
+    queryset = queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(
+        count=Count('pk')
+    ).values('count')
+    return Coalesce(Subquery(queryset, output_field=models.IntegerField()), 0)
+
+
+def _max_subquery(queryset, fk_name, field_name):
+    """Correlated subquery returning the latest ``field_name`` in ``queryset`` for the outer order."""
+    queryset = queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(
+        latest=Max(field_name)
+    ).values('latest')
+    return Subquery(queryset, output_field=models.DateTimeField())
+
+
+class OrderTotalsQuerySet(models.QuerySet):
+    # Condition on the stored totals of a paid order, as ``is_paid`` tests it; set by each order queryset
+    paid_condition = None
+
+    def add_to_totals(self, **deltas):
+        return _add_deltas(self, deltas)
+
+    def age_payment_statuses(self, current=None):
+        """Move unpaid orders to the status their last delivery date now falls in.
+
+        Orders are told unpaid by their totals, not their stored status, which a payment
+        saved outside a coalesced batch leaves behind. Only rows whose status changes are
+        written. Returns the number moved into each status.
+        """
+        buckets = _aging_buckets(current or now())
+        unpaid = self.exclude(self.paid_condition)
+        return dict(
+            (status, unpaid.filter(condition).exclude(payment_status=status).update(payment_status=status))
+            for status, condition in buckets
+        )
+
+    def extend_last_delivery(self, delivery_date):
+        """Move ``last_delivery_date`` forward to ``delivery_date`` where it is older or unset."""
+        return self.filter(
+            Q(last_delivery_date__isnull=True) | Q(last_delivery_date__lt=delivery_date)
+        ).update(last_delivery_date=delivery_date)
+
+
+def _aging_buckets(current):
+    """The payment status of an unpaid order and the condition on its last delivery for it."""
+    return (
+        ('pending payment',
+         Q(last_delivery_date__isnull=True) | Q(last_delivery_date__gt=current - timedelta(days=31))),
+        ('overdue', Q(last_delivery_date__lte=current - timedelta(days=31),
+                      last_delivery_date__gt=current - timedelta(days=61))),
+        ('critical', Q(last_delivery_date__lte=current - timedelta(days=61))),
+    )
+
+
+def _payment_status(paid):
+    """Case expression giving the status ``get_payment_status`` would return for each order."""
+    return Case(
+        When(paid, then=Value('paid')),
+        *[When(condition, then=Value(status)) for status, condition in _aging_buckets(now())],
+        output_field=models.CharField()
+    )
+
+
+class OrderCodeMixin(object):
+    @property
+    def display_code(self):
+        """The order code with the prefix configured for the order type."""
+        return '%s%s' % (settings.ORDER_CODE_PREFIXES.get(self._meta.model_name, ''), self.order_code)
+
+
+class StoredTotalsMixin(object):
+    """Orders whose totals are stored columns maintained by atomic delta updates."""
+
+    def save(self, *args, **kwargs):
+        # Never write back in-memory totals, other lines may have moved them on since loading
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ORDER_TOTAL_FIELDS
+            ]
+        try:
+            super(StoredTotalsMixin, self).save(*args, **kwargs)
+        finally:
+            self._summary = None
+
+    def refresh_summary(self):
+        """Reload the stored totals, and whether every line is delivered, in one query.
+
+        The result is kept until the save in progress ends; ``is_delivery_complete``
+        reads it rather than the lines.
+        """
+        if self._state.adding:  # No lines yet
+            self._summary = {'delivery_complete': True}
+            return self._summary
+        self._summary = type(self)._default_manager.filter(pk=self.pk).with_summary().values(
+            'delivery_complete', *ORDER_TOTAL_FIELDS
+        ).get()
+        for name in ORDER_TOTAL_FIELDS:
+            setattr(self, name, self._summary[name])
+        return self._summary
+
+
+class SalesOrderQuerySet(OrderTotalsQuerySet):
+    paid_condition = Q(total_paid=F('order_value'))
+
+    def confirmed(self):
+        """The orders counted in balances, rollups and the dashboard; every sales order is."""
+        return self.all()
+
+    def with_totals(self):
+        """Fetch the customer in the same query as the orders, the totals being stored columns."""
+        return self.select_related('customer')
+
+    def with_item_count(self):
+        """Annotate ``item_count``, the number of lines, without grouping the orders."""
+        return self.annotate(item_count=_count_subquery(SalesOrderItem.objects.all(), 'sales_order'))
+
+    def with_summary(self):
+        """Annotate ``delivery_complete``, whether every line is delivered."""
+        return self.annotate(delivery_complete=~Exists(
+            SalesOrderItem.objects.filter(sales_order=OuterRef('pk'), is_delivered=False)
+        ))
+
+    def with_lines(self):
+        """Also fetch the lines with their items and deliveries, and the payments, in two more queries."""
+        return self.with_totals().prefetch_related(
+            Prefetch('salesorderitem_set', queryset=SalesOrderItem.objects.with_deliveries().order_by('pk')),
+            Prefetch('salesorderpayment_set', queryset=SalesOrderPayment.objects.order_by('pk')),
+        )
+
+    def refresh_statuses(self):
+        """Recompute the stored payment and order status of the selected orders."""
+        self.update(payment_status=_payment_status(self.paid_condition))
+        self.filter(salesorderitem__is_delivered=False).update(order_status='pending deliveries')
+        self.exclude(salesorderitem__is_delivered=False).update(order_status='complete')
+
+    def refresh_last_delivery(self):
+        return self.update(last_delivery_date=_max_subquery(
+            SalesOrderItemDelivery.objects.all(), 'item__sales_order', 'delivery_date'
+        ))
+
+    def rebuild_totals(self):
+        """Recompute the stored totals of the selected orders from their lines and payments."""
+        def order_value():
+            return _sum_subquery(
+                SalesOrderItem.objects.all(), 'sales_order', F('unit_price') * F('quantity_ordered')
+            )
+
+        def total_paid():
+            return _sum_subquery(SalesOrderPayment.objects.all(), 'sales_order', F('amount_paid'))
+
+        return self.update(
+            order_value=order_value(),
+            total_paid=total_paid(),
+            amount_due=E(order_value() - total_paid(), output_field=models.DecimalField()),
+            last_delivery_date=_max_subquery(
+                SalesOrderItemDelivery.objects.all(), 'item__sales_order', 'delivery_date'
+            ),
+        )
+
+
+class SalesOrder(OrderCodeMixin, StoredTotalsMixin, LoadedValuesMixin, models.Model):
     order_code = models.IntegerField(editable=False, unique=True, null=True)
     customer = models.ForeignKey('Customer')
     items = models.ManyToManyField('Inventory', through='SalesOrderItem')
-    order_date = models.DateTimeField()
+    order_date = models.DateTimeField(db_index=True)
     payment_status = models.CharField(
         max_length=20, choices=PAYMENT_STATUS, default=PAYMENT_STATUS[0][0],
         editable=False
@@ -133,6 +634,22 @@ class SalesOrder(models.Model):
         max_length=20, choices=ORDER_STATUS, default=ORDER_STATUS[0][0],
         editable=False
     )
+    order_value = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, editable=False, db_index=True
+    )
+    total_paid = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, editable=False
+    )
+    amount_due = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, editable=False, db_index=True
+    )
+    last_delivery_date = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = SalesOrderQuerySet.as_manager()
+
+    class Meta:
+        # A customer's order history, newest first
+        indexes = [models.Index(fields=['customer', 'order_date'])]
 
     def __str__(self):
         return self.customer.name
@@ -140,40 +657,18 @@ class SalesOrder(models.Model):
     def get_absolute_url(self):
         return reverse('core:salesorder', kwargs={'pk': self.pk})
 
-    @property
-    def total_paid(self):
-        queryset = self.salesorderpayment_set.aggregate(Sum('amount_paid'))
-        return queryset['amount_paid__sum'] or 0
-
     @property
     def order_currency(self):
         return 'KES'
 
-    @property
-    def order_value(self):
-        queryset = self.salesorderitem_set.aggregate(
-            order_value=Sum(E(F('unit_price')*F('quantity_ordered'), output_field=models.DecimalField())),
-        )
-        return queryset['order_value'] or 0
-
-    @property
-    def amount_due(self):
-        return self.order_value - self.total_paid
-
     @property
     def is_paid(self):
         return self.total_paid == self.order_value
 
-    @property
-    def last_delivery_date(self):
-        max_dates = [item.last_delivery_date for item in self.salesorderitem_set.all()
-                     if item.last_delivery_date]
-        if max_dates:
-            return max(max_dates)
-        return None
-
     @property
     def is_delivery_complete(self):
+        if getattr(self, '_summary', None) is not None:  # See ``refresh_summary``
+            return self._summary['delivery_complete']
         return all([item.is_delivered for item in self.salesorderitem_set.all()])
 
     def get_payment_status(self):
@@ -195,7 +690,30 @@ class SalesOrder(models.Model):
         return 'pending deliveries'
 
 
-class SalesOrderItem(models.Model):
+class OrderLineQuerySet(models.QuerySet):
+    def with_deliveries(self):
+        """Fetch the item and annotate the quantity delivered and the last delivery date of each line."""
+        deliveries = self.model._meta.model_name + 'delivery'
+        return self.select_related('item').annotate(
+            delivered_quantity=Coalesce(Sum(deliveries + '__quantity_delivered'), 0),
+            latest_delivery_date=Max(deliveries + '__delivery_date'),
+        )
+
+
+class SalesOrderItemQuerySet(OrderLineQuerySet):
+    def refresh_delivered(self):
+        """Recompute ``is_delivered`` of the selected lines from their deliveries."""
+        delivered = SalesOrderItemDelivery.objects.filter(item=OuterRef('pk')).order_by().values(
+            'item'
+        ).annotate(total=Sum('quantity_delivered')).values('total')
+        return self.update(is_delivered=Case(
+            When(quantity_ordered=Coalesce(Subquery(delivered, output_field=models.IntegerField()), 0),
+                 then=Value(True)),
+            default=Value(False), output_field=models.BooleanField(),
+        ))
+
+
+class SalesOrderItem(AtomicUpdateMixin, LoadedValuesMixin, models.Model):
     sales_order = models.ForeignKey('SalesOrder')
     item = models.ForeignKey('Inventory')
     quantity_ordered = models.IntegerField()
@@ -203,6 +721,8 @@ class SalesOrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=9, decimal_places=2, default=0)
     is_delivered = models.BooleanField(default=False, editable=False)
 
+    objects = SalesOrderItemQuerySet.as_manager()
+
     class Meta:
         unique_together = (("sales_order", "item"),)
 
@@ -218,11 +738,15 @@ class SalesOrderItem(models.Model):
 
     @property
     def quantity_delivered(self):
+        if hasattr(self, 'delivered_quantity'):  # See ``with_deliveries``
+            return self.delivered_quantity
         queryset = self.salesorderitemdelivery_set.aggregate(Sum('quantity_delivered'))
         return queryset['quantity_delivered__sum'] or 0
 
     @property
     def last_delivery_date(self):
+        if hasattr(self, 'latest_delivery_date'):
+            return self.latest_delivery_date
         try:
             last_delivery = self.salesorderitemdelivery_set.latest('delivery_date')
             return last_delivery.delivery_date or None
@@ -230,11 +754,52 @@ class SalesOrderItem(models.Model):
             return None
 
 
-class SalesOrderItemDelivery(models.Model):
+class SalesOrderItemDeliveryQuerySet(models.QuerySet):
+    def bulk_record(self, quantities, delivery_date):
+        """Record deliveries for many order lines in one insert, refreshing each affected order once.
+
+        ``quantities`` maps order line ids to the quantity delivered. Raises
+        ``InsufficientStock``, recording nothing, if an item is short.
+        """
+        deliveries = [
+            self.model(item_id=item_id, quantity_delivered=quantity, delivery_date=delivery_date)
+            for item_id, quantity in quantities.items() if quantity
+        ]
+        if not deliveries:
+            return 0
+        with transaction.atomic():
+            self.bulk_create(deliveries)
+            items = SalesOrderItem.objects.filter(pk__in=[d.item_id for d in deliveries])
+            lines = items.values_list('pk', 'item_id', 'sales_order_id')
+            stock_items = dict((pk, item_id) for pk, item_id, order_id in lines)
+            StockMovement.objects.record([
+                StockMovement(
+                    item_id=stock_items[d.item_id], quantity=-d.quantity_delivered, reason='sale', delivery_id=d.pk
+                ) for d in deliveries
+            ])
+            consumed = defaultdict(int)
+            for d in deliveries:
+                consumed[stock_items[d.item_id]] -= d.quantity_delivered
+            StockReservation.objects.reserve(consumed)
+            items.refresh_delivered()
+            orders = SalesOrder.objects.filter(pk__in=items.values('sales_order'))
+            if delivery_date:
+                orders.extend_last_delivery(delivery_date)
+            orders.refresh_statuses()
+            scopes = [('salesorder', None), ('stock', None)]
+            for pk, item_id, order_id in lines:
+                scopes.extend([('salesorder', order_id), ('inventory', item_id)])
+            pages_changed(scopes)
+        return len(deliveries)
+
+
+class SalesOrderItemDelivery(AtomicSaveMixin, LoadedValuesMixin, models.Model):
     item = models.ForeignKey('SalesOrderItem')
     quantity_delivered = models.IntegerField()
     delivery_date = models.DateTimeField(blank=True, null=True)
 
+    objects = SalesOrderItemDeliveryQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('sales order delivery')
         verbose_name_plural = _('sales order deliveries')
@@ -247,7 +812,7 @@ class SalesOrderItemDelivery(models.Model):
         return reverse('core:salesorder', kwargs={'pk': self.item.sales_order.pk})
 
 
-class SalesOrderPayment(models.Model):
+class SalesOrderPayment(AtomicUpdateMixin, LoadedValuesMixin, models.Model):
     sales_order = models.ForeignKey('SalesOrder')
     payment_code = models.CharField(max_length=30, unique=True, editable=False)
     currency = models.CharField(max_length=3, choices=CURRENCY, default='KES')
@@ -265,11 +830,76 @@ class SalesOrderPayment(models.Model):
         return str(self.sales_order.order_code) + str(uuid4()).split('-')[0]
 
 
-class SupplyOrder(models.Model):
+class SupplyOrderQuerySet(OrderTotalsQuerySet):
+    paid_condition = Q(total_paid__gte=F('amount_due'))
+
+    def confirmed(self):
+        """The orders counted in balances, rollups and the dashboard, leaving out drafts."""
+        return self.filter(is_draft=False)
+
+    def with_totals(self):
+        """Fetch the supplier in the same query as the orders, the totals being stored columns."""
+        return self.select_related('supplier')
+
+    def with_item_count(self):
+        """Annotate ``item_count``, the number of lines, without grouping the orders."""
+        return self.annotate(item_count=_count_subquery(SupplyOrderItem.objects.all(), 'supply_order'))
+
+    def with_summary(self):
+        """Annotate ``delivery_complete``, whether every line is delivered."""
+        return self.annotate(delivery_complete=~Exists(
+            SupplyOrderItem.objects.filter(supply_order=OuterRef('pk')).order_by().annotate(
+                delivered=Coalesce(Sum('supplyorderitemdelivery__quantity_delivered'), 0)
+            ).exclude(delivered=F('quantity_ordered'))
+        ))
+
+    def with_lines(self):
+        """Also fetch the lines with their items and deliveries, and the payments, in two more queries."""
+        return self.with_totals().prefetch_related(
+            Prefetch('supplyorderitem_set', queryset=SupplyOrderItem.objects.with_deliveries().order_by('pk')),
+            Prefetch('supplyorderpayment_set', queryset=SupplyOrderPayment.objects.order_by('pk')),
+        )
+
+    def refresh_statuses(self):
+        """Recompute the stored payment and order status of the selected orders."""
+        self.update(payment_status=_payment_status(self.paid_condition))
+        undelivered = SupplyOrderItem.objects.order_by().annotate(
+            delivered=Coalesce(Sum('supplyorderitemdelivery__quantity_delivered'), 0)
+        ).exclude(delivered=F('quantity_ordered')).values('supply_order')
+        self.filter(pk__in=undelivered).update(order_status='pending deliveries')
+        self.exclude(pk__in=undelivered).update(order_status='complete')
+
+    def refresh_last_delivery(self):
+        return self.update(last_delivery_date=_max_subquery(
+            SupplyOrderItemDelivery.objects.all(), 'item__supply_order', 'delivery_date'
+        ))
+
+    def rebuild_totals(self):
+        """Recompute the stored totals of the selected orders from their lines and payments."""
+        return self.update(
+            order_value=_sum_subquery(
+                SupplyOrderItem.objects.all(), 'supply_order', F('unit_price') * F('quantity_ordered')
+            ),
+            total_paid=_sum_subquery(SupplyOrderPayment.objects.all(), 'supply_order', F('amount_paid')),
+            amount_due=_sum_subquery(
+                SupplyOrderItem.objects.filter(delivery_date__isnull=False), 'supply_order',
+                F('unit_price') * F('quantity_ordered')
+            ),
+            last_delivery_date=_max_subquery(
+                SupplyOrderItemDelivery.objects.all(), 'item__supply_order', 'delivery_date'
+            ),
+        )
+
+
+class SupplyOrder(OrderCodeMixin, StoredTotalsMixin, LoadedValuesMixin, models.Model):
     order_code = models.IntegerField(editable=False, unique=True, null=True)
     supplier = models.ForeignKey('Supplier')
+    is_draft = models.BooleanField(
+        default=False, help_text='Raised for low stock, not yet sent to the supplier; '
+                                 'left out of balances and reports until confirmed'
+    )
     items = models.ManyToManyField('Inventory', through='SupplyOrderItem')
-    order_date = models.DateTimeField()
+    order_date = models.DateTimeField(db_index=True)
     payment_status = models.CharField(
         max_length=20, choices=PAYMENT_STATUS, default=PAYMENT_STATUS[0][0],
         editable=False
@@ -278,6 +908,23 @@ class SupplyOrder(models.Model):
         max_length=20, choices=ORDER_STATUS, default=ORDER_STATUS[0][0],
         editable=False
     )
+    order_value = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, editable=False, db_index=True
+    )
+    total_paid = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, editable=False
+    )
+    amount_due = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, editable=False, db_index=True,
+        help_text='Takes delivery into consideration and bills only delivered items'
+    )
+    last_delivery_date = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = SupplyOrderQuerySet.as_manager()
+
+    class Meta:
+        # A supplier's order history, newest first
+        indexes = [models.Index(fields=['supplier', 'order_date'])]
 
     def __str__(self):
         return self.supplier.name
@@ -286,61 +933,39 @@ class SupplyOrder(models.Model):
         return reverse('core:supplyorder', kwargs={'pk': self.pk})
 
     @property
-    def total_paid(self):
-        queryset = self.supplyorderpayment_set.aggregate(Sum('amount_paid'))
-        return queryset['amount_paid__sum'] or 0
-
-    @property
-    def order_value(self):
-        queryset = self.supplyorderitem_set.aggregate(
-            order_value=Sum(F('unit_price')*F('quantity_ordered'))
-        )
-        return queryset['order_value'] or 0
-
-    @property
-    def amount_due(self):
-        """Takes delivery into consideration and bills only delivered items"""
-        queryset = self.supplyorderitem_set.filter(delivery_date__isnull=False).aggregate(
-            amount_due=Sum(F('unit_price')*F('quantity_ordered'))
-        )
-        return queryset['amount_due'] or 0
+    def order_currency(self):
+        return 'KES'
 
     @property
     def is_paid(self):
         return self.total_paid >= self.amount_due
 
-    @property
-    def last_delivery_date(self):
-        max_dates = [item.last_delivery_date for item in self.supplyorderitem_set.all()
-                     if item.last_delivery_date]
-        if max_dates:
-            return max(max_dates).date()
-        return None
-
     @property
     def is_delivery_complete(self):
+        if getattr(self, '_summary', None) is not None:  # See ``refresh_summary``
+            return self._summary['delivery_complete']
         return all([item.is_delivered for item in self.supplyorderitem_set.all()])
 
     def get_payment_status(self):
         if self.is_paid:
             return 'paid'
         if not self.last_delivery_date:
-            return 'pending_payment'
+            return 'pending payment'
         td = now() - self.last_delivery_date
         if td.days <= 30:
-            return 'pending_payment'
+            return 'pending payment'
         if 30 < td.days <= 60:
             return 'overdue'
         if 60 < td.days:
             return 'critical'
 
     def get_order_status(self):
-        if self.delivery_complete:
+        if self.is_delivery_complete:
             return 'complete'
-        return 'pending'
+        return 'pending deliveries'
 
 
-class SupplyOrderItem(models.Model):
+class SupplyOrderItem(AtomicUpdateMixin, LoadedValuesMixin, models.Model):
     supply_order = models.ForeignKey('SupplyOrder')
     item = models.ForeignKey('Inventory')
     quantity_ordered = models.IntegerField()
@@ -348,6 +973,8 @@ class SupplyOrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=9, decimal_places=2, default=0)
     delivery_date = models.DateTimeField(blank=True, null=True)
 
+    objects = OrderLineQuerySet.as_manager()
+
     def __str__(self):
         return self.item.item_name
 
@@ -357,6 +984,8 @@ class SupplyOrderItem(models.Model):
 
     @property
     def quantity_delivered(self):
+        if hasattr(self, 'delivered_quantity'):  # See ``with_deliveries``
+            return self.delivered_quantity
         queryset = self.supplyorderitemdelivery_set.aggregate(Sum('quantity_delivered'))
         return queryset['quantity_delivered__sum'] or 0
 
@@ -366,11 +995,13 @@ class SupplyOrderItem(models.Model):
 
     @property
     def last_delivery_date(self):
+        if hasattr(self, 'latest_delivery_date'):
+            return self.latest_delivery_date
         queryset = self.supplyorderitemdelivery_set.aggregate(Max('delivery_date'))
         return queryset['delivery_date__max'] or None
 
 
-class SupplyOrderItemDelivery(models.Model):
+class SupplyOrderItemDelivery(AtomicSaveMixin, LoadedValuesMixin, models.Model):
     item = models.ForeignKey('SupplyOrderItem')
     quantity_delivered = models.IntegerField()
     delivery_date = models.DateTimeField(blank=True, null=True)
@@ -384,7 +1015,7 @@ class SupplyOrderItemDelivery(models.Model):
                             self.quantity_delivered)
 
 
-class SupplyOrderPayment(models.Model):
+class SupplyOrderPayment(AtomicUpdateMixin, LoadedValuesMixin, models.Model):
     supply_order = models.ForeignKey('SupplyOrder')
     currency = models.CharField(max_length=3, choices=CURRENCY, default='KES')
     amount_paid = models.DecimalField(max_digits=9, decimal_places=2)
@@ -393,3 +1024,213 @@ class SupplyOrderPayment(models.Model):
 
     def __str__(self):
         return '%s - %s %s' % (self.supply_order.order_code, self.currency, self.amount_paid)
+
+
+class RollupQuerySet(models.QuerySet):
+    def add(self, key, **deltas):
+        """Atomically add ``deltas`` to the rollup row identified by ``key``, creating it if missing."""
+        if _add_deltas(self.filter(**key), deltas) or not any(deltas.values()):
+            return
+        try:
+            with transaction.atomic():
+                values = dict(key)
+                values.update(deltas)
+                self.create(**values)
+        except IntegrityError:  # Created concurrently
+            _add_deltas(self.filter(**key), deltas)
+
+    def add_many(self, changes):
+        """Apply ``{(partition, dimension id): deltas}`` with a fixed number of statements per partition.
+
+        The partition is the date of a daily rollup.
+        """
+        partition, dimension = self.model.partition, self.model.dimension
+        days = {}
+        for (day, dimension_id), deltas in changes.items():
+            if any(deltas.values()):
+                days.setdefault(day, {})[dimension_id] = deltas
+        for day, rows in days.items():
+            existing = set(self.filter(**{partition: day, dimension + '__in': list(rows)}).values_list(
+                dimension, flat=True
+            ))
+            missing = [pk for pk in rows if pk not in existing]
+            try:
+                if missing:
+                    with transaction.atomic():
+                        self.bulk_create([
+                            self.model(**dict(rows[pk], **{partition: day, dimension: pk})) for pk in missing
+                        ])
+            except IntegrityError:  # Some were created concurrently
+                for pk in missing:
+                    self.add({partition: day, dimension: pk}, **rows[pk])
+            if not existing:
+                continue
+            names = set(name for pk in existing for name in rows[pk])
+            self.filter(**{partition: day, dimension + '__in': list(existing)}).update(**dict(
+                (name, F(name) + Case(
+                    *[When(then=Value(rows[pk].get(name, 0)), **{dimension: pk}) for pk in existing],
+                    default=Value(0), output_field=self.model._meta.get_field(name)
+                )) for name in names
+            ))
+
+
+class CustomerDailyRollup(models.Model):
+    date = models.DateField()
+    customer = models.ForeignKey('Customer')
+    sales = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, help_text='Value of orders placed'
+    )
+    revenue = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, help_text='Payments received'
+    )
+
+    objects = RollupQuerySet.as_manager()
+    partition = 'date'
+    dimension = 'customer_id'
+
+    class Meta:
+        unique_together = (('date', 'customer'),)
+
+    @property
+    def receivables(self):
+        return self.sales - self.revenue
+
+
+class SupplierDailyRollup(models.Model):
+    date = models.DateField()
+    supplier = models.ForeignKey('Supplier')
+    purchases = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, help_text='Value of orders placed'
+    )
+    expenditure = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, help_text='Payments made'
+    )
+
+    objects = RollupQuerySet.as_manager()
+    partition = 'date'
+    dimension = 'supplier_id'
+
+    class Meta:
+        unique_together = (('date', 'supplier'),)
+
+    @property
+    def payables(self):
+        return self.purchases - self.expenditure
+
+
+class ItemDailyRollup(models.Model):
+    date = models.DateField()
+    item = models.ForeignKey('Inventory')
+    quantity_sold = models.IntegerField(default=0)
+    sales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    quantity_purchased = models.IntegerField(default=0)
+    purchases = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = RollupQuerySet.as_manager()
+    partition = 'date'
+    dimension = 'item_id'
+
+    class Meta:
+        unique_together = (('date', 'item'),)
+
+
+# Counter rows each item's reservations are spread over, so concurrent orders rarely share one
+RESERVATION_SHARDS = 8
+
+
+class StockReservationQuerySet(RollupQuerySet):
+    def reserve(self, quantities):
+        """Add ``{item id: quantity}`` to the reserved stock; negative quantities release or consume it.
+
+        Everything goes to one randomly chosen shard, so writers reserving the same item at the
+        same time mostly update different rows instead of queueing on one.
+        """
+        shard = random.randrange(RESERVATION_SHARDS)
+        self.add_many(dict(((shard, item_id), {'reserved': quantity}) for item_id, quantity in quantities.items()))
+
+    def rebuild(self):
+        """Recompute the reservations from the undelivered quantity of every sales order line."""
+        outstanding = defaultdict(int)
+        for item_id, ordered in SalesOrderItem.objects.order_by().values('item').annotate(
+            total=Sum('quantity_ordered')
+        ).values_list('item', 'total'):
+            outstanding[item_id] += ordered
+        for item_id, delivered in SalesOrderItemDelivery.objects.order_by().values('item__item').annotate(
+            total=Sum('quantity_delivered')
+        ).values_list('item__item', 'total'):
+            outstanding[item_id] -= delivered
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                self.model(item_id=item_id, shard=0, reserved=reserved)
+                for item_id, reserved in outstanding.items() if reserved
+            ])
+
+
+class StockReservation(models.Model):
+    """Part of the stock of an item held for sales order lines not yet delivered.
+
+    The reservations of an item are the sum over its shards.
+    """
+    item = models.ForeignKey('Inventory')
+    shard = models.SmallIntegerField()
+    reserved = models.IntegerField(default=0)
+
+    objects = StockReservationQuerySet.as_manager()
+    partition = 'shard'
+    dimension = 'item_id'
+
+    class Meta:
+        unique_together = (('item', 'shard'),)
+
+    def __str__(self):
+        return '%s/%s: %s' % (self.item_id, self.shard, self.reserved)
+
+
+class RollupWatermark(models.Model):
+    """The highest row id of a source table already folded into the daily rollups."""
+    source = models.CharField(max_length=50, unique=True)
+    last_id = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '%s: %s' % (self.source, self.last_id)
+
+
+class OrderCodeSequenceQuerySet(models.QuerySet):
+    def reserve(self, name, count, start):
+        """Reserve ``count`` consecutive values of the counter ``name`` and return the first.
+
+        A missing counter is created to continue from the value ``start()`` returns. The
+        counter row stays locked until the calling transaction ends.
+        """
+        with transaction.atomic():
+            if not self.filter(name=name).update(last_value=F('last_value') + count):
+                first = start()
+                try:
+                    with transaction.atomic():
+                        self.create(name=name, last_value=first - 1 + count)
+                    return first
+                except IntegrityError:  # Created concurrently
+                    self.filter(name=name).update(last_value=F('last_value') + count)
+            return self.filter(name=name).values_list('last_value', flat=True).get() - count + 1
+
+
+class OrderCodeSequence(models.Model):
+    """The last order code handed out of a type, on databases without sequences."""
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField()
+
+    objects = OrderCodeSequenceQuerySet.as_manager()
+
+    def __str__(self):
+        return '%s: %s' % (self.name, self.last_value)
+
+
+class ImportCheckpoint(models.Model):
+    """How many rows of an import source have been committed, so a failed import can resume."""
+    source = models.CharField(max_length=255, unique=True)
+    rows_done = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s: %s' % (self.source, self.rows_done)
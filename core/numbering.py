@@ -0,0 +1,89 @@
+"""Order codes allocated when an order is inserted, instead of saving it a second time.
+
+On PostgreSQL every order type draws its codes from its own sequence, which never makes
+concurrent writers wait. Other databases, such as SQLite in tests, use a counter row per
+order type instead. Codes are numbers; ``settings.ORDER_CODE_PREFIXES`` sets what each
+type shows before them.
+"""
+from collections import namedtuple
+
+from django.db import connections
+from django.db.models import F, Func, Max, Min, IntegerField
+from .models import SalesOrder, SupplyOrder, OrderCodeSequence
+
+Sequence = namedtuple('Sequence', 'name start')
+
+# The sequence each order type draws its codes from, and its first code
+SEQUENCES = {
+    SalesOrder: Sequence('core_salesorder_code_seq', 1001),
+    SupplyOrder: Sequence('core_supplyorder_code_seq', 3001),
+}
+
+
+class NextValue(Func):
+    """The next value of a PostgreSQL sequence, drawn for every row the expression is evaluated for."""
+    template = "nextval('%(sequence)s')"
+
+    def __init__(self, sequence, **extra):
+        super(NextValue, self).__init__(sequence=sequence, output_field=IntegerField(), **extra)
+
+
+def _start(model, using='default'):
+    """The first code to hand out, following any codes already in use."""
+    highest = model.objects.using(using).aggregate(highest=Max('order_code'))['highest'] or 0
+    return max(SEQUENCES[model].start, highest + 1)
+
+
+def next_code(model, using='default'):
+    """Allocate the code of one new order of type ``model``."""
+    sequence = SEQUENCES[model]
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [sequence.name])
+            return cursor.fetchone()[0]
+    return OrderCodeSequence.objects.using(using).reserve(sequence.name, 1, lambda: _start(model, using))
+
+
+def assign_codes(queryset):
+    """Give every order in ``queryset`` a new code in one UPDATE, for orders inserted in bulk.
+
+    PostgreSQL draws the codes from the sequence as the rows are updated. Elsewhere a block
+    covering the id range of the orders is reserved and each order gets the code at its
+    id's offset in the block.
+    """
+    model = queryset.model
+    sequence = SEQUENCES[model]
+    if connections[queryset.db].vendor == 'postgresql':
+        return queryset.update(order_code=NextValue(sequence.name))
+    ids = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+    if ids['first'] is None:
+        return 0
+    first_code = OrderCodeSequence.objects.using(queryset.db).reserve(
+        sequence.name, ids['last'] - ids['first'] + 1, lambda: _start(model, queryset.db)
+    )
+    return queryset.update(order_code=F('id') + (first_code - ids['first']))
+
+
+def create_order_code_sequences(using='default', **kwargs):
+    """Create the order code sequences after ``migrate``, continuing after the codes in use.
+
+    Databases without sequences get their counter rows instead, so the first order
+    does not pay for creating them.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        for model, sequence in SEQUENCES.items():
+            if not OrderCodeSequence.objects.using(using).filter(name=sequence.name).exists():
+                OrderCodeSequence.objects.using(using).create(
+                    name=sequence.name, last_value=_start(model, using) - 1
+                )
+        return
+    with connection.cursor() as cursor:
+        for model, sequence in SEQUENCES.items():
+            cursor.execute('CREATE SEQUENCE IF NOT EXISTS %s' % sequence.name)
+            cursor.execute(
+                'SELECT setval(%%s, GREATEST((SELECT MAX(order_code) FROM %s), %%s, (SELECT last_value FROM %s)))' % (
+                    model._meta.db_table, sequence.name
+                ), [sequence.name, sequence.start - 1]
+            )
@@ -0,0 +1,107 @@
+"""Rendered pages cached under the generations of what they show.
+
+A scope is a model name, standing for all its rows, or a model name and a pk, standing
+for one row. Each scope has a generation counter in the cache, which signals bump when
+a row in it changes. A page is cached under its URL and the current generations of the
+scopes it shows, so a change moves every later request to a new key and the stale page
+is never read again; it expires with ``PAGE_CACHE_TIMEOUT``.
+
+Generations are bumped when the row is saved and again once the transaction commits,
+so a page rendered from uncommitted data in between is not served afterwards. They
+live in the default cache, which must be shared by every process serving pages.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Part of every page key; bumped when rows change without signals, e.g. by a command
+GLOBAL_SCOPE = ('all', None)
+
+
+def generation_key(name, pk=None):
+    if pk is None:
+        return 'core:generation:%s' % name
+    return 'core:generation:%s:%s' % (name, pk)
+
+
+def _seed():
+    # Counters lost from the cache restart from the clock, not from a value already used
+    return int(time.time() * 1000000)
+
+
+def get_generations(scopes):
+    """The current generation of each scope, starting counters missing from the cache."""
+    keys = [generation_key(*scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _seed(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(scopes):
+    """Move each scope to a new generation."""
+    for scope in set(scopes):
+        key = generation_key(*scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _seed(), None)
+
+
+def pages_changed(scopes):
+    """Bump the scopes now and, if in a transaction, again once it commits."""
+    scopes = list(scopes)
+    bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump(scopes))
+
+
+def invalidate_pages():
+    """Stop serving every cached page."""
+    bump([GLOBAL_SCOPE])
+
+
+def page_key(request, scopes):
+    scopes = [GLOBAL_SCOPE] + list(scopes)
+    parts = [request.get_full_path(), str(request.is_ajax())]
+    parts.extend('%s:%s=%s' % (name, pk, generation) for (name, pk), generation in zip(
+        scopes, get_generations(scopes)
+    ))
+    return 'core:page:%s' % hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class CachedPageMixin(object):
+    """Serve GET requests from the page cache while nothing the page shows has changed.
+
+    ``page_scopes`` names the models whose rows show on the page; detail views set
+    ``page_object_scope`` to the model of the object named by the URL's pk. Only pages
+    without forms may be cached, a cached CSRF token belongs to someone else.
+    Requests are marked as cache hits or misses for ``core.instrumentation``.
+    """
+    page_scopes = ()
+    page_object_scope = None
+
+    def get_page_scopes(self):
+        scopes = [(name, None) for name in self.page_scopes]
+        if self.page_object_scope is not None:
+            scopes.append((self.page_object_scope, self.kwargs['pk']))
+        return scopes
+
+    def get(self, request, *args, **kwargs):
+        key = page_key(request, self.get_page_scopes())
+        response = cache.get(key)
+        if response is not None:
+            request._page_cache = 'hit'
+            return response
+        request._page_cache = 'miss'
+        response = super(CachedPageMixin, self).get(request, *args, **kwargs)
+        if response.status_code == 200 and not response.cookies:
+            if hasattr(response, 'render'):
+                response.render()
+            cache.set(key, response, getattr(settings, 'PAGE_CACHE_TIMEOUT', 300))
+        return response
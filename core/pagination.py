@@ -0,0 +1,193 @@
+"""Keyset pagination: pages seek past the last row shown instead of using OFFSET.
+
+A page is identified by an opaque cursor holding the sort key and pk of the row it
+starts after (or ends before), so every page costs one indexed range scan however deep
+it is. Totals are optional and may be estimated rather than counted.
+"""
+import base64
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404, QueryDict
+from django.utils.encoding import force_bytes, force_text
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps the microseconds of datetimes, which DjangoJSONEncoder cuts to milliseconds.
+
+    Rows differing only below the millisecond would otherwise be skipped.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super(CursorEncoder, self).default(o)
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction] + list(values), cls=CursorEncoder)
+    return force_text(base64.urlsafe_b64encode(force_bytes(data))).rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(force_text(base64.urlsafe_b64decode(force_bytes(cursor + '=' * (-len(cursor) % 4)))))
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(data, list) or len(data) != 3 or data[0] not in ('next', 'previous'):
+        raise InvalidCursor(cursor)
+    return data[0], data[1:]
+
+
+def estimated_count(queryset):
+    """The planner's row estimate for a whole PostgreSQL table, otherwise a briefly cached count."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return int(row[0])
+    key = 'core:count:%s' % hashlib.md5(force_bytes(str(queryset.query))).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.LIST_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def keyset_field(model, ordering):
+    """The field ``ordering`` sorts on, if it can be paged by keyset; NULLs cannot be sought past."""
+    field = model._meta.get_field(ordering.lstrip('-'))
+    return None if field.null else field
+
+
+class KeysetPaginator(object):
+    """Pages of ``queryset`` ordered by ``ordering`` (a field name, '-' for descending) and pk."""
+
+    def __init__(self, queryset, per_page, ordering, count_mode='estimate'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.descending = ordering.startswith('-')
+        self.field = keyset_field(queryset.model, ordering)
+        if self.field is None:
+            raise ImproperlyConfigured('%s is nullable and cannot be paged by keyset' % ordering.lstrip('-'))
+        self.count_mode = count_mode
+
+    @property
+    def count(self):
+        if self.count_mode == 'exact':
+            return self.queryset.count()
+        if self.count_mode == 'estimate':
+            return estimated_count(self.queryset)
+        return None
+
+    def page(self, cursor=None):
+        direction, values = decode_cursor(cursor) if cursor else ('next', None)
+        backwards = direction == 'previous'
+        descending = self.descending != backwards
+        prefix = '-' if descending else ''
+        queryset = self.queryset.order_by(prefix + self.field.name, prefix + 'pk')
+        if values is not None:
+            try:
+                value = self.field.to_python(values[0])
+                pk = self.queryset.model._meta.pk.to_python(values[1])
+            except ValidationError:
+                raise InvalidCursor(cursor)
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{'%s__%s' % (self.field.name, lookup): value}) |
+                Q(**{self.field.name: value, 'pk__' + lookup: pk})
+            )
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=more)
+        return KeysetPage(rows, self, has_next=more, has_previous=values is not None)
+
+    def key(self, obj):
+        return getattr(obj, self.field.attname), obj.pk
+
+
+class KeysetPage(object):
+    number = None
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+        self.params = QueryDict(mutable=True)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_cursor(self):
+        return encode_cursor('next', self.paginator.key(self.object_list[-1]))
+
+    def previous_cursor(self):
+        return encode_cursor('previous', self.paginator.key(self.object_list[0]))
+
+    def _query(self, cursor):
+        params = self.params.copy()
+        params['cursor'] = cursor
+        return params.urlencode()
+
+    def next_query(self):
+        return self._query(self.next_cursor())
+
+    def previous_query(self):
+        return self._query(self.previous_cursor())
+
+
+class KeysetPaginationMixin(object):
+    """ListView pagination by cursor; numbered pages are still used when one is requested.
+
+    Search results are ordered by rank, which has no index to seek on, and orderings on
+    nullable fields have no key for their NULL rows, so they are paged by number too.
+    """
+    keyset_ordering = None
+    count_mode = 'estimate'
+
+    def get_keyset_ordering(self):
+        if self.request.GET.get('search'):
+            return None
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_keyset_ordering()
+        if (not ordering or self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or
+                keyset_field(queryset.model, ordering) is None):
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, ordering, self.count_mode)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        page.params = self.request.GET.copy()
+        return paginator, page, page.object_list, page.has_other_pages()
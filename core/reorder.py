@@ -0,0 +1,32 @@
+"""Draft supply orders for the items running low on stock."""
+from collections import defaultdict
+
+from django.utils.timezone import now
+from .models import Inventory, SupplyOrder, SupplyOrderItem
+from .signals import coalesced_recomputation
+
+
+def create_draft_orders(item_ids=None, order_date=None):
+    """Raise one draft supply order per supplier covering the shortfall of the reorder candidates.
+
+    Each item is ordered from the supplier of its latest supply order line, at that line's
+    price; items never bought before are left out. ``item_ids`` limits the candidates
+    considered. Returns the orders created.
+    """
+    candidates = Inventory.objects.reorder_candidates().filter(shortfall__gt=0, last_supplier__isnull=False)
+    if item_ids is not None:
+        candidates = candidates.filter(pk__in=item_ids)
+    by_supplier = defaultdict(list)
+    for item in candidates:
+        by_supplier[item.last_supplier].append(item)
+    orders = []
+    with coalesced_recomputation():
+        for supplier_id, items in sorted(by_supplier.items()):
+            order = SupplyOrder.objects.create(supplier_id=supplier_id, order_date=order_date or now(), is_draft=True)
+            for item in items:
+                SupplyOrderItem.objects.create(
+                    supply_order=order, item=item, quantity_ordered=item.shortfall,
+                    unit_price=item.last_unit_price
+                )
+            orders.append(order)
+    return orders
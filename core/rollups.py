@@ -0,0 +1,210 @@
+"""Daily revenue, expenditure, receivables and payables by customer, supplier and item."""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum, Max, F, ExpressionWrapper as E, DecimalField
+from django.db.models.functions import TruncDate
+from django.utils.timezone import localtime, make_aware
+from .models import (
+    SalesOrder, SupplyOrder, SalesOrderItem, SupplyOrderItem, SalesOrderPayment,
+    SupplyOrderPayment, CustomerDailyRollup, SupplierDailyRollup, ItemDailyRollup,
+    RollupWatermark
+)
+
+# Watermark name, source model and the date each row is reported against
+SOURCES = (
+    ('salesorderitem', SalesOrderItem, 'sales_order__order_date'),
+    ('salesorderpayment', SalesOrderPayment, 'date_paid'),
+    ('supplyorderitem', SupplyOrderItem, 'supply_order__order_date'),
+    ('supplyorderpayment', SupplyOrderPayment, 'date_paid'),
+)
+
+
+def to_day(value):
+    return localtime(value).date()
+
+
+def _line_cost():
+    return Sum(E(F('unit_price') * F('quantity_ordered'), output_field=DecimalField()))
+
+
+def _order_keys(model, order_ids):
+    """Map order ids to their (day, counterparty id), skipping drafts and orders that no longer exist."""
+    if not order_ids:
+        return {}
+    counterparty = 'customer_id' if model is SalesOrder else 'supplier_id'
+    return dict(
+        (pk, (to_day(order_date), counterparty_id)) for pk, order_date, counterparty_id in
+        model.objects.confirmed().filter(pk__in=order_ids).values_list('pk', 'order_date', counterparty)
+    )
+
+
+def rollup_contributions(sender, values, orders):
+    """Yield the rollup model, row key and amounts a line or payment adds to the rollups."""
+    if sender is SalesOrderItem:
+        if values['sales_order_id'] not in orders:
+            return
+        day, customer_id = orders[values['sales_order_id']]
+        cost = values['unit_price'] * values['quantity_ordered']
+        yield CustomerDailyRollup, {'date': day, 'customer_id': customer_id}, {'sales': cost}
+        yield ItemDailyRollup, {'date': day, 'item_id': values['item_id']}, {
+            'quantity_sold': values['quantity_ordered'], 'sales': cost
+        }
+    elif sender is SupplyOrderItem:
+        if values['supply_order_id'] not in orders:
+            return
+        day, supplier_id = orders[values['supply_order_id']]
+        cost = values['unit_price'] * values['quantity_ordered']
+        yield SupplierDailyRollup, {'date': day, 'supplier_id': supplier_id}, {'purchases': cost}
+        yield ItemDailyRollup, {'date': day, 'item_id': values['item_id']}, {
+            'quantity_purchased': values['quantity_ordered'], 'purchases': cost
+        }
+    elif sender is SalesOrderPayment:
+        if values['sales_order_id'] not in orders:
+            return
+        customer_id = orders[values['sales_order_id']][1]
+        yield CustomerDailyRollup, {'date': to_day(values['date_paid']), 'customer_id': customer_id}, {
+            'revenue': values['amount_paid']
+        }
+    elif sender is SupplyOrderPayment:
+        if values['supply_order_id'] not in orders:
+            return
+        supplier_id = orders[values['supply_order_id']][1]
+        yield SupplierDailyRollup, {'date': to_day(values['date_paid']), 'supplier_id': supplier_id}, {
+            'expenditure': values['amount_paid']
+        }
+
+
+def update_rollups(changes):
+    """Move the rollup rows by the difference between versions of lines and payments.
+
+    ``changes`` is a list of ``(sender, previous, current)``; either version may be None.
+    """
+    versions = [
+        (sender, values, sign) for sender, previous, current in changes
+        for values, sign in ((previous, -1), (current, 1)) if values is not None
+    ]
+    if not versions:
+        return
+    orders = {
+        SalesOrder: _order_keys(SalesOrder, [
+            values['sales_order_id'] for sender, values, sign in versions
+            if sender in (SalesOrderItem, SalesOrderPayment)
+        ]),
+        SupplyOrder: _order_keys(SupplyOrder, [
+            values['supply_order_id'] for sender, values, sign in versions
+            if sender in (SupplyOrderItem, SupplyOrderPayment)
+        ]),
+    }
+    deltas = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for sender, values, sign in versions:
+        order_model = SalesOrder if sender in (SalesOrderItem, SalesOrderPayment) else SupplyOrder
+        for model, key, amounts in rollup_contributions(sender, values, orders[order_model]):
+            row = deltas[model][(key['date'], key[model.dimension])]
+            for name, amount in amounts.items():
+                row[name] += sign * amount
+    for model, rows in deltas.items():
+        model.objects.add_many(rows)
+
+
+def _grouped(queryset, date_field, days, group_by, **aggregates):
+    """Group ``queryset`` by day and ``group_by``, limited to ``days`` unless that is None."""
+    queryset = queryset.order_by()
+    if days is not None:
+        start = make_aware(datetime.datetime.combine(min(days), datetime.time.min))
+        end = make_aware(datetime.datetime.combine(max(days) + datetime.timedelta(days=1), datetime.time.min))
+        queryset = queryset.filter(**{date_field + '__gte': start, date_field + '__lt': end})
+    queryset = queryset.annotate(day=TruncDate(date_field))
+    if days is not None:
+        queryset = queryset.filter(day__in=days)
+    return queryset.values('day', group_by).annotate(**aggregates)
+
+
+def rebuild_days(days=None):
+    """Recompute the rollup rows of ``days``, or of every day when None, from the source tables.
+
+    Draft supply orders are left out until they are confirmed.
+    """
+    if days is not None:
+        days = sorted(set(days))
+        if not days:
+            return
+    rows = {CustomerDailyRollup: {}, SupplierDailyRollup: {}, ItemDailyRollup: {}}
+
+    def merge(model, dimension, grouped, group_by, **fields):
+        for values in grouped:
+            key = (values['day'], values[group_by])
+            row = rows[model].get(key)
+            if row is None:
+                row = rows[model][key] = model(**{'date': key[0], dimension: key[1]})
+            for field, aggregate in fields.items():
+                setattr(row, field, getattr(row, field) + (values[aggregate] or 0))
+
+    sales_lines = _grouped(
+        SalesOrderItem.objects.all(), 'sales_order__order_date', days, 'sales_order__customer',
+        total=_line_cost()
+    )
+    merge(CustomerDailyRollup, 'customer_id', sales_lines, 'sales_order__customer', sales='total')
+    sales_payments = _grouped(
+        SalesOrderPayment.objects.all(), 'date_paid', days, 'sales_order__customer',
+        total=Sum('amount_paid')
+    )
+    merge(CustomerDailyRollup, 'customer_id', sales_payments, 'sales_order__customer', revenue='total')
+    confirmed_lines = SupplyOrderItem.objects.filter(supply_order__is_draft=False)
+    supply_lines = _grouped(
+        confirmed_lines, 'supply_order__order_date', days, 'supply_order__supplier', total=_line_cost()
+    )
+    merge(SupplierDailyRollup, 'supplier_id', supply_lines, 'supply_order__supplier', purchases='total')
+    supply_payments = _grouped(
+        SupplyOrderPayment.objects.filter(supply_order__is_draft=False), 'date_paid', days,
+        'supply_order__supplier', total=Sum('amount_paid')
+    )
+    merge(SupplierDailyRollup, 'supplier_id', supply_payments, 'supply_order__supplier', expenditure='total')
+    items_sold = _grouped(
+        SalesOrderItem.objects.all(), 'sales_order__order_date', days, 'item',
+        quantity=Sum('quantity_ordered'), total=_line_cost()
+    )
+    merge(ItemDailyRollup, 'item_id', items_sold, 'item', quantity_sold='quantity', sales='total')
+    items_bought = _grouped(
+        confirmed_lines, 'supply_order__order_date', days, 'item',
+        quantity=Sum('quantity_ordered'), total=_line_cost()
+    )
+    merge(ItemDailyRollup, 'item_id', items_bought, 'item', quantity_purchased='quantity', purchases='total')
+
+    with transaction.atomic():
+        for model, model_rows in rows.items():
+            stale = model.objects.all()
+            if days is not None:
+                stale = stale.filter(date__in=days)
+            stale.delete()
+            model.objects.bulk_create(model_rows.values(), batch_size=1000)
+
+
+def update_since_watermark():
+    """Rebuild the days touched by rows added since the stored watermarks and return them."""
+    days = set()
+    marks = []
+    for source, model, date_field in SOURCES:
+        watermark, created = RollupWatermark.objects.get_or_create(source=source)
+        last_id = model.objects.filter(pk__gt=watermark.last_id).aggregate(Max('pk'))['pk__max']
+        if last_id is None:
+            continue
+        new_rows = model.objects.filter(pk__gt=watermark.last_id, pk__lte=last_id).order_by()
+        days.update(new_rows.annotate(day=TruncDate(date_field)).values_list('day', flat=True).distinct())
+        marks.append((watermark, last_id))
+    with transaction.atomic():
+        rebuild_days(days)
+        for watermark, last_id in marks:
+            watermark.last_id = last_id
+            watermark.save()
+    return days
+
+
+def rebuild_all():
+    """Rebuild every rollup row and move the watermarks to the end of the source tables."""
+    with transaction.atomic():
+        rebuild_days()
+        for source, model, date_field in SOURCES:
+            last_id = model.objects.aggregate(Max('pk'))['pk__max'] or 0
+            RollupWatermark.objects.update_or_create(source=source, defaults={'last_id': last_id})
@@ -0,0 +1,125 @@
+"""Ranked search over customers, suppliers, inventory and orders.
+
+On PostgreSQL the ``icontains`` matches are served by trigram GIN indexes, item
+descriptions by a full text index, and results are ranked by trigram similarity and
+text rank. Other databases, such as SQLite in tests, match the same fields without
+indexes and rank exact and prefix matches above substring matches.
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q, Case, When, Value, IntegerField, FloatField
+from django.db.models.functions import Greatest
+from .models import Customer, Supplier, Inventory, SalesOrder, SupplyOrder
+
+# Short text fields matched by substring, ranked by similarity
+SEARCH_FIELDS = {
+    Customer: ('name', 'email', 'contact_phone'),
+    Supplier: ('name', 'email', 'contact_phone'),
+    Inventory: ('item_name', 'item_sku'),
+    SalesOrder: ('customer__name',),
+    SupplyOrder: ('supplier__name',),
+}
+
+# Long text fields matched by words
+FULL_TEXT_FIELDS = {
+    Inventory: ('description',),
+}
+
+# Number fields matched exactly when the search is a number, or the order code with its prefix
+CODE_FIELDS = {
+    SalesOrder: ('order_code',),
+    SupplyOrder: ('order_code',),
+}
+
+FULL_TEXT_CONFIG = 'english'
+
+
+def search(queryset, query):
+    """Limit ``queryset`` to the rows matching ``query``, best matches first."""
+    query = (query or '').strip()
+    if not query:
+        return queryset
+    model = queryset.model
+    matches = Q()
+    for name in SEARCH_FIELDS[model]:
+        matches |= Q(**{name + '__icontains': query})
+    code = _code(model, query)
+    codes = CODE_FIELDS.get(model, ()) if code is not None else ()
+    for name in codes:
+        matches |= Q(**{name: code})
+    if connections[queryset.db].vendor == 'postgresql':
+        return _postgres_search(queryset, query, matches, codes, code)
+    for name in FULL_TEXT_FIELDS.get(model, ()):
+        matches |= Q(**{name + '__icontains': query})
+    rank = sum(
+        Case(
+            When(then=Value(3), **{name + '__iexact': query}),
+            When(then=Value(2), **{name + '__istartswith': query}),
+            When(then=Value(1), **{name + '__icontains': query}),
+            default=Value(0), output_field=IntegerField()
+        ) for name in SEARCH_FIELDS[model] + FULL_TEXT_FIELDS.get(model, ())
+    )
+    for name in codes:
+        rank = rank + Case(
+            When(then=Value(3), **{name: code}), default=Value(0), output_field=IntegerField()
+        )
+    return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+
+def _code(model, query):
+    """The number ``query`` holds, once stripped of the order code prefix of ``model``, or None."""
+    prefix = settings.ORDER_CODE_PREFIXES.get(model._meta.model_name, '')
+    if prefix and query.upper().startswith(prefix.upper()):
+        query = query[len(prefix):]
+    return int(query) if query.isdigit() else None
+
+
+def _postgres_search(queryset, query, matches, codes, code):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+
+    model = queryset.model
+    similarities = [TrigramSimilarity(name, query) for name in SEARCH_FIELDS[model]]
+    rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    text_query = SearchQuery(query, config=FULL_TEXT_CONFIG)
+    for name in FULL_TEXT_FIELDS.get(model, ()):
+        document = 'search_%s' % name
+        queryset = queryset.annotate(**{document: SearchVector(name, config=FULL_TEXT_CONFIG)})
+        matches |= Q(**{document: text_query})
+        rank = rank + SearchRank(document, text_query)
+    for name in codes:
+        rank = rank + Case(
+            When(then=Value(1.0), **{name: code}), default=Value(0.0), output_field=FloatField()
+        )
+    return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+
+def search_index_statements():
+    """SQL creating the PostgreSQL indexes the searches above are served by."""
+    yield 'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+    for model, names in SEARCH_FIELDS.items():
+        for name in names:
+            if '__' in name:  # Served by the related model's index
+                continue
+            column = model._meta.get_field(name).column
+            yield 'CREATE INDEX IF NOT EXISTS %s_%s_trgm ON %s USING gin (UPPER(%s::text) gin_trgm_ops)' % (
+                model._meta.db_table, column, model._meta.db_table, column
+            )
+    for model, names in FULL_TEXT_FIELDS.items():
+        for name in names:
+            column = model._meta.get_field(name).column
+            yield (
+                "CREATE INDEX IF NOT EXISTS %s_%s_fts ON %s USING gin "
+                "(to_tsvector('%s'::regconfig, COALESCE(%s, ''::text)))" % (
+                    model._meta.db_table, column, model._meta.db_table, FULL_TEXT_CONFIG, column
+                )
+            )
+
+
+def create_search_indexes(using='default', **kwargs):
+    """Create the search indexes after ``migrate``; migrations are generated per install."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for statement in search_index_statements():
+            cursor.execute(statement)
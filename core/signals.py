@@ -1,79 +1,393 @@
-from django.db.models.signals import pre_save, post_save, pre_delete
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.db.models import F, Q
 from django.dispatch import receiver
 from .models import (
-    SalesOrder, SupplyOrder, SalesOrderPayment, SupplyOrderPayment,
-    SalesOrderItem, SalesOrderItemDelivery
+    Customer, Supplier, SalesOrder, SupplyOrder, SalesOrderPayment, SupplyOrderPayment,
+    SalesOrderItem, SalesOrderItemDelivery, SupplyOrderItem, SupplyOrderItemDelivery,
+    Inventory, ItemImage, StockMovement, StockReservation
 )
+from .dashboard import invalidate_dashboard
+from .numbering import next_code
+from .pagecache import bump, pages_changed
+from .rollups import update_rollups, rebuild_days, to_day
+
+# The model holding the running balance of each order type, and the order field pointing at it
+COUNTERPARTY = {
+    SalesOrder: (Customer, 'customer_id'),
+    SupplyOrder: (Supplier, 'supplier_id'),
+}
+
+# The line, order and line field pointing at the order of each delivery model
+DELIVERY_LINES = {
+    SalesOrderItemDelivery: (SalesOrderItem, SalesOrder, 'sales_order_id'),
+    SupplyOrderItemDelivery: (SupplyOrderItem, SupplyOrder, 'supply_order_id'),
+}
+
+# The stock movement reason of each delivery model, and whether it takes stock out (-1) or in
+STOCK_MOVEMENTS = {
+    SalesOrderItemDelivery: ('sale', -1),
+    SupplyOrderItemDelivery: ('receipt', 1),
+}
+
+# Fields of order lines and payments that feed into the stored order totals
+TRACKED_FIELDS = {
+    SalesOrderItem: ('sales_order_id', 'item_id', 'unit_price', 'quantity_ordered'),
+    SalesOrderPayment: ('sales_order_id', 'amount_paid', 'date_paid'),
+    SupplyOrderItem: ('supply_order_id', 'item_id', 'unit_price', 'quantity_ordered', 'delivery_date'),
+    SupplyOrderPayment: ('supply_order_id', 'amount_paid', 'date_paid'),
+}
+
+
+def order_contribution(sender, values):
+    """Return the order model, order id and the amounts a line or payment adds to its totals."""
+    if sender is SalesOrderItem:
+        cost = values['unit_price'] * values['quantity_ordered']
+        return SalesOrder, values['sales_order_id'], {'order_value': cost, 'amount_due': cost}
+    if sender is SalesOrderPayment:
+        paid = values['amount_paid']
+        return SalesOrder, values['sales_order_id'], {'total_paid': paid, 'amount_due': -paid}
+    if sender is SupplyOrderItem:
+        cost = values['unit_price'] * values['quantity_ordered']
+        due = cost if values['delivery_date'] else 0
+        return SupplyOrder, values['supply_order_id'], {'order_value': cost, 'amount_due': due}
+    if sender is SupplyOrderPayment:
+        return SupplyOrder, values['supply_order_id'], {'total_paid': values['amount_paid']}
+
+
+def update_order_totals(sender, previous, current):
+    """Move the stored order totals by the difference between two versions of a line."""
+    changes = {}
+    for values, sign in ((previous, -1), (current, 1)):
+        if values is None:
+            continue
+        model, order_id, totals = order_contribution(sender, values)
+        deltas = changes.setdefault((model, order_id), {})
+        for name, amount in totals.items():
+            deltas[name] = deltas.get(name, 0) + sign * amount
+    # Deletions may be part of deleting the order, which must still exist to be updated
+    batch = current_batch() if current is not None else None
+    for (model, order_id), deltas in changes.items():
+        if batch is not None:
+            batch.add_order_deltas(model, order_id, deltas)
+        else:
+            apply_order_deltas(model, order_id, deltas)
+
+
+def apply_order_deltas(model, order_id, deltas):
+    """Add ``deltas`` to the stored totals of an order and the balance of its counterparty."""
+    if not any(deltas.values()):
+        return
+    model.objects.filter(pk=order_id).add_to_totals(**deltas)
+    update_counterparty_balance(model, order_id, deltas)
+
+
+def update_counterparty_balance(model, order_id, deltas):
+    """Apply a change in a confirmed order's totals to its customer or supplier in one UPDATE."""
+    counterparty = COUNTERPARTY[model][0]
+    counterparty.objects.filter(**{
+        model._meta.model_name + '__in': model.objects.confirmed().filter(pk=order_id)
+    }).add_to_balance(
+        total_paid=deltas.get('total_paid', 0), total_due=deltas.get('amount_due', 0)
+    )
+
+
+class Recomputation(object):
+    """Work triggered by signals while they are coalesced, so each row is updated only once.
+
+    Deltas to order totals, balances and rollups are summed and applied before the
+    transaction commits. Derived values (delivery flags, last delivery dates and statuses)
+    are recomputed for every touched order once the transaction has committed.
+    """
+
+    def __init__(self):
+        self.order_deltas = defaultdict(lambda: defaultdict(int))
+        self.line_changes = []
+        self.delivered_items = defaultdict(set)
+        self.dirty_orders = defaultdict(set)
+        self.reservations = defaultdict(int)
+        self.dashboard_changed = False
+        self.page_scopes = set()
+
+    def add_order_deltas(self, model, order_id, deltas):
+        totals = self.order_deltas[(model, order_id)]
+        for name, amount in deltas.items():
+            totals[name] += amount
+
+    def apply_deltas(self):
+        """Apply the summed deltas; runs inside the transaction that made the changes."""
+        for (model, order_id), deltas in self.order_deltas.items():
+            apply_order_deltas(model, order_id, deltas)
+        update_rollups(self.line_changes)
+        StockReservation.objects.reserve(self.reservations)
+        self.order_deltas.clear()
+        self.line_changes = []
+        self.reservations.clear()
+
+    def recompute(self):
+        """Refresh derived values of the touched lines and orders; runs after the commit."""
+        if self.delivered_items[SalesOrderItem]:
+            SalesOrderItem.objects.filter(pk__in=self.delivered_items[SalesOrderItem]).refresh_delivered()
+        for line_model, order_model in ((SalesOrderItem, SalesOrder), (SupplyOrderItem, SupplyOrder)):
+            if self.delivered_items[line_model]:
+                order_model.objects.filter(**{
+                    line_model._meta.model_name + '__in': self.delivered_items[line_model]
+                }).refresh_last_delivery()
+            if self.dirty_orders[order_model]:
+                order_model.objects.filter(pk__in=self.dirty_orders[order_model]).refresh_statuses()
+        if self.page_scopes:
+            bump(self.page_scopes)
+        if self.dashboard_changed:
+            invalidate_dashboard()
+
+
+_local = threading.local()
+
+
+def current_batch():
+    """The ``Recomputation`` collecting signal work on this thread, or None."""
+    return getattr(_local, 'batch', None)
+
+
+@contextmanager
+def coalesced_recomputation():
+    """Run the block in a transaction, recomputing totals and statuses once rather than per save.
+
+    Saving an order with N lines otherwise updates the order, its customer and the rollups
+    N times. Nested blocks join the outermost one.
+    """
+    if current_batch() is not None:
+        yield current_batch()
+        return
+    batch = _local.batch = Recomputation()
+    try:
+        with transaction.atomic():
+            yield batch
+            batch.apply_deltas()
+            transaction.on_commit(batch.recompute)
+    finally:
+        _local.batch = None
+
+
+@receiver(pre_save, sender=SalesOrderItem)
+@receiver(pre_save, sender=SalesOrderPayment)
+@receiver(pre_save, sender=SupplyOrderItem)
+@receiver(pre_save, sender=SupplyOrderPayment)
+@receiver(pre_delete, sender=SalesOrderItem)
+@receiver(pre_delete, sender=SalesOrderPayment)
+@receiver(pre_delete, sender=SupplyOrderItem)
+@receiver(pre_delete, sender=SupplyOrderPayment)
+def pre_change_order_line(sender, instance, **kwargs):
+    """Keep the stored values of the line so the change can be applied as a delta."""
+    instance._previous_values = instance.get_stored_values(*TRACKED_FIELDS[sender])
+
+
+@receiver(post_save, sender=SalesOrderItem)
+@receiver(post_save, sender=SalesOrderPayment)
+@receiver(post_save, sender=SupplyOrderItem)
+@receiver(post_save, sender=SupplyOrderPayment)
+def post_save_order_line(sender, instance, **kwargs):
+    """Apply the change in the line's contribution to the stored order totals and rollups."""
+    current = dict((name, getattr(instance, name)) for name in TRACKED_FIELDS[sender])
+    update_order_totals(sender, instance._previous_values, current)
+    line_changed(sender, instance._previous_values, current)
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=SalesOrderItem)
+@receiver(post_delete, sender=SalesOrderPayment)
+@receiver(post_delete, sender=SupplyOrderItem)
+@receiver(post_delete, sender=SupplyOrderPayment)
+def post_delete_order_line(sender, instance, **kwargs):
+    """Remove the line's contribution from the stored order totals and rollups."""
+    update_order_totals(sender, instance._previous_values, None)
+    line_changed(sender, instance._previous_values, None)
+
+
+def line_changed(sender, previous, current):
+    """Update the rollups for a changed line, or leave that and the status to the batch."""
+    if sender is SalesOrderItem:
+        quantities = defaultdict(int)
+        if previous is not None:
+            quantities[previous['item_id']] -= previous['quantity_ordered']
+        if current is not None:
+            quantities[current['item_id']] += current['quantity_ordered']
+        reserve_stock(quantities)
+    batch = current_batch() if current is not None else None
+    if batch is None:
+        update_rollups([(sender, previous, current)])
+        return
+    batch.line_changes.append((sender, previous, current))
+    for values in (previous, current):
+        if values is not None:
+            model, order_id, totals = order_contribution(sender, values)
+            batch.dirty_orders[model].add(order_id)
+
+
+def reserve_stock(quantities):
+    """Move the stock reserved for undelivered sales lines, or leave that to the batch."""
+    batch = current_batch()
+    if batch is None:
+        StockReservation.objects.reserve(quantities)
+        return
+    for item_id, quantity in quantities.items():
+        batch.reservations[item_id] += quantity
+
+
+@receiver(post_save, sender=SupplyOrderItemDelivery)
+def post_save_supply_item_delivery(sender, created, instance, **kwargs):
+    """Keep the last delivery date of the supply order current."""
+    if delivery_changed(sender, instance):
+        return
+    orders = SupplyOrder.objects.filter(supplyorderitem=instance.item_id)
+    if created and instance.delivery_date:
+        orders.extend_last_delivery(instance.delivery_date)
+    else:
+        orders.refresh_last_delivery()
+
+
+def delivery_changed(sender, instance):
+    """Leave the delivery bookkeeping to the batch, if there is one; True if it was."""
+    batch = current_batch()
+    if batch is None:
+        return False
+    line_model, order_model, order_field = DELIVERY_LINES[sender]
+    batch.delivered_items[line_model].add(instance.item_id)
+    batch.dirty_orders[order_model].add(getattr(instance.item, order_field))
+    return True
+
+
+@receiver(post_delete, sender=SalesOrderItemDelivery)
+def post_delete_sales_item_delivery(sender, instance, **kwargs):
+    if delivery_changed(sender, instance):
+        return
+    SalesOrder.objects.filter(salesorderitem=instance.item_id).refresh_last_delivery()
+
+
+@receiver(post_delete, sender=SupplyOrderItemDelivery)
+def post_delete_supply_item_delivery(sender, instance, **kwargs):
+    if delivery_changed(sender, instance):
+        return
+    SupplyOrder.objects.filter(supplyorderitem=instance.item_id).refresh_last_delivery()
+
+
+@receiver(pre_save, sender=SalesOrderItemDelivery)
+@receiver(pre_save, sender=SupplyOrderItemDelivery)
+@receiver(pre_delete, sender=SalesOrderItemDelivery)
+@receiver(pre_delete, sender=SupplyOrderItemDelivery)
+def pre_change_delivery(sender, instance, **kwargs):
+    """Keep the stored line and quantity of the delivery so the stock can be moved by the difference."""
+    instance._previous_values = instance.get_stored_values('item_id', 'quantity_delivered')
+
+
+@receiver(post_save, sender=SalesOrderItemDelivery)
+@receiver(post_save, sender=SupplyOrderItemDelivery)
+def post_save_delivery_stock(sender, instance, **kwargs):
+    move_delivered_stock(sender, instance, instance._previous_values, instance)
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=SalesOrderItemDelivery)
+@receiver(post_delete, sender=SupplyOrderItemDelivery)
+def post_delete_delivery_stock(sender, instance, **kwargs):
+    move_delivered_stock(sender, instance, instance._previous_values, None)
+
+
+def move_delivered_stock(sender, instance, previous, current):
+    """Record the stock movement of a changed delivery, in the transaction saving it.
+
+    Runs at once even in a batch: an oversold item must fail the save.
+    """
+    reason, direction = STOCK_MOVEMENTS[sender]
+    line_model = DELIVERY_LINES[sender][0]
+    quantities = defaultdict(int)
+    if previous is not None:
+        if current is not None and previous['item_id'] == current.item_id:
+            item_id = current.item.item_id
+        else:
+            item_id = line_model.objects.values_list('item_id', flat=True).get(pk=previous['item_id'])
+        quantities[item_id] -= direction * previous['quantity_delivered']
+    if current is not None:
+        quantities[current.item.item_id] += direction * current.quantity_delivered
+    StockMovement.objects.record([
+        StockMovement(item_id=item_id, quantity=quantity, reason=reason, delivery_id=instance.pk)
+        for item_id, quantity in quantities.items()
+    ])
+    if sender is SalesOrderItemDelivery:  # What is delivered is no longer held for the order
+        reserve_stock(quantities)
 
 
 @receiver(pre_delete, sender=SalesOrder)
-def pre_delete_sales_order(sender, instance, **kwargs):
-    """Update the customers payment records."""
-    customer = instance.customer  # remove the payment data on deletion
-    customer.total_paid -= instance.total_paid
-    customer.total_due -= instance.amount_due
-    customer.save()
+@receiver(pre_delete, sender=SupplyOrder)
+def pre_delete_order(sender, instance, **kwargs):
+    """Apply what the batch holds for the order while the order still exists."""
+    batch = current_batch()
+    if batch is not None:
+        batch.apply_deltas()
 
 
-@receiver(post_save, sender=SalesOrder)
-def post_save_sales_order(sender, created, instance, **kwargs):
-    """Add the order code for new orders."""
-    if created:  # A new order has been created
-        instance.order_code = instance.id + 1000
-        instance.save()
+@receiver(pre_save, sender=SalesOrder)
+@receiver(pre_save, sender=SupplyOrder)
+def pre_save_order_counterparty(sender, instance, **kwargs):
+    """Keep the stored customer or supplier, date and draft flag so a change can move balances and rollups."""
+    counterparty, field = COUNTERPARTY[sender]
+    fields = (field, 'order_date', 'is_draft') if sender is SupplyOrder else (field, 'order_date')
+    instance._previous_values = instance.get_loaded_values(*fields)
 
 
+@receiver(post_save, sender=SalesOrder)
 @receiver(post_save, sender=SupplyOrder)
-def post_save_supply_order(sender, created, instance, **kwargs):
-    """Add the order code for new orders"""
-    if created:  # A new order has been created
-        instance.order_code = instance.id + 3000
-        instance.save()
+def post_save_order_counterparty(sender, instance, **kwargs):
+    """Move the order's totals to the new customer or supplier if it was reassigned or confirmed."""
+    counterparty, field = COUNTERPARTY[sender]
+    previous = instance._previous_values
+    # Drafts are left out of balances and rollups until they are confirmed
+    was_counted = previous is not None and not previous.get('is_draft', False)
+    counted = not getattr(instance, 'is_draft', False)
+    if previous and (previous[field] != getattr(instance, field) or was_counted != counted):
+        if was_counted:
+            counterparty.objects.filter(pk=previous[field]).add_to_balance(
+                total_paid=-instance.total_paid, total_due=-instance.amount_due
+            )
+        if counted:
+            counterparty.objects.filter(pk=getattr(instance, field)).add_to_balance(
+                total_paid=instance.total_paid, total_due=instance.amount_due
+            )
+    if previous and (previous[field] != getattr(instance, field) or was_counted != counted or
+                     previous['order_date'] != instance.order_date):
+        if current_batch() is not None:  # Rebuilt rows must not get the pending deltas again
+            current_batch().apply_deltas()
+        payments = getattr(instance, sender._meta.model_name + 'payment_set')
+        rebuild_days([to_day(previous['order_date']), to_day(instance.order_date)] + [
+            to_day(date_paid) for date_paid in payments.values_list('date_paid', flat=True)
+        ])
+    instance.remember_loaded_values()
+
+
+@receiver(pre_save, sender=SalesOrder)
+@receiver(pre_save, sender=SupplyOrder)
+def pre_save_order_code(sender, instance, using, **kwargs):
+    """Give new orders their code before the insert, so they are saved once."""
+    if instance._state.adding and instance.order_code is None:
+        instance.order_code = next_code(sender, using)
 
 
 @receiver(pre_save, sender=SalesOrder)
 @receiver(pre_save, sender=SupplyOrder)
 def pre_save_order(sender, instance, **kwargs):
     """Ensure correct payment status for all orders before saving"""
+    # The stored totals are updated in the database, not on this instance
+    instance.refresh_summary()
     # Add the payment status before saving
     instance.payment_status = instance.get_payment_status()
     instance.order_status = instance.get_order_status()
 
 
-@receiver(pre_save, sender=SalesOrder, dispatch_uid="sales order pre save only")
-def pre_save_sales_order(sender, instance, **kwargs):
-    """Update customer payment records with the total paid/due"""
-    if instance.id:
-        old_instance = sender.objects.get(pk=instance.id)
-        old_customer = old_instance.customer
-        old_customer.total_paid -= old_instance.total_paid
-        old_customer.total_due -= old_instance.amount_due
-        old_customer.save()
-    customer = instance.customer
-    customer.total_paid += instance.total_paid
-    customer.total_due += instance.amount_due
-    import pdb;pdb.set_trace()
-    customer.save()
-
-
-@receiver(pre_save, sender=SupplyOrder)
-def pre_save_sales_order(sender, instance, **kwargs):
-    """Update supplier payment records with the total paid/due"""
-    if instance.id:
-        old_instance = sender.objects.get(pk=instance.id)
-        old_supplier = old_instance.supplier
-        old_supplier.total_paid -= old_instance.total_paid
-        old_supplier.total_due -= old_instance.amount_due
-        old_supplier.save()
-    supplier = instance.supplier
-    supplier.total_paid += instance.total_paid
-    supplier.total_due += instance.amount_due
-    supplier.save()
-
-
 @receiver(pre_save, sender=SalesOrderPayment)
-@receiver(pre_save, sender=SupplyOrderPayment)
 def pre_save_order_payment(sender, instance, **kwargs):
     if not instance.payment_code:
         instance.payment_code = instance.get_payment_code()
@@ -82,16 +396,78 @@ def pre_save_order_payment(sender, instance, **kwargs):
 @receiver(pre_save, sender=SalesOrderItem)
 def pre_save_sales_order_item(sender, instance, **kwargs):
     """Ensure item is marked delivered before saving."""
-    instance.is_delivered = (instance.quantity_delivered == instance.quantity_ordered)
+    # A line being added has no deliveries yet
+    delivered = 0 if instance._state.adding else instance.quantity_delivered
+    instance.is_delivered = (delivered == instance.quantity_ordered)
 
 
 @receiver(post_save, sender=SalesOrderItem)
 def post_save_sales_item(sender, created, instance, **kwargs):
-    # Update the order status
-    instance.sales_order.save()
+    # Update the order status, unless the batch will
+    if current_batch() is None:
+        instance.sales_order.save()
 
 
 @receiver(post_save, sender=SalesOrderItemDelivery)
 def post_save_sales_item_delivery(sender, created, instance, **kwargs):
     """Ensure item is marked delivered after saving a delivery."""
+    if delivery_changed(sender, instance):
+        return
+    orders = SalesOrder.objects.filter(salesorderitem=instance.item_id)
+    if created and instance.delivery_date:
+        orders.extend_last_delivery(instance.delivery_date)
+    else:
+        orders.refresh_last_delivery()
     instance.item.save()
+
+
+DASHBOARD_MODELS = (
+    Customer, Supplier, Inventory, SalesOrder, SupplyOrder, SalesOrderItem, SupplyOrderItem,
+    SalesOrderPayment, SupplyOrderPayment, SalesOrderItemDelivery, SupplyOrderItemDelivery,
+)
+
+
+def dashboard_changed(sender, **kwargs):
+    """Drop the dashboard snapshot once the change is visible to other requests."""
+    batch = current_batch()
+    if batch is not None:
+        batch.dashboard_changed = True
+    else:
+        transaction.on_commit(invalidate_dashboard)
+
+
+for model in DASHBOARD_MODELS:
+    post_save.connect(dashboard_changed, sender=model, dispatch_uid='dashboard save %s' % model.__name__)
+    post_delete.connect(dashboard_changed, sender=model, dispatch_uid='dashboard delete %s' % model.__name__)
+
+
+def page_scopes(sender, instance):
+    """The page cache scopes showing a row, see ``core.pagecache``."""
+    if sender is ItemImage:
+        return [('inventory', instance.item_id)]
+    if sender in DELIVERY_LINES:
+        order = DELIVERY_LINES[sender][1]._meta.model_name
+        order_id = getattr(instance.item, DELIVERY_LINES[sender][2])
+        return [(order, None), (order, order_id), ('stock', None), ('inventory', instance.item.item_id)]
+    if sender in TRACKED_FIELDS:
+        order_field = TRACKED_FIELDS[sender][0]
+        order = sender._meta.get_field(order_field).related_model._meta.model_name
+        return [(order, None), (order, getattr(instance, order_field))]
+    name = sender._meta.model_name
+    return [(name, None), (name, instance.pk)]
+
+
+def page_changed(sender, instance, **kwargs):
+    """Move the pages showing the row to new cache keys, again once the change is visible."""
+    scopes = page_scopes(sender, instance)
+    batch = current_batch()
+    if batch is not None:
+        bump(scopes)
+        batch.page_scopes.update(scopes)
+    else:
+        pages_changed(scopes)
+
+
+for model in DASHBOARD_MODELS + (ItemImage,):
+    post_save.connect(page_changed, sender=model, dispatch_uid='page save %s' % model.__name__)
+    post_delete.connect(page_changed, sender=model, dispatch_uid='page delete %s' % model.__name__)
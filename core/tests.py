@@ -1,3 +1,1120 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import six
+from django.utils.timezone import now
+
+from .models import (
+    Customer, Supplier, Inventory, SalesOrder, SalesOrderItem, SalesOrderPayment, SupplyOrder, SupplyOrderItem,
+    SalesOrderItemDelivery, SupplyOrderItemDelivery, SupplyOrderPayment, CustomerDailyRollup, SupplierDailyRollup,
+    ItemDailyRollup, StockMovement, StockReservation, InsufficientStock, ImportCheckpoint
+)
+from .benchmarks import scenarios
+from .benchmarks.fixtures import generate_dataset
+from .benchmarks.load import percentile
+from .instrumentation import QueryBudgetTestMixin, fingerprint, summary
+from .management.commands.import_orders import finalize_orders, import_orders
+from .numbering import assign_codes
+from .pagination import encode_cursor
+from .reorder import create_draft_orders
+from .rollups import rebuild_days, to_day, update_since_watermark
+from .search import search
+from .signals import coalesced_recomputation
+
+
+class StoredTotalsTest(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Customer')
+        self.supplier = Supplier.objects.create(name='Supplier')
+        self.items = [Inventory.objects.create(item_name='Item %d' % i, item_sku='SKU%d' % i) for i in range(2)]
+        self.orders = [SalesOrder.objects.create(customer=self.customer, order_date=now()) for i in range(2)]
+        self.line = SalesOrderItem.objects.create(
+            sales_order=self.orders[0], item=self.items[0], quantity_ordered=2, unit_price=Decimal('10.00')
+        )
+        self.payment = SalesOrderPayment.objects.create(
+            sales_order=self.orders[0], amount_paid=Decimal('5.00'), date_paid=now()
+        )
+        self.supply_orders = [SupplyOrder.objects.create(supplier=self.supplier, order_date=now()) for i in range(2)]
+        self.supply_line = SupplyOrderItem.objects.create(
+            supply_order=self.supply_orders[0], item=self.items[0], quantity_ordered=3, unit_price=Decimal('4.00'),
+            delivery_date=now()
+        )
+        self.supply_payment = SupplyOrderPayment.objects.create(
+            supply_order=self.supply_orders[0], amount_paid=Decimal('2.00'), date_paid=now()
+        )
+
+    def totals(self, model):
+        return list(model.objects.order_by('pk').values_list('pk', 'order_value', 'total_paid', 'amount_due'))
+
+    def assertMatchesRebuild(self):
+        for model in (SalesOrder, SupplyOrder):
+            stored = self.totals(model)
+            model.objects.rebuild_totals()
+            self.assertEqual(stored, self.totals(model))
+
+    def test_new_lines_and_payments_add_to_the_totals(self):
+        self.assertEqual(self.totals(SalesOrder)[0][1:], (Decimal('20.00'), Decimal('5.00'), Decimal('15.00')))
+        self.assertEqual(self.totals(SupplyOrder)[0][1:], (Decimal('12.00'), Decimal('2.00'), Decimal('12.00')))
+        self.assertMatchesRebuild()
+
+    def test_edits_move_the_totals_by_the_difference(self):
+        self.line.quantity_ordered = 3
+        self.line.unit_price = Decimal('7.00')
+        self.line.save()
+        self.payment.amount_paid = Decimal('9.00')
+        self.payment.save()
+        self.supply_line.delivery_date = None
+        self.supply_line.save()
+        self.supply_payment.amount_paid = Decimal('1.00')
+        self.supply_payment.save()
+        self.assertEqual(self.totals(SalesOrder)[0][1:], (Decimal('21.00'), Decimal('9.00'), Decimal('12.00')))
+        self.assertMatchesRebuild()
+
+    def test_edits_from_stale_instances_apply_what_they_write(self):
+        stale = SalesOrderItem.objects.get(pk=self.line.pk)
+        self.line.quantity_ordered = 5
+        self.line.save()
+        stale.unit_price = Decimal('1.00')
+        stale.save()
+        self.assertMatchesRebuild()
+
+    def test_moving_lines_and_payments_moves_their_totals(self):
+        self.line.sales_order = self.orders[1]
+        self.line.save()
+        self.payment.sales_order = self.orders[1]
+        self.payment.save()
+        self.supply_line.supply_order = self.supply_orders[1]
+        self.supply_line.save()
+        self.supply_payment.supply_order = self.supply_orders[1]
+        self.supply_payment.save()
+        self.assertEqual(self.totals(SalesOrder)[0][1:], (0, 0, 0))
+        self.assertEqual(self.totals(SalesOrder)[1][1:], (Decimal('20.00'), Decimal('5.00'), Decimal('15.00')))
+        self.assertMatchesRebuild()
+
+    def test_deleting_lines_and_payments_removes_their_totals(self):
+        for row in (self.line, self.payment, self.supply_line, self.supply_payment):
+            row.delete()
+        self.assertEqual(self.totals(SalesOrder)[0][1:], (0, 0, 0))
+        self.assertMatchesRebuild()
+
+    def test_saving_the_order_keeps_the_stored_totals(self):
+        order = SalesOrder.objects.get(pk=self.orders[0].pk)
+        SalesOrderItem.objects.create(
+            sales_order=order, item=self.items[1], quantity_ordered=1, unit_price=Decimal('3.00')
+        )
+        order.save()  # Its in-memory totals predate the new line
+        self.assertEqual(self.totals(SalesOrder)[0][1], Decimal('23.00'))
+        self.assertMatchesRebuild()
+
+    def test_rebuild_command_restores_totals_and_balances(self):
+        SalesOrder.objects.update(order_value=0, total_paid=0, amount_due=0)
+        Customer.objects.update(total_paid=0, total_due=0)
+        call_command('rebuild_order_totals', stdout=six.StringIO())
+        self.assertEqual(self.totals(SalesOrder)[0][1:], (Decimal('20.00'), Decimal('5.00'), Decimal('15.00')))
+        customer = Customer.objects.get(pk=self.customer.pk)
+        self.assertEqual((customer.total_paid, customer.total_due), (Decimal('5.00'), Decimal('15.00')))
+
+    def test_with_totals_lists_orders_and_customers_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = [(order.customer.name, order.amount_due) for order in SalesOrder.objects.with_totals()]
+        self.assertIn(('Customer', Decimal('15.00')), rows)
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite serialises writers, so there is no race to test')
+class CustomerLedgerConcurrencyTest(TransactionTestCase):
+    threads = 8
+    orders_per_thread = 5
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Busy Customer')
+        self.items = [
+            Inventory.objects.create(item_name='Item %d' % i, item_sku='SKU%d' % i)
+            for i in range(self.threads)
+        ]
+
+    def place_orders(self, item, errors):
+        try:
+            for i in range(self.orders_per_thread):
+                with transaction.atomic():
+                    order = SalesOrder.objects.create(customer=self.customer, order_date=now())
+                    SalesOrderItem.objects.create(
+                        sales_order=order, item=item, quantity_ordered=3, unit_price=Decimal('100.00')
+                    )
+                    SalesOrderPayment.objects.create(
+                        sales_order=order, amount_paid=Decimal('120.00'), date_paid=now()
+                    )
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_concurrent_orders_keep_exact_balance(self):
+        errors = []
+        workers = [
+            threading.Thread(target=self.place_orders, args=(item, errors)) for item in self.items
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+        orders = self.threads * self.orders_per_thread
+        customer = Customer.objects.get(pk=self.customer.pk)
+        self.assertEqual(customer.total_paid, Decimal('120.00') * orders)
+        self.assertEqual(customer.total_due, Decimal('180.00') * orders)
+
+
+class CustomerLedgerTest(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Customer')
+        self.item = Inventory.objects.create(item_name='Item', item_sku='SKU')
+        self.order = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        SalesOrderItem.objects.create(
+            sales_order=self.order, item=self.item, quantity_ordered=2, unit_price=Decimal('50.00')
+        )
+        SalesOrderPayment.objects.create(
+            sales_order=self.order, amount_paid=Decimal('30.00'), date_paid=now()
+        )
+
+    def test_order_lines_update_balance(self):
+        customer = Customer.objects.get(pk=self.customer.pk)
+        self.assertEqual(customer.total_paid, Decimal('30.00'))
+        self.assertEqual(customer.total_due, Decimal('70.00'))
+
+    def test_reassigning_an_order_moves_its_balance(self):
+        other = Customer.objects.create(name='Other Customer')
+        order = SalesOrder.objects.get(pk=self.order.pk)
+        order.customer = other
+        order.save()
+
+        self.assertEqual(Customer.objects.get(pk=self.customer.pk).total_due, 0)
+        self.assertEqual(Customer.objects.get(pk=other.pk).total_due, Decimal('70.00'))
+
+    def test_deleting_an_order_removes_its_balance(self):
+        SalesOrder.objects.get(pk=self.order.pk).delete()
+
+        customer = Customer.objects.get(pk=self.customer.pk)
+        self.assertEqual(customer.total_paid, 0)
+        self.assertEqual(customer.total_due, 0)
+
+
+class DashboardTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(name='Customer')
+
+    def test_warm_dashboard_costs_no_queries(self):
+        self.client.get(reverse('core:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('core:index'))
+        self.assertEqual(response.context['total_customers'], 1)
+
+    def test_changes_invalidate_the_snapshot(self):
+        self.assertEqual(self.client.get(reverse('core:dashboard_json')).json()['total_customers'], 1)
+        Customer.objects.create(name='Another Customer')
+        self.assertEqual(self.client.get(reverse('core:dashboard_json')).json()['total_customers'], 2)
+
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.customers = [Customer.objects.create(name='Customer %d' % i) for i in range(2)]
+        self.items = [Inventory.objects.create(item_name='Item %d' % i, item_sku='SKU%d' % i) for i in range(2)]
+        self.order = SalesOrder.objects.create(customer=self.customers[0], order_date=now() - timedelta(days=3))
+        self.line = SalesOrderItem.objects.create(
+            sales_order=self.order, item=self.items[0], quantity_ordered=2, unit_price=Decimal('10.00')
+        )
+        self.payment = SalesOrderPayment.objects.create(
+            sales_order=self.order, amount_paid=Decimal('5.00'), date_paid=now() - timedelta(days=1)
+        )
+
+    def rollups(self):
+        """The non-zero rollup rows; maintained rows may be left at zero where rebuilt ones are not."""
+        return (
+            sorted(CustomerDailyRollup.objects.exclude(sales=0, revenue=0).values_list(
+                'date', 'customer', 'sales', 'revenue'
+            )),
+            sorted(ItemDailyRollup.objects.exclude(quantity_sold=0, sales=0).values_list(
+                'date', 'item', 'quantity_sold', 'sales'
+            )),
+        )
+
+    def assertMatchesRebuild(self):
+        maintained = self.rollups()
+        rebuild_days()
+        self.assertEqual(maintained, self.rollups())
+        return maintained
+
+    def test_new_lines_and_payments_are_rolled_up(self):
+        customers, items = self.assertMatchesRebuild()
+        self.assertEqual([row[2:] for row in customers], [(Decimal('20.00'), 0), (0, Decimal('5.00'))])
+        self.assertEqual([row[1:] for row in items], [(self.items[0].pk, 2, Decimal('20.00'))])
+
+    def test_edited_lines_and_payments_move_the_rollups(self):
+        self.line.item = self.items[1]
+        self.line.quantity_ordered = 3
+        self.line.save()
+        self.payment.date_paid = now()
+        self.payment.save()
+        self.assertMatchesRebuild()
+
+    def test_moved_and_reassigned_orders_move_the_rollups(self):
+        order = SalesOrder.objects.get(pk=self.order.pk)
+        order.customer = self.customers[1]
+        order.order_date = now() - timedelta(days=10)
+        order.save()
+        customers, items = self.assertMatchesRebuild()
+        self.assertEqual(set(row[1] for row in customers), set([self.customers[1].pk]))
+
+    def test_deleted_lines_and_orders_leave_the_rollups(self):
+        self.payment.delete()
+        self.assertMatchesRebuild()
+        SalesOrder.objects.get(pk=self.order.pk).delete()
+        self.assertEqual(self.assertMatchesRebuild(), ([], []))
+
+    def test_watermark_pass_picks_up_rows_written_without_signals(self):
+        update_since_watermark()
+        day = now() - timedelta(days=5)
+        order = SalesOrder.objects.create(customer=self.customers[1], order_date=day)
+        SalesOrderItem.objects.bulk_create([
+            SalesOrderItem(sales_order=order, item=self.items[1], quantity_ordered=4, unit_price=Decimal('2.50'))
+        ])
+        self.assertFalse(ItemDailyRollup.objects.filter(item=self.items[1]).exists())
+
+        self.assertEqual(update_since_watermark(), set([to_day(day)]))
+        self.assertEqual(ItemDailyRollup.objects.get(item=self.items[1]).sales, Decimal('10.00'))
+        self.assertMatchesRebuild()
+        self.assertEqual(update_since_watermark(), set())
+
+    def test_report_ignores_impossible_dates(self):
+        response = self.client.get(reverse('core:reports'), {'start': '2016-02-30', 'end': 'soon', 'by': 'customer'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['start'])
+        self.assertEqual(len(response.context['rows']), 1)
+
+    def test_report_keeps_namesakes_apart(self):
+        Customer.objects.filter(pk=self.customers[1].pk).update(name='Customer 0')
+        order = SalesOrder.objects.create(customer=self.customers[1], order_date=now() - timedelta(days=3))
+        SalesOrderItem.objects.create(
+            sales_order=order, item=self.items[1], quantity_ordered=1, unit_price=Decimal('7.00')
+        )
+        response = self.client.get(reverse('core:reports'), {'by': 'customer'})
+        self.assertEqual(
+            sorted(response.context['rows']),
+            [('Customer 0', Decimal('7.00'), 0, Decimal('7.00')),
+             ('Customer 0', Decimal('20.00'), Decimal('5.00'), Decimal('15.00'))]
+        )
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, lines):
+        path = os.path.join(self.directory, 'rows.csv')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(u'\n'.join(lines) + u'\n')
+        return path
+
+    def run_import(self, kind, path, **options):
+        call_command('import_orders', kind, path, stdout=six.StringIO(), **options)
+
+    def test_failed_import_resumes_after_its_last_chunk(self):
+        rows = ['item_name,item_sku,quantity', 'Pump,P-1,3', 'Valve,V-1,2', 'Hose,P-1,1', 'Tank,T-1,4']
+        path = self.write(rows)
+        with self.assertRaises(IntegrityError):
+            self.run_import('inventory', path, chunk_size=2)
+        self.assertEqual(ImportCheckpoint.objects.get().rows_done, 2)
+
+        self.write(rows[:3] + ['Hose,H-1,1', 'Tank,T-1,4'])
+        self.run_import('inventory', path, chunk_size=2)
+        self.assertEqual(
+            sorted(Inventory.objects.values_list('item_sku', flat=True)), ['H-1', 'P-1', 'T-1', 'V-1']
+        )
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.assertEqual(sum(StockMovement.objects.values_list('quantity', flat=True)), 10)
+
+    def test_orders_must_name_known_counterparties(self):
+        Customer.objects.create(name='Known')
+        Inventory.objects.create(item_name='Pump', item_sku='P-1')
+        rows = [{
+            'order_ref': '1', 'customer': name, 'order_date': '2016-06-01', 'item_sku': 'P-1',
+            'quantity_ordered': '1', 'unit_price': '5.00',
+        } for name in ('Known', 'Unknown')]
+        with self.assertRaisesMessage(CommandError, 'Unknown customer: Unknown'):
+            import_orders(rows, SalesOrder, SalesOrderItem, 'sales_order', Customer, 'customer')
+        self.assertFalse(SalesOrder.objects.exists())
+
+    def test_finalize_derives_what_the_signals_would_have(self):
+        customer = Customer.objects.create(name='Customer')
+        item = Inventory.objects.create(item_name='Pump', item_sku='P-1', manage_stock=True, quantity=10)
+        SalesOrder.objects.bulk_create([SalesOrder(customer=customer, order_date=now()) for i in range(2)])
+        SalesOrderItem.objects.bulk_create([
+            SalesOrderItem(sales_order=order, item=item, quantity_ordered=3, unit_price=Decimal('5.00'))
+            for order in SalesOrder.objects.all()
+        ])
+
+        self.assertEqual(finalize_orders(SalesOrder, Customer), 2)
+        orders = SalesOrder.objects.all()
+        self.assertEqual(set(orders.values_list('order_value', 'amount_due', 'order_status')), set([
+            (Decimal('15.00'), Decimal('15.00'), 'pending deliveries')
+        ]))
+        self.assertEqual(len(set(orders.values_list('order_code', flat=True)) - set([None])), 2)
+        self.assertEqual(Customer.objects.get(pk=customer.pk).total_due, Decimal('30.00'))
+        self.assertEqual(Inventory.objects.availability([item.pk])[item.pk], 4)
+
+    @skipIf(not connection.features.can_return_ids_from_bulk_insert, 'Importing orders needs ids from bulk inserts')
+    def test_imports_orders_for_their_counterparties(self):
+        customers = [Customer.objects.create(name=name) for name in ('Amina', 'Baraka')]
+        Inventory.objects.create(item_name='Pump', item_sku='P-1')
+        Inventory.objects.create(item_name='Valve', item_sku='V-1')
+        self.run_import('salesorders', self.write([
+            'order_ref,customer,order_date,item_sku,quantity_ordered,unit_price',
+            '1,Amina,2016-06-01,P-1,2,10.00', '1,Amina,2016-06-01,V-1,1,5.00', '2,Baraka,2016-06-02,P-1,1,10.00',
+        ]))
+        self.assertEqual(
+            [Customer.objects.get(pk=c.pk).total_due for c in customers], [Decimal('25.00'), Decimal('10.00')]
+        )
+        self.assertFalse(SalesOrder.objects.filter(order_code__isnull=True).exists())
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+class BatchDeliveryTest(TestCase):
+    def test_records_every_line_and_refreshes_the_order(self):
+        customer = Customer.objects.create(name='Customer')
+        order = SalesOrder.objects.create(customer=customer, order_date=now())
+        lines = [
+            SalesOrderItem.objects.create(
+                sales_order=order, item=Inventory.objects.create(item_name='Item %d' % i, item_sku='SKU%d' % i),
+                quantity_ordered=2, unit_price=Decimal('10.00')
+            )
+            for i in range(3)
+        ]
+        data = {'delivery_date': '2016-06-01 10:00'}
+        data.update(('item_%d' % line.pk, 2) for line in lines)
+
+        response = self.client.post(reverse('core:salesorderdelivery_batch', kwargs={'pk': order.pk}), data)
+
+        self.assertRedirects(response, order.get_absolute_url())
+        self.assertFalse(SalesOrderItem.objects.filter(sales_order=order, is_delivered=False).exists())
+        order = SalesOrder.objects.get(pk=order.pk)
+        self.assertEqual(order.order_status, 'complete')
+        self.assertEqual(order.last_delivery_date.date().isoformat(), '2016-06-01')
+
+
+class StockLedgerTest(TestCase):
+    def setUp(self):
+        self.item = Inventory.objects.create(item_name='Item', item_sku='SKU', manage_stock=True, quantity=5)
+        order = SalesOrder.objects.create(customer=Customer.objects.create(name='Customer'), order_date=now())
+        self.line = SalesOrderItem.objects.create(
+            sales_order=order, item=self.item, quantity_ordered=10, unit_price=Decimal('10.00')
+        )
+
+    def stock(self):
+        return Inventory.objects.get(pk=self.item.pk).quantity
+
+    def ledger(self):
+        return sum(StockMovement.objects.filter(item=self.item).values_list('quantity', flat=True))
+
+    def test_deliveries_move_stock_and_ledger_together(self):
+        delivery = SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=3, delivery_date=now())
+        self.assertEqual(self.stock(), 2)
+        delivery.quantity_delivered = 1
+        delivery.save()
+        self.assertEqual(self.stock(), 4)
+        delivery.delete()
+        self.assertEqual(self.stock(), 5)
+        self.assertEqual(self.ledger(), 5)
+
+    def test_supply_deliveries_receive_stock(self):
+        order = SupplyOrder.objects.create(supplier=Supplier.objects.create(name='Supplier'), order_date=now())
+        line = SupplyOrderItem.objects.create(
+            supply_order=order, item=self.item, quantity_ordered=10, unit_price=Decimal('8.00')
+        )
+        SupplyOrderItemDelivery.objects.create(item=line, quantity_delivered=10, delivery_date=now())
+        self.assertEqual(self.stock(), 15)
+        self.assertEqual(self.ledger(), 15)
+
+    def test_overselling_writes_nothing(self):
+        with self.assertRaises(InsufficientStock):
+            SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=6, delivery_date=now())
+        self.assertFalse(SalesOrderItemDelivery.objects.exists())
+        self.assertEqual(self.stock(), 5)
+        self.assertEqual(self.ledger(), 5)
+
+    def test_editing_the_quantity_is_an_adjustment(self):
+        SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=2, delivery_date=now())
+        self.item.quantity = 8  # The in-memory item still holds the 5 it was created with
+        self.item.save()
+        self.assertEqual(self.stock(), 6)
+        self.assertEqual(self.ledger(), 6)
+
+    def test_compaction_keeps_the_balance(self):
+        for quantity in (1, 2):
+            SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=quantity, delivery_date=now())
+        removed = StockMovement.objects.compact(now() + timedelta(seconds=1))
+        self.assertEqual(removed, 2)
+        self.assertEqual(StockMovement.objects.filter(item=self.item).count(), 1)
+        self.assertEqual(self.ledger(), self.stock())
+
+    def test_opening_balances_match_the_stock(self):
+        StockMovement.objects.all().delete()
+        Inventory.objects.filter(pk=self.item.pk).update(quantity=7)
+        self.assertEqual(StockMovement.objects.open_balances(), 1)
+        self.assertEqual(self.ledger(), 7)
+        self.assertEqual(StockMovement.objects.open_balances(), 0)
+
+    def test_editing_below_zero_is_a_form_error(self):
+        response = self.client.post(reverse('core:inventory_edit', args=[self.item.pk]), {
+            'item_name': 'Item', 'item_sku': 'SKU', 'currency': 'KES', 'unit_price': '0', 'quantity': -1,
+            'min_threshold': 0,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['quantity'])
+        self.assertEqual(self.stock(), 5)
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.items = [
+            Inventory.objects.create(item_name='Item %d' % i, item_sku='SKU%d' % i, manage_stock=True, quantity=10)
+            for i in range(3)
+        ]
+        self.order = SalesOrder.objects.create(customer=Customer.objects.create(name='Customer'), order_date=now())
+        self.line = SalesOrderItem.objects.create(
+            sales_order=self.order, item=self.items[0], quantity_ordered=4, unit_price=Decimal('10.00')
+        )
+
+    def available(self):
+        return Inventory.objects.availability([self.items[0].pk])[self.items[0].pk]
+
+    def test_lines_reserve_and_deliveries_consume(self):
+        self.assertEqual(self.available(), 6)
+        SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=1, delivery_date=now())
+        self.assertEqual(Inventory.objects.get(pk=self.items[0].pk).quantity, 9)
+        self.assertEqual(self.available(), 6)
+
+    def test_deleting_the_order_releases_what_is_undelivered(self):
+        SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=1, delivery_date=now())
+        SalesOrder.objects.get(pk=self.order.pk).delete()
+        self.assertEqual(self.available(), 10)
+
+    def test_has_stock_for_many_items_in_one_query(self):
+        Inventory.objects.filter(pk=self.items[2].pk).update(manage_stock=False, quantity=0)
+        with self.assertNumQueries(1):
+            stock = Inventory.objects.has_stock(dict((item.pk, 7) for item in self.items))
+        self.assertEqual(stock, {self.items[0].pk: False, self.items[1].pk: True, self.items[2].pk: True})
+
+    def test_rebuild_matches_the_maintained_reservations(self):
+        SalesOrderItemDelivery.objects.create(item=self.line, quantity_delivered=1, delivery_date=now())
+        StockReservation.objects.rebuild()
+        self.assertEqual(self.available(), 6)
+
+    def test_rebuild_command_reserves_existing_lines(self):
+        StockReservation.objects.all().delete()
+        call_command('rebuild_order_totals', stdout=six.StringIO())
+        self.assertEqual(self.available(), 6)
+
+
+class ReorderTest(TransactionTestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='Supplier')
+        self.item = Inventory.objects.create(
+            item_name='Item', item_sku='SKU', manage_stock=True, quantity=8, min_threshold=5
+        )
+        with coalesced_recomputation():
+            order = SupplyOrder.objects.create(supplier=self.supplier, order_date=now())
+            SupplyOrderItem.objects.create(
+                supply_order=order, item=self.item, quantity_ordered=3, unit_price=Decimal('8.00')
+            )
+
+    def test_sales_deliveries_flag_low_stock(self):
+        order = SalesOrder.objects.create(customer=Customer.objects.create(name='Customer'), order_date=now())
+        line = SalesOrderItem.objects.create(
+            sales_order=order, item=self.item, quantity_ordered=6, unit_price=Decimal('10.00')
+        )
+        self.assertFalse(Inventory.objects.get(pk=self.item.pk).is_low_stock)
+        SalesOrderItemDelivery.objects.create(item=line, quantity_delivered=6, delivery_date=now())
+        self.assertTrue(Inventory.objects.get(pk=self.item.pk).is_low_stock)
+
+    def test_drafts_cover_the_shortfall_net_of_open_orders(self):
+        Inventory.objects.filter(pk=self.item.pk).update(quantity=1, is_low_stock=True)
+        candidate = Inventory.objects.reorder_candidates().get()
+        self.assertEqual((candidate.on_order, candidate.shortfall), (3, 2))
+
+        orders = create_draft_orders()
+        self.assertEqual(len(orders), 1)
+        line = SupplyOrderItem.objects.get(supply_order=orders[0])
+        self.assertEqual((line.quantity_ordered, line.unit_price), (2, Decimal('8.00')))
+        self.assertTrue(SupplyOrder.objects.get(pk=orders[0].pk).is_draft)
+        self.assertEqual(create_draft_orders(), [])
+
+    def purchases(self):
+        return sum(SupplierDailyRollup.objects.values_list('purchases', flat=True))
+
+    def test_drafts_count_in_balances_and_rollups_once_confirmed(self):
+        Inventory.objects.filter(pk=self.item.pk).update(quantity=1, is_low_stock=True)
+        order = create_draft_orders()[0]
+        SupplyOrderPayment.objects.create(supply_order=order, amount_paid=Decimal('4.00'), date_paid=now())
+        self.assertEqual(Supplier.objects.get(pk=self.supplier.pk).total_paid, 0)
+        self.assertEqual(self.purchases(), Decimal('24.00'))
+
+        self.client.post(reverse('core:supplyorder_draft', args=[order.pk]), {'action': 'confirm'})
+        self.assertFalse(SupplyOrder.objects.get(pk=order.pk).is_draft)
+        self.assertEqual(Supplier.objects.get(pk=self.supplier.pk).total_paid, Decimal('4.00'))
+        self.assertEqual(self.purchases(), Decimal('40.00'))
+        rebuild_days()
+        self.assertEqual(self.purchases(), Decimal('40.00'))
+
+    def test_discarding_a_draft_removes_it(self):
+        Inventory.objects.filter(pk=self.item.pk).update(quantity=1, is_low_stock=True)
+        order = create_draft_orders()[0]
+        self.client.post(reverse('core:supplyorder_draft', args=[order.pk]), {'action': 'discard'})
+        self.assertFalse(SupplyOrder.objects.filter(pk=order.pk).exists())
+        self.assertEqual(Inventory.objects.reorder_candidates().get().shortfall, 2)
+
+    def test_rebuild_command_flags_low_stock(self):
+        Inventory.objects.filter(pk=self.item.pk).update(quantity=1, is_low_stock=False)
+        call_command('rebuild_order_totals', stdout=six.StringIO())
+        self.assertTrue(Inventory.objects.get(pk=self.item.pk).is_low_stock)
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite serialises writers, so there is no race to test')
+class StockConcurrencyTest(TransactionTestCase):
+    def test_concurrent_deliveries_never_oversell(self):
+        item = Inventory.objects.create(item_name='Item', item_sku='SKU', manage_stock=True, quantity=5)
+        customer = Customer.objects.create(name='Customer')
+        lines = [
+            SalesOrderItem.objects.create(
+                sales_order=SalesOrder.objects.create(customer=customer, order_date=now()), item=item,
+                quantity_ordered=1, unit_price=Decimal('10.00')
+            )
+            for i in range(8)
+        ]
+        short = []
+
+        def deliver(line):
+            try:
+                SalesOrderItemDelivery.objects.create(item=line, quantity_delivered=1, delivery_date=now())
+            except InsufficientStock:
+                short.append(line)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=deliver, args=(line,)) for line in lines]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(short), 3)
+        self.assertEqual(Inventory.objects.get(pk=item.pk).quantity, 0)
+
+
+class CoalescedRecomputationTest(TransactionTestCase):
+    def setUp(self):
+        self.items = [Inventory.objects.create(item_name='Item %d' % i, item_sku='SKU%d' % i) for i in range(15)]
+
+    def place_order(self, items):
+        customer = Customer.objects.create(name='Customer')
+        with CaptureQueriesContext(connection) as queries:
+            with coalesced_recomputation():
+                order = SalesOrder.objects.create(customer=customer, order_date=now())
+                for item in items:
+                    SalesOrderItem.objects.create(
+                        sales_order=order, item=item, quantity_ordered=1, unit_price=Decimal('10.00')
+                    )
+                SalesOrderPayment.objects.create(
+                    sales_order=order, amount_paid=Decimal('5.00'), date_paid=now()
+                )
+        return SalesOrder.objects.get(pk=order.pk), len(queries)
+
+    def test_each_line_costs_only_its_insert(self):
+        small, small_queries = self.place_order(self.items[:2])
+        large, large_queries = self.place_order(self.items[2:12])
+        self.assertEqual(large_queries - small_queries, 8)
+
+    def test_totals_and_statuses_are_applied_once_committed(self):
+        order, queries = self.place_order(self.items[:3])
+        self.assertEqual(order.order_value, Decimal('30.00'))
+        self.assertEqual(order.amount_due, Decimal('25.00'))
+        self.assertEqual(order.payment_status, 'pending payment')
+        self.assertEqual(order.order_status, 'pending deliveries')
+        self.assertEqual(order.customer.total_due, Decimal('25.00'))
+
+    def test_saving_an_order_costs_the_same_for_any_number_of_lines(self):
+        supplier = Supplier.objects.create(name='Supplier')
+        counts = []
+        for lines in (1, 10):
+            order = SupplyOrder.objects.create(supplier=supplier, order_date=now())
+            for item in self.items[:lines]:
+                line = SupplyOrderItem.objects.create(
+                    supply_order=order, item=item, quantity_ordered=2, unit_price=Decimal('1.00')
+                )
+                SupplyOrderItemDelivery.objects.create(item=line, quantity_delivered=2, delivery_date=now())
+            order = SupplyOrder.objects.get(pk=order.pk)
+            with CaptureQueriesContext(connection) as queries:
+                order.save()
+            counts.append(len(queries))
+            self.assertEqual(order.order_status, 'complete')
+        self.assertEqual(counts[0], counts[1])
+
+
+class PaymentStatusAgingTest(TestCase):
+    def test_moves_only_orders_whose_status_changed(self):
+        customer = Customer.objects.create(name='Customer')
+        item = Inventory.objects.create(item_name='Item', item_sku='SKU')
+        ages = [5, 40, 90]
+        for days in ages:
+            order = SalesOrder.objects.create(customer=customer, order_date=now())
+            SalesOrderItem.objects.create(sales_order=order, item=item, quantity_ordered=1, unit_price=Decimal('10.00'))
+            SalesOrder.objects.filter(pk=order.pk).update(
+                last_delivery_date=now() - timedelta(days=days), payment_status='pending payment'
+            )
+
+        counts = SalesOrder.objects.age_payment_statuses()
+
+        self.assertEqual(counts, {'pending payment': 0, 'overdue': 1, 'critical': 1})
+        self.assertEqual(
+            sorted(SalesOrder.objects.values_list('payment_status', flat=True)),
+            ['critical', 'overdue', 'pending payment']
+        )
+        self.assertEqual(sum(SalesOrder.objects.age_payment_statuses().values()), 0)
+
+    def test_paid_orders_with_a_stale_status_are_not_aged(self):
+        customer = Customer.objects.create(name='Customer')
+        order = SalesOrder.objects.create(customer=customer, order_date=now())
+        SalesOrderItem.objects.create(
+            sales_order=order, item=Inventory.objects.create(item_name='Item', item_sku='SKU'),
+            quantity_ordered=1, unit_price=Decimal('10.00')
+        )
+        SalesOrderPayment.objects.create(sales_order=order, amount_paid=Decimal('10.00'), date_paid=now())
+        SalesOrder.objects.filter(pk=order.pk).update(
+            last_delivery_date=now() - timedelta(days=40), payment_status='pending payment'
+        )
+
+        self.assertEqual(sum(SalesOrder.objects.age_payment_statuses().values()), 0)
+        self.assertEqual(SalesOrder.objects.get(pk=order.pk).payment_status, 'pending payment')
+
+
+class OrderCodeTest(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Customer')
+
+    def test_new_orders_are_inserted_with_their_code(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        second = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        self.assertGreaterEqual(first.order_code, 1001)
+        self.assertGreater(second.order_code, first.order_code)
+        self.assertEqual(SalesOrder.objects.get(pk=first.pk).order_code, first.order_code)
+        update = 'UPDATE %s ' % connection.ops.quote_name(SalesOrder._meta.db_table)
+        self.assertFalse([q for q in queries if q['sql'].startswith(update)])
+
+    def test_bulk_inserted_orders_get_distinct_codes(self):
+        existing = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        SalesOrder.objects.bulk_create([SalesOrder(customer=self.customer, order_date=now()) for i in range(5)])
+        self.assertEqual(assign_codes(SalesOrder.objects.filter(order_code__isnull=True)), 5)
+        codes = list(SalesOrder.objects.exclude(pk=existing.pk).values_list('order_code', flat=True))
+        self.assertEqual(len(set(codes)), 5)
+        self.assertTrue(all(code > existing.order_code for code in codes))
+
+    @override_settings(ORDER_CODE_PREFIXES={'salesorder': 'SO-'})
+    def test_prefixed_codes_are_shown_and_found(self):
+        order = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        self.assertEqual(order.display_code, 'SO-%d' % order.order_code)
+        self.assertEqual(list(search(SalesOrder.objects.all(), order.display_code)), [order])
+
+
+class SearchTest(TestCase):
+    def test_ranks_closer_matches_first(self):
+        Customer.objects.create(name='Grace Kamau Traders')
+        exact = Customer.objects.create(name='Kamau')
+        Customer.objects.create(name='Peter Otieno')
+
+        results = list(search(Customer.objects.all(), 'kamau'))
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0], exact)
+
+    def test_searches_suppliers_and_items(self):
+        supplier = Supplier.objects.create(name='Savanna Supplies', contact_phone='0712345678')
+        item = Inventory.objects.create(item_name='Pump', item_sku='P-1', description='Galvanised water pump')
+
+        self.assertEqual(list(search(Supplier.objects.all(), '0712')), [supplier])
+        self.assertEqual(list(search(Inventory.objects.all(), 'galvanised')), [item])
+
+    def test_finds_orders_by_code_and_customer_name(self):
+        order = SalesOrder.objects.create(customer=Customer.objects.create(name='Njeri Wambui'), order_date=now())
+        order = SalesOrder.objects.get(pk=order.pk)
+
+        self.assertEqual(list(search(SalesOrder.objects.all(), str(order.order_code))), [order])
+        self.assertEqual(list(search(SalesOrder.objects.all(), 'wambui')), [order])
+
+    def test_supplier_list_search(self):
+        Supplier.objects.create(name='Rift Hardware')
+        response = self.client.get(reverse('core:supplier_list'), {'search': 'rift'})
+        self.assertEqual([s.name for s in response.context['suppliers']], ['Rift Hardware'])
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        for i in range(60):
+            Customer.objects.create(name='Customer %02d' % (i // 2))
+
+    def names(self, response):
+        return [(c.name, c.pk) for c in response.context['customers']]
+
+    def test_cursor_pages_cover_every_row_once(self):
+        url = reverse('core:customer_list')
+        response = self.client.get(url)
+        seen = self.names(response)
+        while response.context['page_obj'].has_next():
+            response = self.client.get(url + '?' + response.context['page_obj'].next_query())
+            seen.extend(self.names(response))
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 60)
+        self.assertEqual(len(set(seen)), 60)
+
+    def test_previous_returns_the_page_before(self):
+        url = reverse('core:customer_list')
+        first = self.client.get(url)
+        second = self.client.get(url + '?' + first.context['page_obj'].next_query())
+        back = self.client.get(url + '?' + second.context['page_obj'].previous_query())
+        self.assertEqual(self.names(back), self.names(first))
+
+    def test_numbered_pages_still_work(self):
+        response = self.client.get(reverse('core:customer_list', args=[2]))
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('core:customer_list') + '?cursor=nonsense')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('core:customer_list'), {'cursor': encode_cursor('next', ['C', 'abc'])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_rows_within_one_millisecond_are_all_paged(self):
+        cache.clear()
+        customer = Customer.objects.first()
+        start = now().replace(microsecond=0)
+        for i in range(30):
+            SalesOrder.objects.create(customer=customer, order_date=start + timedelta(microseconds=i * 10))
+        url = reverse('core:salesorder_list')
+        response = self.client.get(url)
+        seen = [order.pk for order in response.context['salesorder']]
+        while response.context['page_obj'].has_next():
+            response = self.client.get(url + '?' + response.context['page_obj'].next_query())
+            seen.extend(order.pk for order in response.context['salesorder'])
+        self.assertEqual(len(set(seen)), 30)
+
+    def test_nullable_orderings_use_numbered_pages(self):
+        response = self.client.get(reverse('core:salesorder_list') + '?sort=order_code')
+        self.assertEqual(response.context['page_obj'].number, 1)
+
+
+class CounterpartyHistoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(name='Big Account')
+        other = Customer.objects.create(name='Other Account')
+        start = now() - timedelta(days=30)
+        for day in range(12):
+            order = SalesOrder.objects.create(customer=self.customer, order_date=start + timedelta(days=day))
+            SalesOrderPayment.objects.create(sales_order=order, amount_paid=Decimal('1.00'), date_paid=order.order_date)
+        SalesOrder.objects.create(customer=other, order_date=now())
+
+    def test_detail_shows_latest_history(self):
+        response = self.client.get(reverse('core:customer', args=[self.customer.pk]))
+        self.assertEqual(response.context['customer'].total_orders, 12)
+        orders = list(response.context['orders'])
+        self.assertEqual(len(orders), 10)
+        self.assertEqual(orders[0], self.customer.salesorder_set.latest('order_date'))
+        self.assertEqual(len(response.context['payments']), 10)
+        self.assertContains(response, reverse('core:salespayment_list') + '?customer=%d' % self.customer.pk)
+
+    def test_lists_filter_by_customer(self):
+        url = reverse('core:salesorder_list') + '?customer=%d' % self.customer.pk
+        orders = self.client.get(url).context['salesorder']
+        self.assertEqual(set(order.customer_id for order in orders), set([self.customer.pk]))
+        url = reverse('core:salespayment_list') + '?customer=%d' % self.customer.pk
+        self.assertEqual(len(self.client.get(url).context['payments']), 12)
+        self.assertEqual(self.client.get(reverse('core:salesorder_list') + '?customer=999999').status_code, 404)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        customer = Customer.objects.create(name='Customer')
+        item = Inventory.objects.create(item_name='Item', item_sku='SKU')
+        for paid in (Decimal('0.00'), Decimal('20.00')):
+            order = SalesOrder.objects.create(customer=customer, order_date=now())
+            SalesOrderItem.objects.create(sales_order=order, item=item, quantity_ordered=2, unit_price=Decimal('10.00'))
+            if paid:
+                SalesOrderPayment.objects.create(sales_order=order, amount_paid=paid, date_paid=now())
+                order.save()
+
+    def get_lines(self, name, **params):
+        response = self.client.get(reverse('core:export', args=[name]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+    def test_csv_export_filtered_by_status(self):
+        lines = self.get_lines('salesorders', payment_status='paid')
+        self.assertEqual(lines[0].split(',')[:3], ['order_code', 'order_date', 'customer'])
+        self.assertEqual(len(lines), 2)
+        self.assertIn('paid', lines[1])
+
+    def test_jsonl_export_filtered_by_date(self):
+        today = now().date()
+        lines = self.get_lines('salespayments', format='jsonl', start=today.isoformat())
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['amount_paid'], '20.00')
+        self.assertEqual(self.get_lines('salespayments', end=(today - timedelta(days=1)).isoformat()), [
+            'payment_code,order_code,customer,date_paid,currency,amount_paid,notes'
+        ])
+
+    def test_unknown_export_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('core:export', args=['customers'])).status_code, 404)
+
+    def test_bad_dates_are_rejected(self):
+        for params in ({'start': '2016-02-30'}, {'end': 'yesterday'}):
+            self.assertEqual(self.client.get(reverse('core:export', args=['salesorders']), params).status_code, 400)
+
+    def test_command_rejects_bad_dates(self):
+        for option in ({'start': '2016-02-30'}, {'end': 'yesterday'}):
+            with self.assertRaises(CommandError):
+                call_command('export_orders', 'salesorders', stdout=six.StringIO(), stderr=six.StringIO(), **option)
+
+
+@override_settings(QUERY_INSTRUMENTATION=True)
+class QueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(name='Customer')
+        self.supplier = Supplier.objects.create(name='Supplier')
+        self.item = Inventory.objects.create(item_name='Item', item_sku='SKU')
+        self.order = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        for i in range(2):
+            SalesOrderItem.objects.create(
+                sales_order=self.order, item=Inventory.objects.create(item_name='Line %d' % i, item_sku='L%d' % i),
+                quantity_ordered=1, unit_price=Decimal('10.00')
+            )
+        SalesOrderPayment.objects.create(sales_order=self.order, amount_paid=Decimal('5.00'), date_paid=now())
+        self.supply_order = SupplyOrder.objects.create(supplier=self.supplier, order_date=now())
+        SupplyOrderItem.objects.create(
+            supply_order=self.supply_order, item=self.item, quantity_ordered=3, unit_price=Decimal('4.00')
+        )
+
+    def test_read_views_stay_within_their_budget(self):
+        urls = [
+            reverse('core:index'), reverse('core:dashboard_json'), reverse('core:reports'),
+            reverse('core:customer_list'), reverse('core:customer', args=[self.customer.pk]),
+            reverse('core:supplier_list'), reverse('core:supplier', args=[self.supplier.pk]),
+            reverse('core:inventory'), reverse('core:item', args=[self.item.pk]), reverse('core:reorder'),
+            reverse('core:salesorder_list'), reverse('core:supplyorder_list'),
+            reverse('core:salesorder', args=[self.order.pk]),
+            reverse('core:supplyorder', args=[self.supply_order.pk]),
+            reverse('core:salesorder_list') + '?customer=%d' % self.customer.pk,
+            reverse('core:salespayment_list') + '?customer=%d' % self.customer.pk,
+            reverse('core:supplypayment_list') + '?supplier=%d' % self.supplier.pk,
+            reverse('core:customer_list') + '?search=cust',
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertWithinBudget(response)
+
+    def test_order_detail_reuses_prefetched_lines(self):
+        for line in self.order.salesorderitem_set.all():
+            SalesOrderItemDelivery.objects.create(item=line, quantity_delivered=1, delivery_date=now())
+        with self.assertNumQueries(3):
+            order = SalesOrder.objects.with_lines().get(pk=self.order.pk)
+            lines = [(line.item.item_name, line.quantity_delivered, line.last_delivery_date is not None)
+                     for line in order.salesorderitem_set.all()]
+            self.assertTrue(order.is_delivery_complete)
+            self.assertEqual(len(order.salesorderpayment_set.all()), 1)
+        self.assertEqual(lines, [('Line 0', 1, True), ('Line 1', 1, True)])
+
+    def test_summary_groups_requests_by_url_name(self):
+        summary.reset()
+        self.client.get(reverse('core:customer_list'))
+        self.client.get(reverse('core:customer_list'))
+        data = self.client.get(reverse('core:instrumentation')).json()
+        self.assertEqual(data['core:customer_list']['requests'], 2)
+        self.assertEqual(data['core:customer_list']['budget'], 3)
+
+    def test_nothing_is_recorded_unless_enabled(self):
+        summary.reset()
+        with override_settings(QUERY_INSTRUMENTATION=False):
+            response = self.client.get(reverse('core:customer_list'))
+        self.assertFalse(hasattr(response, 'query_stats'))
+        self.assertEqual(summary.as_dict(), {})
+
+    def test_fingerprint_ignores_literal_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM core_t1 WHERE id = 12 AND name = 'a''b' AND pk IN (1, 2, 3)"),
+            fingerprint("SELECT * FROM core_t1 WHERE id = 7 AND name = 'c' AND pk IN (4, 5)"),
+        )
+
+
+@override_settings(QUERY_INSTRUMENTATION=True)
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        summary.reset()
+        self.customer = Customer.objects.create(name='Cached Customer')
+        self.order = SalesOrder.objects.create(customer=self.customer, order_date=now())
+        SalesOrderItem.objects.create(
+            sales_order=self.order, item=Inventory.objects.create(item_name='Item', item_sku='SKU'),
+            quantity_ordered=2, unit_price=Decimal('10.00')
+        )
+        self.url = reverse('core:salesorder', args=[self.order.pk])
+
+    def test_unchanged_page_is_served_without_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Cached Customer')
+        stats = self.client.get(reverse('core:instrumentation')).json()['core:salesorder']
+        self.assertEqual((stats['cache_hits'], stats['cache_misses'], stats['cache_hit_ratio']), (1, 1, 0.5))
+
+    def test_edits_show_at_once(self):
+        self.client.get(self.url)
+        SalesOrderPayment.objects.create(sales_order=self.order, amount_paid=Decimal('7.25'), date_paid=now())
+        self.assertContains(self.client.get(self.url), '7.25')
+        self.customer.name = 'Renamed Customer'
+        self.customer.save()
+        self.assertContains(self.client.get(self.url), 'Renamed Customer')
+        self.assertContains(self.client.get(reverse('core:customer_list')), 'Renamed Customer')
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.customer = Customer.objects.create(name='Customer')
+        self.supplier = Supplier.objects.create(name='Supplier')
+        self.item = Inventory.objects.create(item_name='Item', item_sku='SKU')
+
+    def add_orders(self, count):
+        for i in range(count):
+            order = SalesOrder.objects.create(customer=self.customer, order_date=now())
+            line = SalesOrderItem.objects.create(
+                sales_order=order, item=self.item, quantity_ordered=1, unit_price=Decimal('1.00')
+            )
+            SalesOrderItemDelivery.objects.create(item=line, quantity_delivered=1, delivery_date=now())
+            supply_order = SupplyOrder.objects.create(supplier=self.supplier, order_date=now())
+            SupplyOrderItem.objects.create(
+                supply_order=supply_order, item=self.item, quantity_ordered=1, unit_price=Decimal('1.00')
+            )
+
+    def test_queries_do_not_grow_with_rows(self):
+        urls = [reverse('admin:core_%s_changelist' % name) for name in (
+            'salesorder', 'supplyorder', 'salesorderitemdelivery', 'inventory', 'customer'
+        )]
+        counts = []
+        for added in (1, 4):
+            self.add_orders(added)
+            with CaptureQueriesContext(connection) as queries:
+                for url in urls:
+                    self.assertEqual(self.client.get(url).status_code, 200, url)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_search_matches_order_code(self):
+        self.add_orders(2)
+        order = SalesOrder.objects.order_by('pk').last()
+        response = self.client.get(reverse('admin:core_salesorder_changelist'), {'q': str(order.order_code)})
+        self.assertEqual([o.pk for o in response.context['cl'].result_list], [order.pk])
+
+    def test_search_keeps_the_chosen_ordering(self):
+        for name in ('Bolt', 'Bolt Cutter', 'Anchor Bolt'):
+            Inventory.objects.create(item_name=name, item_sku='SKU-%s' % name)
+        url = reverse('admin:core_inventory_changelist')
+        names = ['Anchor Bolt', 'Bolt', 'Bolt Cutter']
+        for order, names in (('1', names), ('-1', names[::-1])):
+            response = self.client.get(url, {'q': 'bolt', 'o': order})
+            self.assertEqual([i.item_name for i in response.context['cl'].result_list], names)
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name in ('Bolt', 'Bracket', 'Cable'):
+            Inventory.objects.create(item_name=name, item_sku='SKU-%s' % name)
+        self.url = reverse('core:autocomplete', args=['items'])
+
+    def test_lookup_matches_prefix_and_is_cached(self):
+        response = self.client.get(self.url, {'term': 'b'})
+        self.assertEqual([r['text'] for r in response.json()['results']], ['Bolt', 'Bracket'])
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'term': 'b'})
+        self.assertEqual(self.client.get(reverse('core:autocomplete', args=['orders'])).status_code, 404)
+
+    def test_order_form_renders_only_chosen_rows(self):
+        customer = Customer.objects.create(name='Chosen Customer')
+        order = SalesOrder.objects.create(customer=customer, order_date=now())
+        SalesOrderItem.objects.create(
+            sales_order=order, item=Inventory.objects.get(item_name='Cable'), quantity_ordered=1,
+            unit_price=Decimal('1.00')
+        )
+        Customer.objects.create(name='Other Customer')
+        response = self.client.get(reverse('core:salesorder_edit', args=[order.pk]))
+        self.assertContains(response, 'Chosen Customer')
+        self.assertContains(response, 'Cable')
+        self.assertNotContains(response, 'Other Customer')
+        self.assertNotContains(response, 'Bracket')
+
+
+class BenchmarkTest(TestCase):
+    def generate(self):
+        generate_dataset(customers=4, suppliers=2, items=6, orders=5, lines=3, deliveries=2, payments=2)
+
+    def test_generated_dataset_is_consistent(self):
+        self.generate()
+        self.assertEqual(SalesOrder.objects.count(), 5)
+        self.assertEqual(SupplyOrder.objects.count(), 5)
+        self.assertEqual(SalesOrderItem.objects.count(), 15)
+        self.assertFalse(SalesOrderItem.objects.filter(is_delivered=False).exists())
+        orders = SalesOrder.objects.values('order_value', 'total_paid')
+        self.assertEqual(
+            sum(o['order_value'] - o['total_paid'] for o in orders),
+            sum(c.total_due for c in Customer.objects.all())
+        )
+        self.assertEqual(
+            sum(r.sales for r in CustomerDailyRollup.objects.all()), sum(o['order_value'] for o in orders)
+        )
+        self.assertEqual(StockMovement.objects.open_balances(), 0)
+
+    def test_generator_is_deterministic(self):
+        self.generate()
+        first = list(SalesOrderItem.objects.order_by('pk').values_list('quantity_ordered', 'unit_price'))
+        SalesOrder.objects.all().delete()
+        self.generate()
+        second = list(SalesOrderItem.objects.order_by('pk').values_list('quantity_ordered', 'unit_price'))
+        self.assertEqual(first, second)
+
+    def test_scenarios_run(self):
+        self.generate()
+        results = scenarios.run(repeat=1)
+        self.assertTrue(all(result['median_ms'] >= 0 for result in results))
+        self.assertIn('save', set(result['group'] for result in results))
+
+    def test_percentile_is_nearest_rank(self):
+        timings = list(range(1, 101))
+        self.assertEqual(percentile(timings, 0.50), 51)
+        self.assertEqual(percentile(timings, 0.99), 100)
+        self.assertEqual(percentile([7], 0.95), 7)
+        self.assertIsNone(percentile([], 0.5))
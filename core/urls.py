@@ -4,6 +4,8 @@ from . import views
 app_name = 'core'
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^dashboard\.json$', views.dashboard_json, name='dashboard_json'),
+    url(r'^instrumentation\.json$', views.instrumentation_summary, name='instrumentation'),
     url(r'^customers/(?P<page>[0-9]+)?$', views.CustomerListView.as_view(), name='customer_list'),
     url(r'^customers/id/(?P<pk>[0-9]+)?$', views.CustomerDetailView.as_view(), name='customer'),
     url(r'^customers/add/$', views.CustomerCreateView.as_view(), name='customer_add'),
@@ -23,15 +25,23 @@ urlpatterns = [
     url(r'^salesorders/item/id/(?P<pk>[0-9]+)/update$', views.SalesOrderItemUpdateView.as_view(), name='salesorderitem_edit'),
     url(r'^salesorders/item/id/(?P<pk>[0-9]+)/delete$', views.SalesOrderItemDeleteView.as_view(), name='salesorderitem_delete'),
     url(r'^salesorders/item/id/(?P<pk>[0-9]+)/delivery/add$', views.SalesOrderDeliveryCreateView.as_view(), name='salesorderdelivery_add'),
+    url(r'^salesorders/id/(?P<pk>[0-9]+)/delivery/add$', views.SalesOrderBatchDeliveryView.as_view(), name='salesorderdelivery_batch'),
     url(r'^salesorders/id/(?P<pk>[0-9]+)/payment/add$', views.SalesOrderPaymentCreateView.as_view(), name='salesorderpayment_add'),
     url(r'^salesorders/payment/id/(?P<pk>[0-9]+)/update$', views.SalesOrderPaymentUpdateView.as_view(), name='salesorderpayment_edit'),
+    url(r'^salesorders/payments/(?P<page>[0-9]+)?$', views.SalesOrderPaymentListView.as_view(), name='salespayment_list'),
     url(r'^salesorders/payment/id/(?P<pk>[0-9]+)/delete$', views.SalesOrderPaymentDeleteView.as_view(), name='salesorderpayment_delete'),
-    url(r'^supplyorders/(?P<page>[0-9]+)?$', views.SupplierListView.as_view(), name='supplyorder_list'),
-    url(r'^supplyorders/id/(?P<pk>[0-9]+)?$', views.SupplierDetailView.as_view(), name='supplyorder'),
+    url(r'^supplyorders/(?P<page>[0-9]+)?$', views.SupplyOrderListView.as_view(), name='supplyorder_list'),
+    url(r'^supplyorders/id/(?P<pk>[0-9]+)?$', views.SupplyOrderDetailView.as_view(), name='supplyorder'),
+    url(r'^supplyorders/id/(?P<pk>[0-9]+)/draft$', views.SupplyOrderDraftView.as_view(), name='supplyorder_draft'),
+    url(r'^supplyorders/payments/(?P<page>[0-9]+)?$', views.SupplyOrderPaymentListView.as_view(), name='supplypayment_list'),
     url(r'^inventory/(?P<page>[0-9]+)?$', views.InventoryListView.as_view(), name='inventory'),
     url(r'^inventory/id/(?P<pk>[0-9]+)?$', views.InventoryDetailView.as_view(), name='item'),
     url(r'^inventory/add/$', views.InventoryCreateView.as_view(), name='inventory_add'),
+    url(r'^inventory/reorder/$', views.ReorderView.as_view(), name='reorder'),
     url(r'^inventory/id/(?P<pk>[0-9]+)/update$', views.InventoryUpdateView.as_view(), name='inventory_edit'),
     url(r'^inventory/id/(?P<pk>[0-9]+)/delete$', views.InventoryDeleteView.as_view(), name='inventory_delete'),
     url(r'^inventory/id/image/add/(?P<pk>[0-9]+)$', views.ImageCreateView.as_view(), name='item_image_add'),
+    url(r'^reports/$', views.ReportView.as_view(), name='reports'),
+    url(r'^exports/(?P<name>[a-z]+)$', views.export, name='export'),
+    url(r'^autocomplete/(?P<name>[a-z]+)$', views.autocomplete, name='autocomplete'),
 ]
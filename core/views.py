@@ -1,76 +1,120 @@
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
+from django.views.generic import (
+    ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView, FormView, View
+)
+from django.http import JsonResponse, StreamingHttpResponse, Http404, HttpResponseBadRequest
 from django.conf import settings
-from django.shortcuts import render, render_to_response
+from django.shortcuts import render, get_object_or_404, redirect
 from django.core.urlresolvers import reverse_lazy, reverse
 from django.template import RequestContext
-from django.db.models import Avg, Sum, Max, Min, Count, F, Q
+from django.db.models import Avg, Sum, Max, Min, Count
 from .models import (
     Customer, Supplier, SalesOrder, SupplyOrder, SalesOrderPayment,
     SupplyOrderPayment, SalesOrderItem, SupplyOrderItem, Inventory,
-    ItemImage, SalesOrderItemDelivery
+    ItemImage, SalesOrderItemDelivery, CustomerDailyRollup, SupplierDailyRollup, ItemDailyRollup,
+    InsufficientStock
+)
+from .forms import (
+    SalesOrderPaymentForm, SalesOrderForm, ItemDeliveryForm, ItemInline, ItemFormset, DeliveryFormset,
+    BatchDeliveryForm
 )
-from .forms import SalesOrderPaymentForm, SalesOrderForm, ItemDeliveryForm, ItemFormset, DeliveryFormset
-from .mixin import AjaxableResponseMixin
+from .instrumentation import query_budget, summary
+from .autocomplete import LOOKUPS, lookup
+from .mixin import AjaxableResponseMixin, CounterpartyFilterMixin
+from .pagecache import CachedPageMixin
+from .pagination import KeysetPaginationMixin
+from .dashboard import get_dashboard
+from .exports import EXPORTS, FORMATS, day_bounds, export_rows, parse_day, stream
+from .reorder import create_draft_orders
+from .search import search
+from .signals import coalesced_recomputation
+
+# Order list columns that may be sorted on, each backed by an index
+ORDER_SORT_FIELDS = ('order_code', 'order_date', 'order_value', 'amount_due')
+
+
+@query_budget(8)
+def index(request):
+    return render(request, 'core/index.html', get_dashboard())
 
 
-def index(request):
-    total_customers = Customer.objects.count()
-    total_suppliers = Supplier.objects.count()
-    total_sales_orders = SalesOrder.objects.count()
-    total_supply_orders = SupplyOrder.objects.count()
-    revenue = SalesOrderPayment.objects.aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0
-    credit = Customer.objects.aggregate(Sum('total_due'))['total_due__sum'] or 0
-    expenditure = SupplyOrderPayment.objects.aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0
-    debit = 0
-    del_orders = SalesOrder.objects.filter(order_status='pending_deliveries').count()
-    unpaid_sales = SalesOrder.objects.exclude(payment_status='paid')
-    total_unpaid_sales = unpaid_sales.count()
-    unpaying_customers = unpaid_sales.distinct('customer').count()
-    unpaid_purchase = SupplyOrder.objects.exclude(payment_status='paid')
-    total_unpaid_purchases = unpaid_purchase.count()
-    unpaid_suppliers = unpaid_purchase.distinct('supplier').count()
-    low_items = Inventory.objects.filter(quantity__lte=F('min_threshold')).count()
-    data = {
-        'total_sales_orders': total_sales_orders, 'revenue': revenue,
-        'expenditure': expenditure, 'total_supply_orders': total_supply_orders,
-        'credit': credit, 'debit': debit, 'total_customers': total_customers,
-        'total_suppliers': total_suppliers, 'del_orders': del_orders,
-        'low_items': low_items, 'total_unpaid_sales': total_unpaid_sales,
-        'unpaying_customers': unpaying_customers,
-        'total_unpaid_purchases': total_unpaid_purchases,
-        'unpaid_suppliers': unpaid_suppliers,
-    }
-    return render_to_response('core/index.html', data)
-
-
-class CustomerListView(ListView):
+@query_budget(8)
+def dashboard_json(request):
+    """The dashboard snapshot for the wallboard."""
+    return JsonResponse(get_dashboard())
+
+
+@query_budget(0)
+def instrumentation_summary(request):
+    """Query counts and timings recorded by this process, by URL name."""
+    return JsonResponse(summary.as_dict())
+
+
+@query_budget(1)
+def autocomplete(request, name):
+    """Rows of a lookup in ``core.autocomplete`` starting with ?term=, for the order forms."""
+    if name not in LOOKUPS:
+        raise Http404('Unknown lookup')
+    return JsonResponse({'results': lookup(name, request.GET.get('term'))})
+
+
+@query_budget(1)
+def export(request, name):
+    """Stream an export as CSV or JSON lines, filtered by ?start=, ?end= and status."""
+    export_format = request.GET.get('format', 'csv')
+    if name not in EXPORTS or export_format not in FORMATS:
+        raise Http404('Unknown export')
+    try:
+        start, end = day_bounds(parse_day(request.GET.get('start')), parse_day(request.GET.get('end')))
+    except ValueError:
+        return HttpResponseBadRequest('start and end must be dates as YYYY-MM-DD')
+    statuses = dict(
+        (field, request.GET[field]) for field in EXPORTS[name].status_fields if request.GET.get(field)
+    )
+    rows = export_rows(name, start, end, **statuses)
+    response = StreamingHttpResponse(stream(name, rows, export_format), content_type=FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (name, export_format)
+    return response
+
+
+class CustomerListView(CachedPageMixin, KeysetPaginationMixin, ListView):
     model = Customer
     template_name = 'core/customer_list.html'
     context_object_name = 'customers'
     paginate_by = settings.PAGE_SIZE
+    keyset_ordering = 'name'
+    query_budget = 3
+    page_scopes = ('customer',)
 
     def get_queryset(self):
-        search = self.request.GET.get('search', None)
-        if search:
-            queryset = self.model.objects.filter(
-                Q(name__icontains=search) | Q(email__icontains=search) |
-                Q(contact_phone__icontains=search)
-            )
-        else:
-            queryset = self.model.objects.all()
-        return queryset
+        return search(self.model.objects.all(), self.request.GET.get('search'))
 
 
-class CustomerDetailView(DetailView):
+class CustomerDetailView(CachedPageMixin, DetailView):
     model = Customer
     template_name = 'core/customer.html'
     context_object_name = 'customer'
+    query_budget = 3
+    page_scopes = ('salesorder',)
+    page_object_scope = 'customer'
+    history_size = 10  # Latest orders and payments shown; the rest are on the filtered lists
+
+    def get_queryset(self):
+        return self.model.objects.with_order_count()
+
+    def get_context_data(self, **kwargs):
+        context = super(CustomerDetailView, self).get_context_data(**kwargs)
+        context['orders'] = context['object'].salesorder_set.order_by('-order_date', '-pk')[:self.history_size]
+        context['payments'] = SalesOrderPayment.objects.filter(
+            sales_order__customer=context['object']
+        ).select_related('sales_order').order_by('-date_paid', '-pk')[:self.history_size]
+        return context
 
 
 class CustomerCreateView(AjaxableResponseMixin, CreateView):
     model = Customer
     fields = ['name', 'email', 'contact_phone']
     template_name = 'core/form.html'
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(CustomerCreateView, self).get_context_data(**kwargs)
@@ -82,6 +126,7 @@ class CustomerUpdateView(AjaxableResponseMixin, UpdateView):
     model = Customer
     fields = ['name', 'email', 'contact_phone']
     template_name = 'core/form.html'
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(CustomerUpdateView, self).get_context_data(**kwargs)
@@ -93,6 +138,7 @@ class CustomerDeleteView(AjaxableResponseMixin, DeleteView):
     model = Customer
     template_name = 'core/confirm_delete.html'
     success_url = reverse_lazy('core:customer_list')
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(CustomerDeleteView, self).get_context_data(**kwargs)
@@ -100,35 +146,45 @@ class CustomerDeleteView(AjaxableResponseMixin, DeleteView):
         return context
 
 
-class SupplierListView(ListView):
+class SupplierListView(CachedPageMixin, KeysetPaginationMixin, ListView):
     model = Supplier
     template_name = 'core/supplier_list.html'
     context_object_name = 'suppliers'
     paginate_by = settings.PAGE_SIZE
+    keyset_ordering = 'name'
+    query_budget = 3
+    page_scopes = ('supplier',)
 
     def get_queryset(self):
-        search = self.request.GET.get('search', None)
-        if search:
-            queryset = self.model.objects.filter(
-                Q(username__icontains=search) | Q(surname__icontains=search) |
-                Q(other_names__icontains=search) | Q(email__icontains=search) |
-                Q(contact_phone__icontains=search)
-            )
-        else:
-            queryset = self.model.objects.all()
-        return queryset
+        return search(self.model.objects.all(), self.request.GET.get('search'))
 
 
-class SupplierDetailView(DetailView):
+class SupplierDetailView(CachedPageMixin, DetailView):
     model = Supplier
     template_name = 'core/supplier.html'
     context_object_name = 'supplier'
+    query_budget = 3
+    page_scopes = ('supplyorder',)
+    page_object_scope = 'supplier'
+    history_size = 10  # Latest orders and payments shown; the rest are on the filtered lists
+
+    def get_queryset(self):
+        return self.model.objects.with_order_count()
+
+    def get_context_data(self, **kwargs):
+        context = super(SupplierDetailView, self).get_context_data(**kwargs)
+        context['orders'] = context['object'].supplyorder_set.order_by('-order_date', '-pk')[:self.history_size]
+        context['payments'] = SupplyOrderPayment.objects.filter(
+            supply_order__supplier=context['object']
+        ).select_related('supply_order').order_by('-date_paid', '-pk')[:self.history_size]
+        return context
 
 
 class SupplierCreateView(AjaxableResponseMixin, CreateView):
     model = Supplier
     fields = ['name', 'email', 'contact_phone']
     template_name = 'core/form.html'
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(SupplierCreateView, self).get_context_data(**kwargs)
@@ -140,6 +196,7 @@ class SupplierUpdateView(AjaxableResponseMixin, UpdateView):
     model = Supplier
     fields = ['name', 'email', 'contact_phone']
     template_name = 'core/form.html'
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(SupplierUpdateView, self).get_context_data(**kwargs)
@@ -151,6 +208,7 @@ class SupplierDeleteView(AjaxableResponseMixin, DeleteView):
     model = Supplier
     template_name = 'core/confirm_delete.html'
     success_url = reverse_lazy('core:supplier_list')
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(SupplierDeleteView, self).get_context_data(**kwargs)
@@ -158,34 +216,51 @@ class SupplierDeleteView(AjaxableResponseMixin, DeleteView):
         return context
 
 
-class SalesOrderListView(ListView):
+class SalesOrderListView(CachedPageMixin, CounterpartyFilterMixin, KeysetPaginationMixin, ListView):
     model = SalesOrder
     template_name = 'core/salesorder_list.html'
     context_object_name = 'salesorder'
     paginate_by = settings.PAGE_SIZE
+    keyset_ordering = '-order_date'
+    query_budget = 3
+    page_scopes = ('salesorder', 'customer')
+    counterparty_model = Customer
+    counterparty_lookup = 'customer'
 
     def get_queryset(self):
-        search = self.request.GET.get('search', None)
-        if search:
-            queryset = self.model.objects.filter(
-                Q(username__icontains=search) | Q(surname__icontains=search) |
-                Q(other_names__icontains=search) | Q(email__icontains=search) |
-                Q(contact_phone__icontains=search)
-            )
-        else:
-            queryset = self.model.objects.all()
-        return queryset
+        queryset = self.filter_counterparty(search(self.model.objects.all(), self.request.GET.get('search')))
+        ordering = self.get_ordering()
+        if ordering:
+            queryset = queryset.order_by(ordering, 'pk')
+        return queryset.with_totals()
+
+    def get_ordering(self):
+        sort = self.request.GET.get('sort', None)
+        if sort and sort.lstrip('-') in ORDER_SORT_FIELDS:
+            return sort
+        return None
 
+    def get_keyset_ordering(self):
+        ordering = super(SalesOrderListView, self).get_keyset_ordering()
+        return ordering and (self.get_ordering() or ordering)
 
-class SalesOrderDetailView(DetailView):
+
+class SalesOrderDetailView(CachedPageMixin, DetailView):
     model = SalesOrder
     template_name = 'core/salesorder.html'
     context_object_name = 'salesorder'
+    query_budget = 3
+    page_scopes = ('customer', 'inventory')
+    page_object_scope = 'salesorder'
+
+    def get_queryset(self):
+        return self.model.objects.with_lines()
 
 
 class SalesOrderCreateView(AjaxableResponseMixin, CreateView):
     form_class = SalesOrderForm
     template_name = 'core/form.html'
+    query_budget = 4
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderCreateView, self).get_context_data(**kwargs)
@@ -197,23 +272,26 @@ class SalesOrderCreateView(AjaxableResponseMixin, CreateView):
         return context
 
     def form_valid(self, form):
-        context = self.get_context_data()
-        if all([f.is_valid() for f in context['formsets']]):
-            self.object = form.save()
-            for formset in context['formsets']:
-                formset.instance = self.object
-                formset.save()
-        return super(SalesOrderCreateView, self).form_valid(form)
+        # Order totals and statuses are recomputed once for all the lines
+        with coalesced_recomputation():
+            context = self.get_context_data()
+            if all([f.is_valid() for f in context['formsets']]):
+                self.object = form.save()
+                for formset in context['formsets']:
+                    formset.instance = self.object
+                    formset.save()
+            return super(SalesOrderCreateView, self).form_valid(form)
 
 
 class SalesOrderUpdateView(AjaxableResponseMixin, UpdateView):
     form_class = SalesOrderForm
     model = SalesOrder
     template_name = 'core/form.html'
+    query_budget = 15
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderUpdateView, self).get_context_data(**kwargs)
-        context['page_title'] = "Edit Sales Order %s" % context['object'].order_code
+        context['page_title'] = "Edit Sales Order %s" % context['object'].display_code
         if self.request.POST:
             context['formsets'] = [ItemFormset(self.request.POST, instance=self.get_object())]
         else:
@@ -221,35 +299,39 @@ class SalesOrderUpdateView(AjaxableResponseMixin, UpdateView):
         return context
 
     def form_valid(self, form):
-        context = self.get_context_data()
-        if all([f.is_valid() for f in context['formsets']]):
-            self.object = form.save()
-            for formset in context['formsets']:
-                formset.instance = self.object
-                formset.save()
-        return super(SalesOrderUpdateView, self).form_valid(form)
+        # Order totals and statuses are recomputed once for all the lines
+        with coalesced_recomputation():
+            context = self.get_context_data()
+            if all([f.is_valid() for f in context['formsets']]):
+                self.object = form.save()
+                for formset in context['formsets']:
+                    formset.instance = self.object
+                    formset.save()
+            return super(SalesOrderUpdateView, self).form_valid(form)
 
 
 class SalesOrderDeleteView(AjaxableResponseMixin, DeleteView):
     model = SalesOrder
     template_name = 'core/confirm_delete.html'
     success_url = reverse_lazy('core:salesorder_list')
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderDeleteView, self).get_context_data(**kwargs)
-        context['page_title'] = "Sales Order %s" % context['object'].order_code
+        context['page_title'] = "Sales Order %s" % context['object'].display_code
         return context
 
 
 class SalesOrderItemCreateView(AjaxableResponseMixin, CreateView):
     model = SalesOrderItem
-    fields = ['item', 'quantity_ordered', 'currency', 'unit_price']
+    form_class = ItemInline
     template_name = 'core/form.html'
+    query_budget = 4
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderItemCreateView, self).get_context_data(**kwargs)
         sales_order = SalesOrder.objects.get(pk=self.kwargs['pk'])
-        context['page_title'] = "Sales Order %s: Add Item" % sales_order.order_code
+        context['page_title'] = "Sales Order %s: Add Item" % sales_order.display_code
         if self.request.POST:
             context['formsets'] = [DeliveryFormset(self.request.POST)]
         else:
@@ -257,25 +339,32 @@ class SalesOrderItemCreateView(AjaxableResponseMixin, CreateView):
         return context
 
     def form_valid(self, form):
-        sales_order = SalesOrder.objects.get(pk=self.kwargs['pk'])
-        form.instance.sales_order = sales_order
-        context = self.get_context_data()
-        if all([f.is_valid() for f in context['formsets']]):
-            self.object = form.save()
-            for formset in context['formsets']:
-                formset.instance = self.object
-                formset.save()
-        return super(SalesOrderItemCreateView, self).form_valid(form)
+        try:
+            # Order totals and statuses are recomputed once for the line and its deliveries
+            with coalesced_recomputation():
+                sales_order = SalesOrder.objects.get(pk=self.kwargs['pk'])
+                form.instance.sales_order = sales_order
+                context = self.get_context_data()
+                if all([f.is_valid() for f in context['formsets']]):
+                    self.object = form.save()
+                    for formset in context['formsets']:
+                        formset.instance = self.object
+                        formset.save()
+                return super(SalesOrderItemCreateView, self).form_valid(form)
+        except InsufficientStock:
+            form.add_error(None, 'There is not enough stock to deliver that quantity.')
+            return self.form_invalid(form)
 
 
 class SalesOrderItemUpdateView(AjaxableResponseMixin, UpdateView):
     model = SalesOrderItem
-    fields = ['item', 'quantity_ordered', 'currency', 'unit_price']
+    form_class = ItemInline
     template_name = 'core/form.html'
+    query_budget = 8
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderItemUpdateView, self).get_context_data(**kwargs)
-        context['page_title'] = "Sales Order %s: Edit Item" % context['object'].sales_order.order_code
+        context['page_title'] = "Sales Order %s: Edit Item" % context['object'].sales_order.display_code
         if self.request.POST:
             context['formsets'] = [DeliveryFormset(self.request.POST, instance=self.get_object())]
         else:
@@ -283,19 +372,26 @@ class SalesOrderItemUpdateView(AjaxableResponseMixin, UpdateView):
         return context
 
     def form_valid(self, form):
-        context = self.get_context_data()
-        form.instance.sales_order = context['object'].sales_order
-        if all([f.is_valid() for f in context['formsets']]):
-            self.object = form.save()
-            for formset in context['formsets']:
-                formset.instance = self.object
-                formset.save()
-        return super(SalesOrderItemUpdateView, self).form_valid(form)
+        try:
+            # Order totals and statuses are recomputed once for the line and its deliveries
+            with coalesced_recomputation():
+                context = self.get_context_data()
+                form.instance.sales_order = context['object'].sales_order
+                if all([f.is_valid() for f in context['formsets']]):
+                    self.object = form.save()
+                    for formset in context['formsets']:
+                        formset.instance = self.object
+                        formset.save()
+                return super(SalesOrderItemUpdateView, self).form_valid(form)
+        except InsufficientStock:
+            form.add_error(None, 'There is not enough stock to deliver that quantity.')
+            return self.form_invalid(form)
 
 
 class SalesOrderItemDeleteView(AjaxableResponseMixin, DeleteView):
     model = SalesOrderItem
     template_name = 'core/confirm_delete.html'
+    query_budget = 3
 
     def get_success_url(self):
         context = self.get_context_data()
@@ -310,29 +406,73 @@ class SalesOrderItemDeleteView(AjaxableResponseMixin, DeleteView):
 class SalesOrderDeliveryCreateView(AjaxableResponseMixin, CreateView):
     form_class = ItemDeliveryForm
     template_name = 'core/form.html'
+    query_budget = 4
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderDeliveryCreateView, self).get_context_data(**kwargs)
         item = SalesOrderItem.objects.get(pk=self.kwargs['pk'])
         context['page_title'] = "Sales Order %s: Add %s Delivery" % (
-            item.sales_order.order_code, item.item.item_name
+            item.sales_order.display_code, item.item.item_name
         )
         return context
 
     def form_valid(self, form):
         item = SalesOrderItem.objects.get(pk=self.kwargs['pk'])
         form.instance.item = item
-        return super(SalesOrderDeliveryCreateView, self).form_valid(form)
+        try:
+            return super(SalesOrderDeliveryCreateView, self).form_valid(form)
+        except InsufficientStock:
+            form.add_error('quantity_delivered', 'There is not enough %s in stock.' % item.item.item_name)
+            return self.form_invalid(form)
+
+
+class SalesOrderBatchDeliveryView(FormView):
+    """Record deliveries for all outstanding lines of an order in one submission."""
+    form_class = BatchDeliveryForm
+    template_name = 'core/form.html'
+    query_budget = 5
+
+    def dispatch(self, request, *args, **kwargs):
+        self.sales_order = get_object_or_404(SalesOrder, pk=kwargs['pk'])
+        return super(SalesOrderBatchDeliveryView, self).dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super(SalesOrderBatchDeliveryView, self).get_form_kwargs()
+        kwargs['sales_order'] = self.sales_order
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super(SalesOrderBatchDeliveryView, self).get_context_data(**kwargs)
+        context['page_title'] = "Sales Order %s: Record Deliveries" % self.sales_order.display_code
+        return context
+
+    def form_invalid(self, form):
+        if self.request.is_ajax():
+            return JsonResponse(form.errors, status=400)
+        return super(SalesOrderBatchDeliveryView, self).form_invalid(form)
+
+    def form_valid(self, form):
+        try:
+            deliveries = form.save()
+        except InsufficientStock as e:
+            for line in form.lines:
+                if line.item_id in e.items:
+                    form.add_error('item_%d' % line.pk, 'There is not enough %s in stock.' % line.item.item_name)
+            return self.form_invalid(form)
+        if self.request.is_ajax():
+            return JsonResponse({'pk': self.sales_order.pk, 'deliveries': deliveries})
+        return redirect(self.sales_order)
 
 
 class SalesOrderPaymentCreateView(AjaxableResponseMixin, CreateView):
     form_class = SalesOrderPaymentForm
     template_name = 'core/form.html'
+    query_budget = 4
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderPaymentCreateView, self).get_context_data(**kwargs)
         sales_order = SalesOrder.objects.get(pk=self.kwargs['pk'])
-        context['page_title'] = "Sales Order %s: Add Payment" % sales_order.order_code
+        context['page_title'] = "Sales Order %s: Add Payment" % sales_order.display_code
         return context
 
     def form_valid(self, form):
@@ -345,11 +485,12 @@ class SalesOrderPaymentUpdateView(AjaxableResponseMixin, UpdateView):
     model = SalesOrderPayment
     form_class = SalesOrderPaymentForm
     template_name = 'core/form.html'
+    query_budget = 4
 
     def get_context_data(self, **kwargs):
         context = super(SalesOrderPaymentUpdateView, self).get_context_data(**kwargs)
         sales_order = SalesOrder.objects.get(pk=self.kwargs['pk'])
-        context['page_title'] = "Sales Order %s: Edit Item" % sales_order.order_code
+        context['page_title'] = "Sales Order %s: Edit Item" % sales_order.display_code
         return context
 
     def form_valid(self, form):
@@ -361,6 +502,7 @@ class SalesOrderPaymentUpdateView(AjaxableResponseMixin, UpdateView):
 class SalesOrderPaymentDeleteView(AjaxableResponseMixin, DeleteView):
     model = SalesOrderPayment
     template_name = 'core/confirm_delete.html'
+    query_budget = 4
 
     def get_success_url(self):
         context = self.get_context_data()
@@ -372,33 +514,103 @@ class SalesOrderPaymentDeleteView(AjaxableResponseMixin, DeleteView):
         return context
 
 
-class InventoryListView(ListView):
+class SupplyOrderListView(CachedPageMixin, CounterpartyFilterMixin, KeysetPaginationMixin, ListView):
+    model = SupplyOrder
+    template_name = 'core/supplyorder_list.html'
+    context_object_name = 'supplyorder'
+    paginate_by = settings.PAGE_SIZE
+    keyset_ordering = '-order_date'
+    query_budget = 3
+    page_scopes = ('supplyorder', 'supplier')
+    counterparty_model = Supplier
+    counterparty_lookup = 'supplier'
+
+    def get_queryset(self):
+        queryset = self.filter_counterparty(search(self.model.objects.all(), self.request.GET.get('search')))
+        ordering = self.get_ordering()
+        if ordering:
+            queryset = queryset.order_by(ordering, 'pk')
+        return queryset.with_totals()
+
+    def get_ordering(self):
+        sort = self.request.GET.get('sort', None)
+        if sort and sort.lstrip('-') in ORDER_SORT_FIELDS:
+            return sort
+        return None
+
+    def get_keyset_ordering(self):
+        ordering = super(SupplyOrderListView, self).get_keyset_ordering()
+        return ordering and (self.get_ordering() or ordering)
+
+
+class SupplyOrderDetailView(CachedPageMixin, DetailView):
+    model = SupplyOrder
+    template_name = 'core/supplyorder.html'
+    context_object_name = 'supplyorder'
+    query_budget = 3
+    page_scopes = ('supplier', 'inventory')
+    page_object_scope = 'supplyorder'
+
+    def get_queryset(self):
+        return self.model.objects.with_lines()
+
+
+class SalesOrderPaymentListView(CachedPageMixin, CounterpartyFilterMixin, KeysetPaginationMixin, ListView):
+    model = SalesOrderPayment
+    template_name = 'core/salespayment_list.html'
+    context_object_name = 'payments'
+    paginate_by = settings.PAGE_SIZE
+    keyset_ordering = '-date_paid'
+    query_budget = 3
+    page_scopes = ('salesorder', 'customer')
+    counterparty_model = Customer
+    counterparty_lookup = 'sales_order__customer'
+
+    def get_queryset(self):
+        return self.filter_counterparty(self.model.objects.select_related('sales_order__customer'))
+
+
+class SupplyOrderPaymentListView(CachedPageMixin, CounterpartyFilterMixin, KeysetPaginationMixin, ListView):
+    model = SupplyOrderPayment
+    template_name = 'core/supplypayment_list.html'
+    context_object_name = 'payments'
+    paginate_by = settings.PAGE_SIZE
+    keyset_ordering = '-date_paid'
+    query_budget = 3
+    page_scopes = ('supplyorder', 'supplier')
+    counterparty_model = Supplier
+    counterparty_lookup = 'supply_order__supplier'
+
+    def get_queryset(self):
+        return self.filter_counterparty(self.model.objects.select_related('supply_order__supplier'))
+
+
+class InventoryListView(CachedPageMixin, KeysetPaginationMixin, ListView):
     model = Inventory
     template_name = 'core/inventory_list.html'
     context_object_name = 'inventory'
     paginate_by = settings.PAGE_SIZE
+    keyset_ordering = 'item_name'
+    query_budget = 3
+    page_scopes = ('inventory', 'stock')
 
     def get_queryset(self):
-        search = self.request.GET.get('search', None)
-        if search:
-            queryset = self.model.objects.filter(
-                Q(item_name__icontains=search) | Q(item_sku__icontains=search)
-            )
-        else:
-            queryset = self.model.objects.all()
-        return queryset
+        return search(self.model.objects.all(), self.request.GET.get('search'))
 
 
-class InventoryDetailView(DetailView):
+class InventoryDetailView(CachedPageMixin, DetailView):
     model = Inventory
     template_name = 'core/item.html'
     context_object_name = 'item'
+    query_budget = 5
+    page_object_scope = 'inventory'
 
 
 class InventoryCreateView(AjaxableResponseMixin, CreateView):
     model = Inventory
     fields = ['item_name', 'item_sku', 'description', 'currency', 'unit_price', 'quantity', 'min_threshold']
     template_name = 'core/form.html'
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(InventoryCreateView, self).get_context_data(**kwargs)
@@ -410,17 +622,26 @@ class InventoryUpdateView(AjaxableResponseMixin, UpdateView):
     model = Inventory
     fields = ['item_name', 'item_sku', 'description', 'currency', 'unit_price', 'quantity', 'min_threshold']
     template_name = 'core/form.html'
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(InventoryUpdateView, self).get_context_data(**kwargs)
         context['page_title'] = "Edit %s" % context['object'].item_name
         return context
 
+    def form_valid(self, form):
+        try:
+            return super(InventoryUpdateView, self).form_valid(form)
+        except InsufficientStock:
+            form.add_error('quantity', 'The stock of %s cannot go below zero.' % form.instance.item_name)
+            return self.form_invalid(form)
+
 
 class InventoryDeleteView(AjaxableResponseMixin, DeleteView):
     model = Inventory
     template_name = 'core/confirm_delete.html'
     success_url = reverse_lazy('core:inventory')
+    query_budget = 2
 
     def get_context_data(self, **kwargs):
         context = super(InventoryDeleteView, self).get_context_data(**kwargs)
@@ -432,6 +653,7 @@ class ImageCreateView(AjaxableResponseMixin, CreateView):
     model = ItemImage
     fields = ['image']
     template_name = 'core/form.html'
+    query_budget = 3
 
     def get_context_data(self, **kwargs):
         context = super(ImageCreateView, self).get_context_data(**kwargs)
@@ -443,3 +665,117 @@ class ImageCreateView(AjaxableResponseMixin, CreateView):
         item = Inventory.objects.get(pk=self.kwargs['pk'])
         form.instance.item = item
         return super(ImageCreateView, self).form_valid(form)
+
+
+class ReorderView(TemplateView):
+    """Items low on stock net of what is on order, raising draft supply orders for those selected."""
+    template_name = 'core/reorder.html'
+    query_budget = 4
+
+    def get_context_data(self, **kwargs):
+        context = super(ReorderView, self).get_context_data(**kwargs)
+        context['candidates'] = Inventory.objects.reorder_candidates()
+        context['drafts'] = SupplyOrder.objects.filter(is_draft=True).with_totals().order_by('order_date', 'pk')
+        return context
+
+    def post(self, request, *args, **kwargs):
+        orders = create_draft_orders([pk for pk in request.POST.getlist('item') if pk.isdigit()])
+        if request.is_ajax():
+            return JsonResponse({'orders': [order.pk for order in orders]})
+        return redirect('core:supplyorder_list')
+
+
+class SupplyOrderDraftView(View):
+    """Confirm a draft supply order, counting it in balances and reports from then on, or discard it."""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        order = get_object_or_404(SupplyOrder, pk=kwargs['pk'], is_draft=True)
+        action = request.POST.get('action')
+        if action == 'confirm':
+            order.is_draft = False
+            order.save()
+        elif action == 'discard':
+            order.delete()
+        else:
+            return HttpResponseBadRequest('action must be confirm or discard')
+        if request.is_ajax():
+            return JsonResponse({'pk': order.pk if action == 'confirm' else None})
+        return redirect('core:reorder')
+
+
+class ReportView(TemplateView):
+    """Financial figures read from the pre-aggregated daily rollups."""
+    template_name = 'core/report.html'
+    dimensions = ('day', 'customer', 'supplier', 'item')
+    query_budget = 4
+
+    def get_day(self, name):
+        try:
+            return parse_day(self.request.GET.get(name))
+        except ValueError:  # A bad bound leaves that end of the range open
+            return None
+
+    def get_context_data(self, **kwargs):
+        context = super(ReportView, self).get_context_data(**kwargs)
+        by = self.request.GET.get('by', 'day')
+        if by not in self.dimensions:
+            by = 'day'
+        start, end = self.get_day('start'), self.get_day('end')
+
+        def in_range(queryset):
+            if start:
+                queryset = queryset.filter(date__gte=start)
+            if end:
+                queryset = queryset.filter(date__lte=end)
+            return queryset.order_by()
+
+        if by == 'day':
+            rows = {}
+            customers = in_range(CustomerDailyRollup.objects.all()).values('date').annotate(
+                sales=Sum('sales'), revenue=Sum('revenue'))
+            suppliers = in_range(SupplierDailyRollup.objects.all()).values('date').annotate(
+                purchases=Sum('purchases'), expenditure=Sum('expenditure'))
+            for values in list(customers) + list(suppliers):
+                rows.setdefault(values['date'], {'sales': 0, 'revenue': 0, 'purchases': 0, 'expenditure': 0})
+                rows[values['date']].update((k, v) for k, v in values.items() if k != 'date')
+            columns = ['Date', 'Sales', 'Revenue', 'Receivables', 'Purchases', 'Expenditure', 'Payables']
+            rows = [
+                (day, r['sales'], r['revenue'], r['sales'] - r['revenue'],
+                 r['purchases'], r['expenditure'], r['purchases'] - r['expenditure'])
+                for day, r in sorted(rows.items())
+            ]
+        elif by == 'customer':
+            columns = ['Customer', 'Sales', 'Revenue', 'Receivables']
+            rows = [
+                (r['customer__name'], r['sales'], r['revenue'], r['sales'] - r['revenue'])
+                for r in in_range(CustomerDailyRollup.objects.all()).values(
+                    'customer_id', 'customer__name'
+                ).annotate(
+                    sales=Sum('sales'), revenue=Sum('revenue')
+                ).order_by('customer__name', 'customer_id')
+            ]
+        elif by == 'supplier':
+            columns = ['Supplier', 'Purchases', 'Expenditure', 'Payables']
+            rows = [
+                (r['supplier__name'], r['purchases'], r['expenditure'], r['purchases'] - r['expenditure'])
+                for r in in_range(SupplierDailyRollup.objects.all()).values(
+                    'supplier_id', 'supplier__name'
+                ).annotate(
+                    purchases=Sum('purchases'), expenditure=Sum('expenditure')
+                ).order_by('supplier__name', 'supplier_id')
+            ]
+        else:
+            columns = ['Item', 'Quantity Sold', 'Sales', 'Quantity Purchased', 'Purchases']
+            rows = [
+                (r['item__item_name'], r['quantity_sold'], r['sales'], r['quantity_purchased'], r['purchases'])
+                for r in in_range(ItemDailyRollup.objects.all()).values('item_id', 'item__item_name').annotate(
+                    quantity_sold=Sum('quantity_sold'), sales=Sum('sales'),
+                    quantity_purchased=Sum('quantity_purchased'), purchases=Sum('purchases')
+                ).order_by('item__item_name', 'item_id')
+            ]
+        context.update({
+            'by': by, 'dimensions': self.dimensions, 'start': start, 'end': end,
+            'columns': columns, 'rows': rows,
+        })
+        return context